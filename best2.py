@@ -1,5 +1,8 @@
 import sys
-from PyQt5.QtCore import Qt, QTimer
+import threading
+import time
+from collections import deque
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QMessageBox, QFileDialog, QMenu
 from PyQt5.QtGui import QImage, QPixmap, QClipboard
 import cv2
@@ -9,6 +12,7 @@ from ultralytics import YOLO
 class Worker:
     def __init__(self):
         self.model = None
+        self.lock = threading.Lock()  # 模型不是线程安全的，多个线程推理时需要加锁
 
     def load_model(self):
         model_path, _ = QFileDialog.getOpenFileName(None, "选择模型文件", "", "模型文件 (*.pt)")
@@ -18,10 +22,140 @@ class Worker:
         return False
 
     def detect_image(self, image):
-        results = self.model.predict(image)
+        with self.lock:
+            results = self.model.predict(image)
         return results
 
 
+class FrameQueue:
+    """有界帧队列：队列满时丢弃最旧的一帧（drop-oldest），生产者永远不会阻塞"""
+
+    def __init__(self, maxsize=2):
+        self.items = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0  # 被丢弃的帧数
+
+    def put(self, item):
+        """放入一帧，队列满了就挤掉最旧的一帧"""
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=0.1):
+        """取出最旧的一帧，超时返回 None"""
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.items:
+                return self.items.popleft()
+            return None
+
+    def close(self):
+        """生产者已结束，唤醒所有等待的消费者"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def is_drained(self):
+        """生产者已结束并且队列已取空"""
+        with self.condition:
+            return self.closed and not self.items
+
+
+class VideoPipeline(QObject):
+    """视频处理流水线：采集线程 -> 推理线程 -> 渲染线程，只把渲染好的图像通过信号交给界面线程"""
+    frame_ready = pyqtSignal(QImage, QImage, object)  # 原始帧、标注帧、检测结果
+    finished = pyqtSignal()  # 视频播放结束或摄像头断开
+
+    def __init__(self, worker, capture, interval=0, queue_size=2):
+        super().__init__()
+        self.worker = worker
+        self.capture = capture
+        self.interval = interval / 1000  # 采集间隔（秒），0 表示按设备速度读取（摄像头）
+        self.capture_queue = FrameQueue(queue_size)  # 采集 -> 推理
+        self.render_queue = FrameQueue(queue_size)  # 推理 -> 渲染
+        self.target_sizes = ((640, 480), (640, 480))  # 左右两个标签的显示尺寸
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.capture_loop, daemon=True),
+            threading.Thread(target=self.inference_loop, daemon=True),
+            threading.Thread(target=self.render_loop, daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """请求停止，不等待线程退出，界面不会被卡住"""
+        self.stop_event.set()
+        self.capture_queue.close()
+        self.render_queue.close()
+
+    def set_target_size(self, size1, size2):
+        """更新左右标签的显示尺寸，渲染线程会按新尺寸缩放"""
+        self.target_sizes = ((size1.width(), size1.height()), (size2.width(), size2.height()))
+
+    def capture_loop(self):
+        """采集线程：读取视频帧放入队列，视频文件按间隔节流，摄像头按设备速度读取"""
+        next_time = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.capture.read()
+                if not ret:
+                    break
+                self.capture_queue.put(frame)
+                if self.interval:
+                    next_time += self.interval
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        self.stop_event.wait(delay)
+                    else:
+                        next_time = time.perf_counter()
+        finally:
+            self.capture.release()
+            self.capture_queue.close()
+
+    def inference_loop(self):
+        """推理线程：检测并绘制标注帧"""
+        while not self.stop_event.is_set():
+            frame = self.capture_queue.get()
+            if frame is None:
+                if self.capture_queue.is_drained():
+                    break
+                continue
+            results = self.worker.detect_image(frame)  # 检测直接使用原始 BGR 帧
+            annotated_frame = results[0].plot()  # 获取标注后的帧（默认返回 BGR 格式）
+            self.render_queue.put((frame, annotated_frame, results))
+        self.render_queue.close()
+
+    def render_loop(self):
+        """渲染线程：把帧转换为缩放好的 QImage，通过信号交给界面线程"""
+        while not self.stop_event.is_set():
+            item = self.render_queue.get()
+            if item is None:
+                if self.render_queue.is_drained():
+                    if not self.stop_event.is_set():
+                        self.finished.emit()
+                    break
+                continue
+            frame, annotated_frame, results = item
+            size1, size2 = self.target_sizes
+            image1 = self.to_qimage(frame, size1)
+            image2 = self.to_qimage(annotated_frame, size2)
+            self.frame_ready.emit(image1, image2, results)
+
+    @staticmethod
+    def to_qimage(frame, size):
+        """BGR 帧转换为指定尺寸的 QImage（scaled 会生成新的图像，不再引用 numpy 内存）"""
+        height, width, channel = frame.shape
+        qimage = QImage(frame.data, width, height, 3 * width, QImage.Format_BGR888)
+        return qimage.scaled(size[0], size[1], Qt.KeepAspectRatio)
+
+
 class InteractiveLabel(QLabel):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -175,9 +309,7 @@ class MainWindow(QMainWindow):
 
         # 视频播放变量
         self.video_path = None
-        self.video_capture = None
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.video_play)
+        self.pipeline = None  # 当前的视频处理流水线
 
         # 当前图片数据
         self.original_image = None
@@ -205,43 +337,45 @@ class MainWindow(QMainWindow):
         file_name, _ = QFileDialog.getOpenFileName(self, "选择视频文件", "", "视频文件 (*.mp4 *.avi *.mov)")
         if file_name:
             self.video_path = file_name
-            self.video_capture = cv2.VideoCapture(self.video_path)
-            self.timer.start(60)  # 每 60 毫秒播放一帧
+            video_capture = cv2.VideoCapture(self.video_path)
+            fps = video_capture.get(cv2.CAP_PROP_FPS)
+            interval = 1000 / fps if 1 <= fps <= 240 else 60  # 按视频自身的帧率采集，读不到帧率时每 60 毫秒一帧
+            self.start_pipeline(video_capture, interval)
             self.stop_button.setEnabled(True)
 
-    def video_play(self):
-        """播放视频并检测"""
-        if self.video_capture is None or not self.video_capture.isOpened():
-            self.timer.stop()
+    def start_pipeline(self, capture, interval=0):
+        """启动视频处理流水线，采集、推理、渲染都在后台线程中进行"""
+        self.stop_pipeline()
+        self.original_image = None
+        self.annotated_image = None
+        self.pipeline = VideoPipeline(self.worker, capture, interval)
+        self.pipeline.set_target_size(self.label1.size(), self.label2.size())
+        self.pipeline.frame_ready.connect(self.video_play)
+        self.pipeline.finished.connect(self.video_finished)
+        self.pipeline.start()
+
+    def stop_pipeline(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+    def video_play(self, image1, image2, results):
+        """显示流水线渲染好的原始帧和检测帧"""
+        if self.sender() is not self.pipeline:
             return
+        self.current_results = results
+        self.label1.setPixmap(QPixmap.fromImage(image1))
+        self.label2.set_image(QPixmap.fromImage(image2))
 
-        ret, frame = self.video_capture.read()
-        if ret:
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if self.worker.model is not None:
-                results = self.worker.detect_image(frame_rgb)
-                annotated_frame = results[0].plot()
-                annotated_frame_rgb = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-
-                # 显示原始帧
-                height1, width1, channel1 = frame_rgb.shape
-                bytesPerLine1 = 3 * width1
-                qimage1 = QImage(frame_rgb.data, width1, height1, bytesPerLine1, QImage.Format_RGB888)
-                pixmap1 = QPixmap.fromImage(qimage1)
-                self.label1.setPixmap(pixmap1.scaled(self.label1.size(), Qt.KeepAspectRatio))
-
-                # 显示检测后的帧
-                height2, width2, channel2 = annotated_frame_rgb.shape
-                bytesPerLine2 = 3 * width2
-                qimage2 = QImage(annotated_frame_rgb.data, width2, height2, bytesPerLine2, QImage.Format_RGB888)
-                pixmap2 = QPixmap.fromImage(qimage2)
-                self.label2.set_image(pixmap2.scaled(self.label2.size(), Qt.KeepAspectRatio))
-        else:
-            self.video_capture.release()
-            self.timer.stop()
+    def video_finished(self):
+        """视频播放完毕"""
+        if self.sender() is self.pipeline:
+            self.pipeline = None
 
     def resizeEvent(self, event):
         """当窗口大小发生变化时，重新加载图片以防止图片变花"""
+        if self.pipeline is not None:
+            self.pipeline.set_target_size(self.label1.size(), self.label2.size())
         if self.original_image is not None and self.annotated_image is not None:
             self.show_images(self.original_image, self.annotated_image)
 # -------------------------------------------
@@ -314,15 +448,13 @@ class MainWindow(QMainWindow):
 # -------------------------------------------
     def stop_processing(self):
         """停止视频播放或其他处理"""
-        if self.timer.isActive():
-            self.timer.stop()
-        if self.video_capture is not None and self.video_capture.isOpened():
-            self.video_capture.release()
+        self.stop_pipeline()
         self.label1.clear()
         self.label2.clear()
         self.stop_button.setEnabled(False)
 
     def exit_application(self):
+        self.stop_pipeline()
         sys.exit()
 
 # -------------------------------------------
@@ -0,0 +1,74 @@
+"""批量检测时缓存命中的图片和新推理的图片都按显示过滤计数"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'yolo_app'))
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('ultralytics')
+from PyQt5.QtWidgets import QApplication, QInputDialog
+import main
+
+NAMES = {0: 'a', 1: 'b'}
+
+
+def raw_detections():
+    """原始结果：置信度 0.9、0.6 的两个框会显示，0.3、0.15 的两个框被 conf=0.5 的过滤掉"""
+    return main.Detections(np.array([[10, 10, 60, 60], [100, 10, 150, 60], [10, 100, 60, 150], [100, 100, 150, 150]], np.float32),
+                           np.array([0.9, 0.6, 0.3, 0.15], np.float32), np.array([0, 1, 1, 0], np.int32), NAMES)
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    app = QApplication.instance() or QApplication([])
+    window = main.MainWindow(data_dir=str(tmp_path / 'data'))
+    worker = window.worker
+    worker.model = SimpleNamespace(names=NAMES)
+    worker.model_hash = 'fake'
+    worker.annotator = main.FastAnnotator(NAMES)
+    inferred = []
+
+    def detect_batch(images, batch_size=8, **overrides):
+        inferred.extend(images)
+        return [raw_detections().to_results(image) for image in images]
+
+    worker.detect_batch = detect_batch
+    worker.detect_image = lambda image, **overrides: detect_batch([image])
+    window.prefetcher.close()
+    monkeypatch.setattr(QInputDialog, 'getInt', lambda *args: (4, True))
+    yield app, window, inferred
+    window.close()
+
+
+def test_batch_over_partly_cached_folder_counts_filtered_results(tmp_path, window):
+    app, window, inferred = window
+    paths = []
+    for index in range(10):
+        path = str(tmp_path / f'image_{index:02d}.jpg')
+        cv2.imwrite(path, np.full((160, 160, 3), index * 20, np.uint8))
+        paths.append(path)
+    window.worker.set_display_filter(main.DetectionFilter(conf=0.5))
+    for path in paths[::2]:  # 一半图片之前已经检测过
+        window.detection_cache.put(window.worker.cache_key(path), raw_detections())
+    window.open_image_set(paths)
+    inferred.clear()
+
+    window.start_batch()
+    deadline = time.perf_counter() + 30
+    while window.batch_processor is not None and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+
+    assert window.batch_processor is None
+    assert len(inferred) == len(paths) // 2  # 缓存命中的图片不重新推理
+    stats = window.image_stats
+    assert stats.frames == len(paths)
+    assert stats.totals.tolist() == [len(paths), len(paths)]  # 每张图片只计入 0.9 和 0.6 两个框
+    assert stats.series()[1].tolist() == [2] * len(paths)
+    assert window.thumbnail_model.counts[:len(paths)].tolist() == [2] * len(paths)
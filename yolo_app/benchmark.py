@@ -0,0 +1,375 @@
+"""无界面性能测试：在 Qt offscreen 平台上运行真实的 Worker 和 MainWindow 渲染代码
+
+测试图片和视频在临时目录中即时生成，不指定模型时用 yolov8n.yaml 生成随机权重的小模型（不需要下载）。
+随机权重的模型检测不到任何框，推理照常运行并计时，结果换成一组固定的合成检测框，绘制阶段测量的是真实的画框开销。
+分别测量看图、视频播放、批量检测三种模式下各阶段（解码 -> 推理 -> 绘制 -> 转换 -> 显示）的耗时分位数、
+帧率和内存峰值，结果写成 JSON，可以用 --compare 与之前提交的结果对比。
+
+用法：
+    python benchmark.py --output bench.json
+    python benchmark.py --model best.pt --modes video batch --output bench.json --compare old.json
+"""
+import sys, os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # 必须在创建 QApplication 之前设置
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
+from main import Detections, BatchProcessor, VideoPipeline, StageMetrics, MainWindow
+
+
+MODES = ('browse', 'video', 'batch')
+
+
+class StageTimer:
+    """记录每个阶段每次的耗时（毫秒），输出分位数"""
+
+    def __init__(self):
+        self.samples = {}  # 阶段 -> [耗时]
+
+    def add(self, stage, milliseconds):
+        self.samples.setdefault(stage, []).append(milliseconds)
+
+    def measure(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.add(stage, (time.perf_counter() - start) * 1000)
+        return result
+
+    def summary(self):
+        summary = {}
+        for stage, samples in self.samples.items():
+            values = np.array(samples)
+            summary[stage] = {
+                'count': len(values),
+                'mean_ms': round(float(values.mean()), 3),
+                'p50_ms': round(float(np.percentile(values, 50)), 3),
+                'p90_ms': round(float(np.percentile(values, 90)), 3),
+                'p99_ms': round(float(np.percentile(values, 99)), 3),
+                'max_ms': round(float(values.max()), 3),
+            }
+        return summary
+
+
+class MemorySampler:
+    """后台线程每 10 毫秒读取一次进程的常驻内存，记录测试期间的峰值
+    优先使用 psutil，没有安装时在 Linux 上读取 /proc/self/statm，都不可用时返回 None"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.read_rss = self.rss_reader()
+
+    @staticmethod
+    def rss_reader():
+        try:
+            import psutil
+            process = psutil.Process()
+            return lambda: process.memory_info().rss
+        except ImportError:
+            pass
+        if os.path.exists('/proc/self/statm'):
+            page_size = os.sysconf('SC_PAGE_SIZE')
+
+            def read_statm():
+                with open('/proc/self/statm') as f:
+                    return int(f.read().split()[1]) * page_size
+            return read_statm
+        return None
+
+    def __enter__(self):
+        if self.read_rss is not None:
+            self.peak = self.read_rss()
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.read_rss is not None:
+            self.stop_event.set()
+            self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.read_rss())
+
+    def peak_mb(self):
+        return round(self.peak / 1024 / 1024, 1) if self.read_rss is not None else None
+
+
+def synthetic_image(rng, width, height):
+    """渐变背景加随机矩形和圆，JPEG 压缩后的大小和解码耗时接近真实照片"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (x * 0.6 + y * 0.4).astype(np.uint8)
+    image[..., 1] = (255 - x * 0.5).astype(np.uint8)
+    image[..., 2] = (y * 0.8).astype(np.uint8)
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x1, y1 = int(rng.integers(0, width - 40)), int(rng.integers(0, height - 40))
+        x2, y2 = x1 + int(rng.integers(20, width // 3)), y1 + int(rng.integers(20, height // 3))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, -1)
+        else:
+            cv2.circle(image, (x1, y1), int(rng.integers(10, height // 6)), color, -1)
+    noise = rng.integers(0, 24, image.shape, dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+def make_images(directory, count, size, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"image_{index:04d}.jpg")
+        cv2.imwrite(path, synthetic_image(rng, *size))
+        paths.append(path)
+    return paths
+
+
+def make_video(path, frames, size, fps=30, seed=0):
+    """生成一段画面在移动的测试视频（mp4v 编码，OpenCV 自带，不需要额外的编码器）"""
+    rng = np.random.default_rng(seed)
+    background = synthetic_image(rng, size[0] * 2, size[1])
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for index in range(frames):
+        offset = index * 4 % size[0]
+        writer.write(np.ascontiguousarray(background[:, offset:offset + size[0]]))
+    writer.release()
+    return path
+
+
+def make_model(directory):
+    """用 yolov8n.yaml 生成随机权重的小模型，保存为 .pt 供 Worker.load_model 使用"""
+    from ultralytics import YOLO
+    path = os.path.join(directory, 'yolov8n-random.pt')
+    YOLO('yolov8n.yaml').save(path)
+    return path
+
+
+def synthetic_detections(names, size, count=20, seed=0):
+    """一组固定的合成检测框：随机位置和大小、置信度 0.3~0.95（默认的显示过滤不会滤掉），类别取自模型"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    x1 = rng.uniform(0, width * 0.8, count)
+    y1 = rng.uniform(0, height * 0.8, count)
+    w = rng.uniform(width * 0.05, width * 0.2, count)
+    h = rng.uniform(height * 0.05, height * 0.2, count)
+    xyxy = np.stack([x1, y1, np.minimum(x1 + w, width - 1), np.minimum(y1 + h, height - 1)], axis=1).astype(np.float32)
+    conf = rng.uniform(0.3, 0.95, count).astype(np.float32)
+    cls = rng.choice(np.array(sorted(names), dtype=np.int32), count)
+    return Detections(xyxy, conf, cls, names)
+
+
+def use_synthetic_boxes(worker, detections):
+    """随机权重的模型在任何置信度阈值下都检测不到框（最高置信度约 2e-4），绘制阶段只能测到空画；
+    模型推理照常运行，返回的结果换成固定的合成检测框"""
+    detect_image, detect_batch = worker.detect_image, worker.detect_batch
+    worker.detect_image = lambda image, **overrides: [detections.to_results(image) for _ in detect_image(image, **overrides)]
+    worker.detect_batch = lambda images, batch_size=8, **overrides: [
+        detections.to_results(image) for image, _ in zip(images, detect_batch(images, batch_size, **overrides))]
+
+
+def bench_browse(window, image_paths, timer):
+    """看图模式：逐阶段执行 show_current_image 的每一步（不使用缓存），最后按真实点击测量翻页耗时
+    返回不使用缓存时逐张看图（解码到显示）的每秒图片数"""
+    worker = window.worker
+    browse_start = time.perf_counter()
+    for path in image_paths:
+        image = timer.measure('decode', cv2.imread, path)
+        results = timer.measure('infer', worker.detect_image, image)
+        detections = timer.measure('extract', Detections.from_results, results[0])
+        annotated = timer.measure('plot', worker.annotate, image, detections)
+        start = time.perf_counter()
+        window.original_pixmap = window.to_pixmap(image)
+        window.annotated_pixmap = window.to_pixmap(annotated)
+        timer.add('convert', (time.perf_counter() - start) * 1000)
+        timer.measure('display', window.scale_images, Qt.SmoothTransformation)
+        QApplication.processEvents()
+    elapsed = time.perf_counter() - browse_start
+
+    # 翻页：包含预取，每次点击之间留出推理一张图片的时间，与用户浏览时的节奏相近
+    window.detection_cache.clear()
+    window.open_image_set(image_paths)
+    think_time = np.median(timer.samples['infer']) / 1000 * 1.5
+    for _ in image_paths[1:]:
+        time.sleep(think_time)
+        QApplication.processEvents()
+        timer.measure('next_click', window.show_next_image)
+    window.prefetcher.cancel()
+    return len(image_paths) / elapsed if elapsed > 0 else 0
+
+
+def bench_video(window, video_path, timer):
+    """视频模式：逐帧处理（不丢帧）运行真实的 VideoPipeline，各阶段耗时取自流水线随帧传递的耗时记录"""
+    app = QApplication.instance()
+    pipeline = VideoPipeline(window.worker, cv2.VideoCapture(video_path), live=False, realtime=False)
+    pipeline.set_target_size(window.label1.size(), window.label2.size())
+    window.pipeline = pipeline  # video_play 只处理当前流水线发出的帧
+    last_frame = [None]
+    frame_count = [0]
+
+    def on_frame(display1, display2, results, timings):
+        now = time.perf_counter()
+        if last_frame[0] is not None:
+            timer.add('frame_interval', (now - last_frame[0]) * 1000)
+        last_frame[0] = now
+        frame_count[0] += 1
+        # 直接调用 video_play 时 sender() 不是流水线，这里复现它的显示步骤
+        start = time.perf_counter()
+        window.current_results = results
+        pixmap1, pixmap2 = window.to_pixmap(display1), window.to_pixmap(display2)
+        pipeline.release_buffers(display1, display2)
+        display_start = time.perf_counter()
+        window.label1.setPixmap(pixmap1)
+        window.label2.set_image(pixmap2)
+        timings['convert'] = (display_start - start) * 1000
+        timings['display'] = (time.perf_counter() - display_start) * 1000
+        timings['latency'] = (time.perf_counter() - timings['captured']) * 1000
+        for stage in StageMetrics.STAGES:
+            if stage in timings:
+                timer.add(stage, timings[stage])
+
+    pipeline.frame_ready.connect(on_frame)
+    pipeline.finished.connect(app.quit)
+    start = time.perf_counter()
+    pipeline.start()
+    app.exec_()
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+    pipeline.wait()
+    window.pipeline = None
+    return frame_count[0] / elapsed if elapsed > 0 else 0
+
+
+def bench_batch(worker, image_paths, batch_size, timer):
+    """批量检测：同步运行 BatchProcessor，记录每批的耗时（折算到每张图片）"""
+    processor = BatchProcessor(worker, None, image_paths, batch_size=batch_size)
+    last = [time.perf_counter(), 0]  # 上一批完成的时间、已完成数量
+
+    def on_progress(done, total):
+        now = time.perf_counter()
+        timer.add('per_image', (now - last[0]) * 1000 / max(1, done - last[1]))
+        last[0], last[1] = now, done
+
+    processor.progress.connect(on_progress)
+    start = time.perf_counter()
+    processor.run()
+    elapsed = time.perf_counter() - start
+    return len(image_paths) / elapsed if elapsed > 0 else 0
+
+
+def environment():
+    """记录运行环境，不同机器上的结果不能直接比较"""
+    import torch
+    import ultralytics
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch.__version__,
+        'ultralytics': ultralytics.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def print_report(report, baseline=None):
+    """按模式打印各阶段耗时，指定 baseline 时显示 p50 的变化"""
+    for mode, result in report['modes'].items():
+        line = f"[{mode}]"
+        if result.get('fps') is not None:
+            line += f"  {result['fps']:.1f} FPS"
+        if result.get('peak_rss_mb') is not None:
+            line += f"  内存峰值 {result['peak_rss_mb']} MB"
+        print(line)
+        old_stages = (baseline or {}).get('modes', {}).get(mode, {}).get('stages', {})
+        for stage, stats in result['stages'].items():
+            text = f"  {stage:<15}p50 {stats['p50_ms']:9.2f} ms  p90 {stats['p90_ms']:9.2f} ms  p99 {stats['p99_ms']:9.2f} ms  n={stats['count']}"
+            old = old_stages.get(stage)
+            if old and old['p50_ms'] > 0:
+                text += f"  ({(stats['p50_ms'] / old['p50_ms'] - 1):+.0%})"
+            print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO 可视化工具性能测试")
+    parser.add_argument('--model', help="模型文件 (*.pt)，默认用 yolov8n.yaml 生成随机权重的小模型（检测不到框，绘制使用合成检测框）")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help="要测试的模式")
+    parser.add_argument('--images', type=int, default=20, help="生成的测试图片数量")
+    parser.add_argument('--frames', type=int, default=90, help="生成的测试视频帧数")
+    parser.add_argument('--size', default='1280x720', help="测试图片和视频的尺寸（宽x高）")
+    parser.add_argument('--batch-size', type=int, default=8, help="批量检测每批图片数量")
+    parser.add_argument('--conf', type=float, help="推理的置信度阈值，默认使用 ultralytics 的默认值")
+    parser.add_argument('--imgsz', type=int, help="推理尺寸")
+    parser.add_argument('--output', help="结果 JSON 文件")
+    parser.add_argument('--compare', help="之前的结果 JSON 文件，打印 p50 的变化")
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.lower().split('x'))
+
+    app = QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = args.model or make_model(directory)
+        image_paths = make_images(directory, args.images, size)
+        video_path = make_video(os.path.join(directory, 'video.mp4'), args.frames, size)
+
+        window = MainWindow(data_dir=os.path.join(directory, 'data'))  # 数据库和缩略图缓存写到临时目录
+        window.resize(1280, 800)
+        window.show()
+        window.detection_cache.store = None  # 翻页测量的是推理和显示，不包括数据库读写
+        worker = window.worker
+        worker.predict_params = {'verbose': False}
+        if args.conf is not None:
+            worker.predict_params['conf'] = args.conf
+        if args.imgsz:
+            worker.predict_params['imgsz'] = args.imgsz
+        worker.load_model(model_path)
+        if not args.model:
+            use_synthetic_boxes(worker, synthetic_detections(worker.model.names, size))
+        QApplication.processEvents()
+
+        report = {'environment': environment(), 'args': vars(args), 'load_ms': dict(worker.speed), 'modes': {}}
+        for mode in args.modes:
+            print(f"正在测试 {mode}…", file=sys.stderr)
+            timer = StageTimer()
+            with MemorySampler() as memory:
+                if mode == 'browse':
+                    fps = bench_browse(window, image_paths, timer)
+                elif mode == 'video':
+                    fps = bench_video(window, video_path, timer)
+                else:
+                    fps = bench_batch(worker, image_paths, args.batch_size, timer)
+            report['modes'][mode] = {
+                'fps': round(fps, 2) if fps is not None else None,
+                'peak_rss_mb': memory.peak_mb(),
+                'stages': timer.summary(),
+            }
+
+        window.close()  # 停止后台线程、关闭数据库，之后才能删除临时目录
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""无界面批量检测，适合没有显示器的服务器
+
+用法：
+    python headless.py --model best.pt --source 图片目录 --output result.jsonl --workers 4
+    python headless.py --model best.pt --source "data/**/*.jpg" --output result.csv
+    python headless.py --model best.pt --source video.mp4 --output result.jsonl --resume
+    python headless.py --model best.pt --source 图片目录 --output result.jsonl --backend openvino --int8
+    python headless.py --model best.pt --source 大图目录 --output result.jsonl --tile 1024
+"""
+import sys, os
+import argparse
+import csv
+import glob
+import json
+import time
+import multiprocessing as mp
+from queue import Empty
+import cv2
+from main import Worker, Detections, BatchProcessor, IMAGE_EXTENSIONS, iter_images
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+CSV_FIELDS = ['source', 'frame', 'class', 'name', 'conf', 'x1', 'y1', 'x2', 'y2']
+
+
+def list_images(source):
+    """列出目录（递归）或通配符匹配到的全部图片，按路径排序保证每次顺序一致"""
+    if os.path.isdir(source):
+        return list(iter_images(source))
+    return sorted(path for path in glob.glob(source, recursive=True) if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def to_record(source, frame, detections):
+    """把一张图片（或一帧）的检测结果转换为输出记录，frame 为 None 表示图片"""
+    return {
+        'source': source,
+        'frame': frame,
+        'detections': [
+            {
+                'class': int(class_id),
+                'name': detections.names[int(class_id)],
+                'conf': round(float(conf), 4),
+                'box': [round(float(value), 1) for value in box],
+            }
+            for box, conf, class_id in zip(detections.xyxy, detections.conf, detections.cls)
+        ],
+    }
+
+
+class ResultWriter:
+    """把检测记录逐条写入 JSONL 或 CSV，每条都立即落盘，中断后可以续跑"""
+
+    def __init__(self, path, fmt, resume=False):
+        self.path = path
+        self.fmt = fmt
+        self.done = set()  # 已经写入的 (source, frame)
+        if resume and os.path.exists(path):
+            self.repair()
+            self.done = self.load_done()
+        new_file = not (resume and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self.csv_writer = csv.writer(self.file)
+            if new_file:
+                self.csv_writer.writerow(CSV_FIELDS)
+
+    def repair(self):
+        """上次中断时最后一行可能只写了一半，截断到最后一个完整的换行"""
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def load_done(self):
+        done = set()
+        with open(self.path, encoding='utf-8', newline='') as f:
+            if self.fmt == 'csv':
+                for row in csv.DictReader(f):
+                    done.add((row['source'], int(row['frame']) if row['frame'] else None))
+            else:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        done.add((record['source'], record['frame']))
+        return done
+
+    def write(self, record):
+        if self.fmt == 'csv':
+            frame = '' if record['frame'] is None else record['frame']
+            if not record['detections']:
+                # 没有检测到物体也写一行，续跑时才知道这张图片已经处理过
+                self.csv_writer.writerow([record['source'], frame, '', '', '', '', '', '', ''])
+            for det in record['detections']:
+                self.csv_writer.writerow([record['source'], frame, det['class'], det['name'], det['conf'], *det['box']])
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def detect_images(worker, image_paths, batch_size, queue):
+    """复用 BatchProcessor：线程池解码、按批推理，在当前线程同步运行"""
+    processor = BatchProcessor(worker, None, image_paths, batch_size=batch_size)
+    processor.result_ready.connect(lambda index, detections: queue.put(to_record(image_paths[index], None, detections)))
+    processor.run()
+
+
+def detect_video_frames(worker, video_path, frames, batch_size, queue):
+    """按顺序读取分到的帧，只有帧号不连续时才跳转"""
+    capture = cv2.VideoCapture(video_path)
+    position = 0
+    batch_frames, batch_images = [], []
+    try:
+        for frame_index in frames + [None]:
+            if frame_index is not None:
+                if frame_index != position:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                ret, image = capture.read()
+                position = frame_index + 1
+                if not ret:
+                    frame_index = None  # 视频提前结束（帧数统计不准确）
+                else:
+                    batch_frames.append(frame_index)
+                    batch_images.append(image)
+            if batch_images and (frame_index is None or len(batch_images) == batch_size):
+                results = worker.detect_batch(batch_images, batch_size)
+                for index, result in zip(batch_frames, results):
+                    queue.put(to_record(video_path, index, Detections.from_results(result)))
+                batch_frames, batch_images = [], []
+            if frame_index is None:
+                break
+    finally:
+        capture.release()
+
+
+def run_shard(model_path, backend, int8, predict_params, tile, source, items, is_video, batch_size, threads, queue):
+    """子进程：只加载一次模型，处理分到的图片或视频帧，把记录放入队列，结束时放入 None"""
+    try:
+        import torch
+        torch.set_num_threads(threads)  # 多个进程时平分 CPU 核心，避免线程过多互相抢占
+        worker = Worker()
+        worker.predict_params = predict_params
+        worker.tile_size, worker.tile_overlap = tile
+        worker.load_model(model_path, backend, int8)
+        if is_video:
+            detect_video_frames(worker, source, items, batch_size, queue)
+        else:
+            detect_images(worker, items, batch_size, queue)
+    finally:
+        queue.put(None)
+
+
+def split_shards(items, count, contiguous):
+    """图片交错分片保证负载均衡，视频帧按连续区间分片减少跳转"""
+    if not contiguous:
+        return [items[i::count] for i in range(count)]
+    size = (len(items) + count - 1) // count
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO 无界面批量检测")
+    parser.add_argument('--model', required=True, help="模型文件 (*.pt)")
+    parser.add_argument('--source', required=True, help="图片目录、通配符（如 \"data/**/*.jpg\"）或视频文件")
+    parser.add_argument('--output', required=True, help="输出文件 (*.jsonl / *.csv)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="输出格式，默认按输出文件后缀判断")
+    parser.add_argument('--workers', type=int, default=1, help="进程数，每个进程加载一次模型")
+    parser.add_argument('--batch-size', type=int, default=8, help="每批送入模型的图片数量")
+    parser.add_argument('--resume', action='store_true', help="跳过输出文件中已有的结果，继续上次中断的任务")
+    parser.add_argument('--conf', type=float, help="置信度阈值")
+    parser.add_argument('--iou', type=float, help="NMS 的 IoU 阈值")
+    parser.add_argument('--imgsz', type=int, help="推理尺寸")
+    parser.add_argument('--backend', choices=list(Worker.BACKENDS), default='pytorch', help="推理后端，首次使用时导出并缓存")
+    parser.add_argument('--int8', action='store_true', help="导出时做 INT8 量化（仅 onnx / openvino）")
+    parser.add_argument('--tile', type=int, help="切片大小，长边超过该值的大图切成小块分别检测后合并")
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help="相邻切片的重叠比例")
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    is_video = os.path.isfile(args.source) and args.source.lower().endswith(VIDEO_EXTENSIONS)
+    predict_params = {'verbose': False}
+    for name in ('conf', 'iou', 'imgsz'):
+        if getattr(args, name) is not None:
+            predict_params[name] = getattr(args, name)
+
+    if args.backend != 'pytorch':
+        # 在主进程中导出一次，子进程直接加载缓存，避免多个进程同时导出
+        worker = Worker()
+        worker.predict_params = predict_params
+        worker.export_model(args.model, Worker.file_hash(args.model), args.backend, args.int8)
+
+    writer = ResultWriter(args.output, fmt, args.resume)
+    if is_video:
+        capture = cv2.VideoCapture(args.source)
+        if not capture.isOpened():
+            sys.exit(f"无法打开视频文件：{args.source}")
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        items = [frame for frame in range(frame_count) if (args.source, frame) not in writer.done]
+    else:
+        items = [path for path in list_images(args.source) if (path, None) not in writer.done]
+    skipped = len(writer.done)
+    print(f"待处理 {len(items)} 项，已跳过 {skipped} 项", file=sys.stderr)
+
+    workers = max(1, min(args.workers, len(items)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    shards = [shard for shard in split_shards(items, workers, is_video) if shard]
+    context = mp.get_context('spawn')  # torch 与 fork 不兼容，统一使用 spawn
+    queue = context.Queue(maxsize=1000)
+    processes = [
+        context.Process(target=run_shard, args=(args.model, args.backend, args.int8, predict_params, (args.tile, args.tile_overlap), args.source, shard, is_video, args.batch_size, threads, queue), daemon=True)
+        for shard in shards
+    ]
+    for process in processes:
+        process.start()
+
+    start_time = time.perf_counter()
+    last_report = start_time
+    written = 0
+    running = len(processes)
+    try:
+        while running:
+            try:
+                record = queue.get(timeout=1)
+            except Empty:
+                if not any(process.is_alive() for process in processes):
+                    break  # 子进程异常退出
+                continue
+            if record is None:
+                running -= 1
+                continue
+            writer.write(record)
+            written += 1
+            now = time.perf_counter()
+            if now - last_report >= 2:
+                last_report = now
+                print(f"已处理 {written}/{len(items)}，{written / (now - start_time):.1f} 项/秒", file=sys.stderr)
+    finally:
+        writer.close()
+        for process in processes:
+            process.join(timeout=5)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"完成：写入 {written} 项，耗时 {elapsed:.1f} 秒", file=sys.stderr)
+    if written < len(items):
+        print(f"有 {len(items) - written} 项没有结果（读取失败或进程异常），可以使用 --resume 重试", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
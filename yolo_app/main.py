@@ -1,28 +1,2703 @@
 import sys,os
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QMessageBox, QFileDialog, QMenu
-from PyQt5.QtGui import QImage, QPixmap,QIcon
+import csv
+import hashlib
+import json
+import shutil
+import sqlite3
+import threading
+import time
+STARTUP_TIME = time.perf_counter()  # 启动计时从导入本模块开始
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import Qt, QObject, QTimer, QSize, QRect, QModelIndex, QAbstractListModel, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QMessageBox, QFileDialog, QMenu, QInputDialog, \
+    QDialog, QFormLayout, QComboBox, QSpinBox, QDoubleSpinBox, QDialogButtonBox, QShortcut, \
+    QGridLayout, QPlainTextEdit, QSizePolicy, QSlider, QListView, QStyledItemDelegate, QListWidget, QListWidgetItem, QToolBar
+from PyQt5.QtGui import QImage, QPixmap,QIcon, QKeySequence, QImageReader, QColor, QPainter
 import cv2
-from ultralytics import YOLO
+import numpy as np
+# ultralytics 会同时导入 torch，需要数秒，不在这里导入：窗口显示后由后台线程调用 import_ultralytics()，
+# 用到的地方在函数内导入（已导入时只是查一次 sys.modules）
 
 
 
 
+def import_ultralytics():
+    """导入推理需要的 ultralytics 模块"""
+    from ultralytics import YOLO
+    from ultralytics.engine.results import Results
+    from ultralytics.utils.plotting import Annotator, colors
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def user_data_dir():
+    """检测结果库、缩略图等缓存的保存目录（每个用户一个），程序目录可能是只读的（安装目录、打包后的程序）"""
+    if sys.platform == 'win32':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+    elif sys.platform == 'darwin':
+        root = os.path.expanduser(os.path.join('~', 'Library', 'Application Support'))
+    else:
+        root = os.environ.get('XDG_DATA_HOME') or os.path.expanduser(os.path.join('~', '.local', 'share'))
+    return os.path.join(root, 'YOLO-Visualisation-tools')
+
+
+def iter_images(directory, dir_mtimes=None):
+    """递归遍历目录，逐个产生图片路径（先是当前目录按文件名排序的图片，再按名称进入各个子目录），不需要先列出全部文件
+    dir_mtimes 不为 None 时记录遍历过的目录的修改时间，监视文件夹时用来判断哪些目录有变化"""
+    try:
+        if dir_mtimes is not None:
+            dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError:
+        return
+    subdirectories = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):  # 与 os.walk 相同，不进入指向目录的符号链接
+                subdirectories.append(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+        except OSError:
+            continue
+    for subdirectory in subdirectories:
+        yield from iter_images(subdirectory, dir_mtimes)
+
+
 class Worker:
+    # 推理后端：名称 -> (显示名称, ultralytics 导出格式)
+    BACKENDS = {
+        'pytorch': ("PyTorch", None),
+        'onnx': ("ONNX Runtime", 'onnx'),
+        'openvino': ("OpenVINO", 'openvino'),
+    }
+
     def __init__(self):
         self.model = None
+        self.model_path = None  # 原始 .pt 文件，切换后端时重新加载
+        self.model_hash = None  # 模型文件的哈希值（加上后端），用于区分不同模型的缓存结果
+        self.backend = 'pytorch'
+        self.int8 = False
+        self.speed = {}  # 预热后测得的单张推理耗时（毫秒）：后端 -> 耗时
+        self.predict_params = {}  # 传给 model.predict 的推理参数
+        self.display_filter = None  # 显示过滤（DetectionFilter），作用于缓存的原始检测结果，None 表示不过滤
+        self.annotator = None  # 绘制标注图用的 FastAnnotator，加载模型时创建
+        self.lock = threading.Lock()  # 模型不是线程安全的，多个线程推理时需要加锁
+        self.export_dir = os.path.join(user_data_dir(), 'exports')  # 导出模型的缓存目录，与界面、命令行共用
+        self.int8_data = None  # INT8 量化的校准数据集（yaml），None 时使用 ultralytics 默认的数据集
+        # 切片推理：大图切成 tile_size 的重叠切片分批推理，小目标不会因为整图缩小到 imgsz 而消失；None 表示不切片
+        self.tile_size = None
+        self.tile_overlap = 0.2  # 相邻切片重叠的比例
+        self.tile_batch = 8  # 每批送入模型的切片数量，决定切片推理时模型的峰值内存（不含解码后的整图）
+        self.tile_full_pass = True  # 另外对整图推理一次，切片放不下的大目标也能检测到
+        self.tile_merge_threshold = 0.5  # 合并重复框的 IoS 阈值
 
-    def load_model(self):
-        model_path, _ = QFileDialog.getOpenFileName(None, "选择模型文件", "", "模型文件 (*.pt)")
-        if model_path:
-            self.model = YOLO(model_path)
-            return self.model is not None
-        return False
+    def load_model(self, model_path=None, backend='pytorch', int8=False):
+        """加载模型，没有指定路径时弹出文件选择框
+
+        backend 不是 pytorch 时先导出（已导出过则直接使用缓存），加载后预热并测量推理耗时
+        """
+        if model_path is None:
+            model_path, _ = QFileDialog.getOpenFileName(None, "选择模型文件", "", "模型文件 (*.pt)")
+        if not model_path:
+            return False
+        from ultralytics import YOLO
+        model_hash = self.file_hash(model_path)
+        model = YOLO(model_path)
+        speed = {'pytorch': self.warmup(model)}
+        if backend != 'pytorch':
+            model = YOLO(self.export_model(model_path, model_hash, backend, int8), task='detect')
+            speed[backend] = self.warmup(model)
+            model_hash = f"{model_hash}-{backend}{'-int8' if int8 else ''}"  # 不同后端的结果略有差别，分开缓存
+        with self.lock:
+            self.model = model
+        self.model_path = model_path
+        self.model_hash = model_hash
+        self.backend = backend
+        self.int8 = int8
+        self.speed = speed
+        self.annotator = FastAnnotator(self.model.names)
+        return True
+
+    def export_model(self, model_path, model_hash, backend, int8=False):
+        """导出为 ONNX Runtime / OpenVINO 格式并缓存到 export_dir，以 .pt 的哈希、推理尺寸和是否量化区分，只导出一次"""
+        imgsz = self.predict_params.get('imgsz', 640)
+        name = f"{model_hash[:16]}_{imgsz}"
+        suffix = '_int8' if int8 else ''
+        if backend == 'onnx':
+            exported = os.path.join(self.export_dir, f"{name}{suffix}.onnx")
+        else:
+            exported = os.path.join(self.export_dir, f"{name}{suffix}_openvino_model")
+        if os.path.exists(exported):
+            return exported
+        # 复制到缓存目录再导出，导出的文件按 ultralytics 的规则命名在同一目录下，不会覆盖 .pt 旁边的文件
+        os.makedirs(self.export_dir, exist_ok=True)
+        source = os.path.join(self.export_dir, name + '.pt')
+        shutil.copyfile(model_path, source)
+        from ultralytics import YOLO
+        options = {'format': self.BACKENDS[backend][1], 'imgsz': imgsz, 'dynamic': True, 'verbose': False}
+        if int8:
+            options['int8'] = True
+            if self.int8_data:
+                options['data'] = self.int8_data
+        try:
+            YOLO(source).export(**options)
+        finally:
+            os.remove(source)
+        return exported
+
+    def warmup(self, model, runs=3):
+        """预热模型（第一次推理包含初始化），返回之后几次推理耗时的中位数（毫秒）"""
+        imgsz = self.predict_params.get('imgsz', 640)
+        image = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        params = dict(self.predict_params, verbose=False)
+        model.predict(image, **params)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            model.predict(image, **params)
+            times.append((time.perf_counter() - start) * 1000)
+        return sorted(times)[len(times) // 2]
+
+    def speed_text(self):
+        """当前后端的推理耗时，以及相对 PyTorch 的加速比"""
+        name = self.BACKENDS[self.backend][0] + (" INT8" if self.int8 else "")
+        text = f"{name}：推理 {self.speed[self.backend]:.0f} ms"
+        if self.backend != 'pytorch':
+            baseline = self.speed['pytorch']
+            text += f"（PyTorch {baseline:.0f} ms，快 {baseline / self.speed[self.backend]:.1f} 倍）"
+        return text
 
-    def detect_image(self, image):
-        results = self.model.predict(image)
+    @staticmethod
+    def file_hash(file_path):
+        """分块计算文件的 SHA1，避免一次读入大文件"""
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def cache_key(self, image_path):
+        """检测结果缓存的键：文件路径、修改时间、模型哈希和推理参数，文件不存在时返回 None"""
+        try:
+            mtime = os.stat(image_path).st_mtime_ns
+        except OSError:
+            return None
+        return (image_path, mtime, self.model_hash, self.result_params())
+
+    def result_params(self):
+        """影响检测结果的参数：推理参数，切片推理时加上切片设置"""
+        params = tuple(sorted(self.predict_params.items()))
+        if self.tile_size:
+            params += (('tile', self.tile_size, self.tile_overlap, self.tile_full_pass),)
+        return params
+
+    def detect_image(self, image, **overrides):
+        """检测一张图片，overrides 为这一次额外传给 model.predict 的参数（如下推的 classes、max_det）"""
+        if self.tile_size and max(image.shape[:2]) > self.tile_size:
+            return [self.detect_tiled(image, **overrides).to_results(image)]
+        with self.lock:
+            results = self.model.predict(image, **self.predict_params, **overrides)
         return results
-    
+
+    @staticmethod
+    def tile_windows(width, height, tile_size, overlap):
+        """切片窗口 (x1, y1, x2, y2)：相邻切片重叠 overlap 比例，最后一行（列）贴齐图片边缘，切片大小都相同"""
+        def starts(length):
+            if length <= tile_size:
+                return [0]
+            stride = max(1, int(tile_size * (1 - overlap)))
+            return list(range(0, length - tile_size, stride)) + [length - tile_size]
+        return [(x, y, min(x + tile_size, width), min(y + tile_size, height)) for y in starts(height) for x in starts(width)]
+
+    def detect_tiled(self, image, **overrides):
+        """切片推理，返回合并后的 Detections
+        整图已经完整解码在内存中（调用方用 cv2.imread 读取），切片只是它的视图（不复制）；
+        每次只有 tile_batch 个切片送入模型，受切片大小限制的只是推理时的峰值内存，不会再按整图分配一份推理输入"""
+        height, width = image.shape[:2]
+        windows = self.tile_windows(width, height, self.tile_size, self.tile_overlap)
+        params = dict(self.predict_params, **overrides)
+        params.setdefault('imgsz', self.tile_size)  # 切片按原始分辨率推理，不再缩小
+        boxes, confs, classes, sources = [], [], [], []
+        for start in range(0, len(windows), self.tile_batch):
+            batch = windows[start:start + self.tile_batch]
+            tiles = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in batch]
+            with self.lock:
+                results = self.model.predict(tiles, **params)
+            for (x1, y1, _, _), result in zip(batch, results):
+                detections = Detections.from_results(result)
+                boxes.append(detections.xyxy + np.array([x1, y1, x1, y1], dtype=np.float32))
+                confs.append(detections.conf)
+                classes.append(detections.cls)
+                sources.append(np.full(len(detections.cls), len(sources), dtype=np.int32))
+        if self.tile_full_pass:
+            with self.lock:
+                detections = Detections.from_results(self.model.predict(image, **self.predict_params, **overrides)[0])
+            boxes.append(detections.xyxy)
+            confs.append(detections.conf)
+            classes.append(detections.cls)
+            sources.append(np.full(len(detections.cls), len(sources), dtype=np.int32))
+        xyxy, conf, cls = np.concatenate(boxes), np.concatenate(confs), np.concatenate(classes)
+        xyxy, conf, cls = self.merge_boxes(xyxy, conf, cls, np.concatenate(sources), self.tile_merge_threshold)
+        return Detections(xyxy, conf, cls, self.model.names)
+
+    @staticmethod
+    def merge_boxes(xyxy, conf, cls, sources, threshold=0.5):
+        """合并不同切片（sources 为每个框来自哪个切片）检测到的同一个目标，返回合并后的 (xyxy, conf, cls)
+        按置信度从高到低，同类别、来自其他切片、IoS 超过 threshold 的框并入已保留的框，坐标取两者的外接框。
+        IoS 是交集占较小框面积的比例：被切片边缘截断的框只是完整框的一部分，IoU 很小但 IoS 接近 1；
+        同一个切片内的重叠框已经由模型做过 NMS，是不同的目标，不合并"""
+        order = np.argsort(-conf, kind='stable')
+        areas = np.prod(np.clip(xyxy[:, 2:] - xyxy[:, :2], 0, None), axis=1)
+        merged = np.zeros(len(conf), dtype=bool)
+        keep = []
+        output = xyxy.copy()
+        for index in order:
+            if merged[index]:
+                continue
+            keep.append(index)
+            top_left = np.maximum(xyxy[index, :2], xyxy[:, :2])
+            bottom_right = np.minimum(xyxy[index, 2:], xyxy[:, 2:])
+            intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=1)
+            ios = intersection / np.maximum(np.minimum(areas[index], areas), 1e-6)
+            duplicates = (cls == cls[index]) & (sources != sources[index]) & (ios > threshold) & ~merged
+            duplicates[index] = False
+            if duplicates.any():
+                output[index, :2] = np.minimum(xyxy[index, :2], xyxy[duplicates, :2].min(axis=0))
+                output[index, 2:] = np.maximum(xyxy[index, 2:], xyxy[duplicates, 2:].max(axis=0))
+                merged |= duplicates
+        keep = np.array(keep, dtype=np.intp)
+        return output[keep], conf[keep], cls[keep]
+
+    def annotate(self, image, detections):
+        """绘制原始分辨率的标注图（不修改 image），类别名不是 ASCII 时退回 results.plot()"""
+        if self.annotator.supported:
+            return self.annotator.draw(image.copy(), detections)
+        return detections.to_results(image).plot()
+
+    def detect_batch(self, images, batch_size=8, **overrides):
+        """批量检测多张图片，每 batch_size 张送入一次模型，返回与 images 一一对应的结果"""
+        if self.tile_size:
+            return [self.detect_image(image, **overrides)[0] for image in images]  # 切片推理时每张图片的切片自成一批
+        results = []
+        for start in range(0, len(images), batch_size):
+            with self.lock:
+                results.extend(self.model.predict(images[start:start + batch_size], **self.predict_params, **overrides))
+        return results
+
+    def set_display_filter(self, display_filter):
+        """更换显示过滤。阈值在缓存的原始结果范围内时只在显示时过滤；
+        置信度低于推理使用的下限、或 IoU 比推理时更宽松时放宽推理参数，返回推理参数是否改变（缓存键随之改变，需要重新检测）"""
+        params = dict(self.predict_params)
+        params['conf'] = min(params.get('conf', DetectionFilter.RAW_CONF), display_filter.conf)
+        params['iou'] = max(params.get('iou', DetectionFilter.RAW_IOU), display_filter.iou)
+        changed = params != self.predict_params
+        self.predict_params = params  # 整体替换，推理线程不会读到改了一半的参数
+        self.display_filter = display_filter
+        return changed
+
+    def filter_detections(self, detections):
+        """对原始检测结果应用显示过滤"""
+        if self.display_filter is None:
+            return detections
+        return self.display_filter.apply(detections, self.predict_params.get('iou', DetectionFilter.RAW_IOU))
+
+    def pushdown_params(self):
+        """可以下推到 model.predict 的过滤条件（类别、最大数量），NMS 和绘制只处理需要显示的框；
+        只用于结果不缓存的画面（摄像头、多路检测、导出），缓存的结果必须是完整的原始结果"""
+        params = {}
+        if self.display_filter is not None:
+            if self.display_filter.classes is not None:
+                params['classes'] = self.display_filter.classes.tolist()
+            params['max_det'] = self.display_filter.max_det
+        return params
+
+
+class Detections:
+    """紧凑的检测结果：只保存检测框、类别和置信度，不保存原图"""
+
+    def __init__(self, xyxy, conf, cls, names, ids=None):
+        self.xyxy = xyxy  # (N, 4) 检测框
+        self.conf = conf  # (N,) 置信度
+        self.cls = cls  # (N,) 类别编号
+        self.names = names  # 类别名称映射
+        self.ids = ids  # (N,) 跟踪编号，没有跟踪时为 None
+
+    @classmethod
+    def from_results(cls, result):
+        """从单张图片的 Results 中提取检测框"""
+        boxes = result.boxes.cpu().numpy()
+        ids = boxes.id.astype(np.int64) if boxes.is_track else None
+        return cls(boxes.xyxy.astype(np.float32), boxes.conf.astype(np.float32), boxes.cls.astype(np.int32), result.names, ids)
+
+    def to_results(self, image, path=""):
+        """还原为 Results 对象，用于绘制标注图和统计"""
+        from ultralytics.engine.results import Results
+        columns = [self.xyxy, self.conf[:, None], self.cls[:, None].astype(np.float32)]
+        if self.ids is not None:
+            columns.insert(1, self.ids[:, None].astype(np.float32))  # 带跟踪编号时为 xyxy, id, conf, cls
+        return Results(image, path=path, names=self.names, boxes=np.concatenate(columns, axis=1))
+
+    def select(self, index):
+        """按布尔掩码或下标取出部分检测框，返回新的 Detections"""
+        ids = self.ids[index] if self.ids is not None else None
+        return Detections(self.xyxy[index], self.conf[index], self.cls[index], self.names, ids)
+
+    @property
+    def nbytes(self):
+        """占用的内存字节数（近似值，类别名称映射是共享的不计入）"""
+        ids_bytes = self.ids.nbytes if self.ids is not None else 0
+        return self.xyxy.nbytes + self.conf.nbytes + self.cls.nbytes + ids_bytes + 256
+
+
+class DetectionFilter:
+    """显示过滤：置信度阈值、NMS 的 IoU 阈值、类别和最大数量
+    推理时用较低的置信度下限得到原始结果并缓存，显示时在原始结果上用 NumPy 掩码过滤，调整阈值不需要重新推理"""
+
+    RAW_CONF = 0.1  # 推理（缓存）使用的置信度下限
+    RAW_IOU = 0.7  # 推理使用的 NMS IoU 阈值（ultralytics 的默认值），更小的阈值在缓存结果上再做一次 NMS
+
+    def __init__(self, conf=0.25, iou=0.7, classes=None, max_det=300):
+        self.conf = conf
+        self.iou = iou
+        self.classes = None if classes is None else np.array(sorted(classes), dtype=np.int32)  # None 表示全部类别
+        self.max_det = max_det
+
+    def apply(self, detections, raw_iou=RAW_IOU):
+        """返回过滤后的 Detections，raw_iou 为原始结果推理时使用的 IoU 阈值；没有框被过滤时直接返回原对象"""
+        keep = detections.conf >= self.conf
+        if self.classes is not None:
+            keep &= np.isin(detections.cls, self.classes)
+        index = np.flatnonzero(keep)
+        if self.iou < raw_iou and len(index) > 1:
+            index = np.sort(index[self.nms(detections.xyxy[index], detections.conf[index], detections.cls[index], self.iou)])
+        if len(index) > self.max_det:
+            index = np.sort(index[np.argsort(-detections.conf[index], kind='stable')[:self.max_det]])
+        if len(index) == len(detections.conf):
+            return detections
+        return detections.select(index)
+
+    @staticmethod
+    def nms(xyxy, conf, cls, iou):
+        """按类别分别做 NMS（与 ultralytics 默认一致），返回保留的下标"""
+        boxes = xyxy.astype(np.float64)
+        boxes += cls[:, None] * (boxes.max() + 1)  # 不同类别的框平移到互不重叠的位置，一次调用完成
+        boxes[:, 2:] -= boxes[:, :2]  # xyxy -> xywh
+        keep = cv2.dnn.NMSBoxes(boxes, conf.astype(np.float32), 0.0, iou)
+        return np.asarray(keep, dtype=np.intp).reshape(-1)
+
+
+class BoxTracker:
+    """跳帧检测时的轻量跟踪：两次检测之间用稀疏光流（Lucas-Kanade）平移检测框，
+    重新检测时按 IoU 与已有的框匹配，保持跟踪编号不变；光流跟丢时标记 lost，下一帧立即重新检测"""
+
+    GRID = 3  # 每个框内取 GRID x GRID 个特征点
+
+    def __init__(self, max_width=640, min_ratio=0.5, iou_threshold=0.3):
+        self.max_width = max_width  # 光流在缩小的灰度图上计算
+        self.min_ratio = min_ratio  # 框内跟踪成功的点少于这个比例就认为跟丢了
+        self.iou_threshold = iou_threshold
+        self.tracks = None  # 当前的 Detections（带 ids）
+        self.next_id = 1
+        self.prev_gray = None
+        self.scale = 1.0
+        self.lost = False
+
+    def prepare(self, frame):
+        height, width = frame.shape[:2]
+        self.scale = min(1.0, self.max_width / width)
+        if self.scale < 1.0:
+            frame = cv2.resize(frame, (round(width * self.scale), round(height * self.scale)), interpolation=cv2.INTER_LINEAR)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    @staticmethod
+    def iou(boxes1, boxes2):
+        """两组框两两之间的 IoU，返回 (len(boxes1), len(boxes2))"""
+        top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+        bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+        intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+        area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+        area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+        return intersection / np.maximum(area1[:, None] + area2[None, :] - intersection, 1e-6)
+
+    def update(self, frame, detections):
+        """用新的检测结果替换跟踪框，返回 (带跟踪编号的 Detections, 新出现目标的类别编号)"""
+        count = len(detections.cls)
+        ids = np.zeros(count, dtype=np.int64)
+        matched = np.zeros(count, dtype=bool)
+        if self.tracks is not None and len(self.tracks.cls) and count:
+            iou = self.iou(self.tracks.xyxy, detections.xyxy)
+            iou[self.tracks.cls[:, None] != detections.cls[None, :]] = 0  # 只匹配同一类别
+            # 贪心匹配：按 IoU 从大到小，每个跟踪框和检测框只用一次
+            used = np.zeros(len(self.tracks.cls), dtype=bool)
+            for flat in np.argsort(-iou, axis=None):
+                track, detection = divmod(int(flat), count)
+                if iou[track, detection] < self.iou_threshold:
+                    break
+                if not used[track] and not matched[detection]:
+                    used[track] = matched[detection] = True
+                    ids[detection] = self.tracks.ids[track]
+        new = ~matched
+        ids[new] = np.arange(self.next_id, self.next_id + int(new.sum()))
+        self.next_id += int(new.sum())
+        self.tracks = Detections(detections.xyxy, detections.conf, detections.cls, detections.names, ids)
+        self.prev_gray = self.prepare(frame)
+        self.lost = False
+        return self.tracks, detections.cls[new]
+
+    def propagate(self, frame):
+        """用上一帧到这一帧的光流平移跟踪框，返回新的 Detections"""
+        gray = self.prepare(frame)
+        tracks = self.tracks
+        if tracks is None or not len(tracks.cls):
+            self.prev_gray = gray
+            return tracks
+        # 在每个框中间 50% 的区域取网格点，避开边缘的背景
+        boxes = tracks.xyxy * self.scale
+        steps = (np.arange(self.GRID, dtype=np.float32) + 0.5) / self.GRID * 0.5 + 0.25
+        centers_x = boxes[:, 0:1] + (boxes[:, 2:3] - boxes[:, 0:1]) * steps  # (N, GRID)
+        centers_y = boxes[:, 1:2] + (boxes[:, 3:4] - boxes[:, 1:2]) * steps
+        points = np.stack([np.repeat(centers_x, self.GRID, axis=1), np.tile(centers_y, (1, self.GRID))], axis=2)
+        points = points.reshape(-1, 1, 2).astype(np.float32)
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2)
+        # 前后向检查：再从这一帧跟踪回上一帧，回不到原位置的点（平坦背景、遮挡）视为无效
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, next_points, None, winSize=(15, 15), maxLevel=2)
+        self.prev_gray = gray
+
+        count = len(tracks.cls)
+        error = np.linalg.norm((back_points - points).reshape(-1, 2), axis=1)
+        valid = ((status[:, 0] == 1) & (back_status[:, 0] == 1) & (error < 1.0)).reshape(count, -1)
+        motion = (next_points - points).reshape(count, -1, 2)
+        # 每个框取有效点位移的中位数：无效点设为 nan 排到最后，再按有效点数取中间的位置
+        motion[~valid] = np.nan
+        motion.sort(axis=1)
+        valid_count = valid.sum(axis=1)
+        middle = np.maximum(valid_count - 1, 0) // 2
+        shift = np.take_along_axis(motion, middle[:, None, None].repeat(2, axis=2), axis=1)[:, 0]
+        shift = np.nan_to_num(shift) / self.scale
+        if np.any(valid_count < self.min_ratio * valid.shape[1]):
+            self.lost = True
+        xyxy = tracks.xyxy + np.tile(shift, 2).astype(np.float32)
+        height, width = frame.shape[:2]
+        np.clip(xyxy, 0, [width, height, width, height], out=xyxy)
+        if np.any((xyxy[:, 2] - xyxy[:, 0] < 2) | (xyxy[:, 3] - xyxy[:, 1] < 2)):
+            self.lost = True  # 框移出了画面
+        self.tracks = Detections(xyxy, tracks.conf, tracks.cls, tracks.names, tracks.ids)
+        return self.tracks
+
+
+class DetectionStats:
+    """整段视频或整个图片集的累计统计：各类别总数、单帧最多同时出现的数量、置信度直方图、每帧物体数量的时间序列
+    每帧用 np.bincount 增量更新，显示时直接读取，不需要重新扫描；推理线程写、界面线程读，需要加锁"""
+
+    def __init__(self, names, conf_bins=10, capacity=1024):
+        self.names = names
+        self.num_classes = max(names) + 1 if names else 0
+        self.conf_bins = conf_bins  # 置信度直方图的档数，0~1 均分
+        self.totals = np.zeros(self.num_classes, dtype=np.int64)  # 各类别累计数量
+        self.max_counts = np.zeros(self.num_classes, dtype=np.int64)  # 各类别单帧最多同时出现的数量
+        self.conf_sums = np.zeros(self.num_classes, dtype=np.float64)  # 各类别置信度之和，用于求平均
+        self.conf_hist = np.zeros((self.num_classes, conf_bins), dtype=np.int64)  # 各类别的置信度直方图
+        self.unique_totals = np.zeros(self.num_classes, dtype=np.int64)  # 跟踪时各类别出现过的不同目标数量
+        self.frame_counts = np.zeros(capacity, dtype=np.int32)  # 每帧的物体数量，容量不够时翻倍
+        self.frame_indexes = np.zeros(capacity, dtype=np.int64)  # 对应的帧号（实时播放会跳帧）或图片索引
+        self.frames = 0  # 已统计的帧数
+        # 图片集中已统计过的图片：索引 -> (在时间序列中的位置, 类别, 置信度)，来回翻看时不重复计数，重新检测后替换
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def contribution(self, cls, conf):
+        """一帧检测结果对各类别数量、置信度直方图、置信度之和的贡献"""
+        counts = np.bincount(cls, minlength=self.num_classes)
+        bins = np.minimum((conf * self.conf_bins).astype(np.intp), self.conf_bins - 1)
+        hist = np.bincount(cls * self.conf_bins + bins, minlength=self.num_classes * self.conf_bins)
+        conf_sums = np.bincount(cls, weights=conf, minlength=self.num_classes)
+        return counts, hist.reshape(self.num_classes, self.conf_bins), conf_sums
+
+    def update(self, detections, index, unique=False):
+        """累加一帧（或一张图片）的检测结果；unique=True 时同一个 index 只保留一份，
+        结果与上次相同（来回翻看）时跳过，不同（切换过滤或切片设置后重新检测）时替换上次的统计"""
+        cls, conf = detections.cls, detections.conf
+        counts, hist, conf_sums = self.contribution(cls, conf)
+        with self.lock:
+            if unique and index in self.seen:
+                slot, old_cls, old_conf = self.seen[index]
+                if np.array_equal(old_cls, cls) and np.array_equal(old_conf, conf):
+                    return
+                old_counts, old_hist, old_conf_sums = self.contribution(old_cls, old_conf)
+                self.seen[index] = (slot, cls, conf)
+                self.frame_counts[slot] = len(cls)
+                self.totals += counts - old_counts
+                self.conf_sums += conf_sums - old_conf_sums
+                self.conf_hist += hist - old_hist
+                # 这张图片原来是某些类别的最多数量，而新结果变少了：重新求这些类别的最大值
+                lowered = np.flatnonzero((old_counts == self.max_counts) & (counts < old_counts))
+                np.maximum(self.max_counts, counts, out=self.max_counts)
+                if len(lowered):
+                    self.max_counts[lowered] = 0
+                    for _, seen_cls, _ in self.seen.values():
+                        np.maximum.at(self.max_counts, lowered, np.bincount(seen_cls, minlength=self.num_classes)[lowered])
+                return
+            if unique:
+                self.seen[index] = (self.frames, cls, conf)
+            if self.frames == len(self.frame_counts):
+                self.frame_counts = np.concatenate([self.frame_counts, np.zeros_like(self.frame_counts)])
+                self.frame_indexes = np.concatenate([self.frame_indexes, np.zeros_like(self.frame_indexes)])
+            self.frame_counts[self.frames] = len(cls)
+            self.frame_indexes[self.frames] = index
+            self.frames += 1
+            self.totals += counts
+            np.maximum(self.max_counts, counts, out=self.max_counts)
+            self.conf_sums += conf_sums
+            self.conf_hist += hist
+
+    def add_unique(self, cls):
+        """累加新出现的跟踪目标（类别编号数组）"""
+        counts = np.bincount(cls, minlength=self.num_classes)
+        with self.lock:
+            self.unique_totals += counts
+
+    def series(self):
+        """每帧物体数量的时间序列：(帧号, 数量)"""
+        with self.lock:
+            return self.frame_indexes[:self.frames].copy(), self.frame_counts[:self.frames].copy()
+
+    def summary_text(self, title, unit):
+        """生成统计文字，title 如“整段视频”，unit 如“帧”"""
+        with self.lock:
+            frames = self.frames
+            totals = self.totals.copy()
+            max_counts = self.max_counts.copy()
+            conf_sums = self.conf_sums.copy()
+            unique_totals = self.unique_totals.copy()
+            hist = self.conf_hist.sum(axis=0)
+            counts = self.frame_counts[:frames]
+            peak = int(counts.argmax()) if frames else 0
+            peak_index, peak_count = (int(self.frame_indexes[peak]), int(counts[peak])) if frames else (0, 0)
+            mean_count = float(counts.mean()) if frames else 0.0
+        text = f"\n{title}（已统计 {frames} {unit}）物体总数：{int(totals.sum())}\n"
+        if not frames:
+            return text
+        text += f"每{unit}物体数：平均 {mean_count:.1f}，最多 {peak_count}（第 {peak_index + 1} {unit}）\n"
+        for class_id in np.argsort(-totals, kind='stable'):
+            if totals[class_id] == 0:
+                break
+            text += (f"{self.names[int(class_id)]}: {totals[class_id]}，单{unit}最多 {max_counts[class_id]}，"
+                     f"平均置信度 {conf_sums[class_id] / totals[class_id]:.2f}")
+            if unique_totals.any():
+                text += f"，不同目标 {unique_totals[class_id]} 个"
+            text += "\n"
+        if hist.sum():
+            step = 1 / self.conf_bins
+            text += "置信度分布：" + "，".join(f"{i * step:.1f}+: {count}" for i, count in enumerate(hist) if count) + "\n"
+        return text
+
+
+class LabelGlyph:
+    """预先渲染好的标签（底色框 + 文字），分别画在黑底和白底上求出颜色和透明度，之后只需要贴图
+    标签框内部是不透明的，直接切片复制；只有抗锯齿的边缘和文字下伸部分需要按透明度混合"""
+
+    def __init__(self, text, font_scale, thickness, box_color, text_color, outside):
+        (width, text_height), baseline = cv2.getTextSize(text, 0, fontScale=font_scale, thickness=thickness)
+        height = text_height + 3  # 与 ultralytics 的 Annotator.box_label 一致，多留 3 像素
+        self.width = width
+        self.height = height
+
+        # 以标签左上角 (x1, y1) 为原点，外侧标签画在框上方，内侧标签画在框内
+        rect_top, rect_bottom = (-height, 0) if outside else (0, height)
+        text_y = -2 if outside else height - 1
+        margin = thickness + 2
+        top = min(rect_top, text_y - text_height) - margin
+        bottom = max(rect_bottom, text_y + baseline) + margin
+        left, right = -margin, width + margin
+        layers = []
+        for background in (0, 255):
+            canvas = np.full((bottom - top + 1, right - left + 1, 3), background, np.uint8)
+            cv2.rectangle(canvas, (-left, rect_top - top), (width - left, rect_bottom - top), box_color, -1, cv2.LINE_AA)
+            cv2.putText(canvas, text, (-left, text_y - top), 0, font_scale, text_color, thickness=thickness, lineType=cv2.LINE_AA)
+            layers.append(canvas)
+        black, white = layers
+
+        # 结果 = 背景 * transparency + color，裁掉完全透明的边
+        transparency = (white.astype(np.float32) - black) / 255
+        ys, xs = np.nonzero(transparency.max(axis=2) < 1)
+        y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+        self.left, self.top = left + x0, top + y0
+        self.color = black[y0:y1, x0:x1].copy()
+        self.premultiplied = self.color.astype(np.float32)
+        self.transparency = transparency[y0:y1, x0:x1].copy()
+        self.core = (rect_top - self.top, rect_bottom - self.top + 1, -self.left, width - self.left + 1)  # 不透明区域
+
+    def paste(self, image, x, y):
+        """把标签贴到 image 的 (x, y) 处，超出图片的部分自动裁剪"""
+        top, left = y + self.top, x + self.left
+        rows, cols = self.color.shape[:2]
+        y0, y1 = max(top, 0), min(top + rows, image.shape[0])
+        x0, x1 = max(left, 0), min(left + cols, image.shape[1])
+        if y0 >= y1 or x0 >= x1:
+            return
+        core_y0, core_y1, core_x0, core_x1 = self.core
+        core_y0, core_y1 = min(max(core_y0 + top, y0), y1), min(max(core_y1 + top, y0), y1)
+        core_x0, core_x1 = min(max(core_x0 + left, x0), x1), min(max(core_x1 + left, x0), x1)
+        image[core_y0:core_y1, core_x0:core_x1] = self.color[core_y0 - top:core_y1 - top, core_x0 - left:core_x1 - left]
+        # 不透明区域上下左右四条边需要混合
+        for sy0, sy1, sx0, sx1 in ((y0, core_y0, x0, x1), (core_y1, y1, x0, x1),
+                                   (core_y0, core_y1, x0, core_x0), (core_y0, core_y1, core_x1, x1)):
+            if sy0 < sy1 and sx0 < sx1:
+                region = image[sy0:sy1, sx0:sx1]
+                rows, cols = slice(sy0 - top, sy1 - top), slice(sx0 - left, sx1 - left)
+                region[:] = region * self.transparency[rows, cols] + self.premultiplied[rows, cols]
+
+
+class FastAnnotator:
+    """直接从 NumPy 数组（xyxy / conf / cls）绘制检测框和标签，画面与 results[0].plot() 一致
+    不复制整张图片，可以直接画在复用的缓冲区上；类别颜色和标签字形都会缓存"""
+
+    def __init__(self, names, max_glyphs=4096):
+        from ultralytics.utils.plotting import Annotator
+        self.names = names
+        self.supported = all(str(name).isascii() for name in names.values())  # OpenCV 字体只支持 ASCII
+        self.max_glyphs = max_glyphs
+        self.colors = {}  # 类别编号 -> (框颜色, 文字颜色)
+        self.glyphs = OrderedDict()  # (文字, 字号, 粗细, 类别, 是否在框外) -> LabelGlyph
+        self.lock = threading.Lock()  # 渲染线程和界面线程可能同时绘制
+        self.reference = Annotator(np.zeros((2, 2, 3), np.uint8))  # 只用来取与 ultralytics 相同的文字颜色
+
+    def class_color(self, class_id):
+        color = self.colors.get(class_id)
+        if color is None:
+            from ultralytics.utils.plotting import colors
+            box_color = colors(class_id, True)
+            color = self.colors[class_id] = (box_color, self.reference.get_txt_color(box_color))
+        return color
+
+    def glyph(self, text, font_scale, thickness, class_id, outside):
+        key = (text, font_scale, thickness, class_id, outside)
+        with self.lock:
+            glyph = self.glyphs.get(key)
+            if glyph is not None:
+                self.glyphs.move_to_end(key)
+                return glyph
+        glyph = LabelGlyph(text, font_scale, thickness, *self.class_color(class_id), outside)
+        with self.lock:
+            self.glyphs[key] = glyph
+            if len(self.glyphs) > self.max_glyphs:
+                self.glyphs.popitem(last=False)
+        return glyph
+
+    @staticmethod
+    def line_width(shape):
+        """与 ultralytics 相同的线宽：图片平均边长的 0.3%（shape 包含通道数），至少 2 像素"""
+        return max(round(sum(shape) / 2 * 0.003), 2)
+
+    def draw(self, image, detections, scale=1.0, source_shape=None):
+        """在 image 上原地绘制；image 是缩小后的显示图时，scale 为缩放比例，source_shape 为原图尺寸"""
+        line_width = max(1, round(self.line_width(source_shape or image.shape) * scale))
+        font_thickness = max(line_width - 1, 1)
+        font_scale = line_width / 3
+        image_width = image.shape[1]
+        boxes = (detections.xyxy * scale).astype(np.int32)
+        # 与 plot() 一样倒序绘制，置信度最高的标签在最上层
+        ids = detections.ids[::-1].tolist() if detections.ids is not None else [None] * len(boxes)
+        for box, conf, class_id, track_id in zip(boxes[::-1].tolist(), detections.conf[::-1].tolist(), detections.cls[::-1].tolist(), ids):
+            box_color, text_color = self.class_color(class_id)
+            x1, y1, x2, y2 = box
+            cv2.rectangle(image, (x1, y1), (x2, y2), box_color, thickness=line_width, lineType=cv2.LINE_AA)
+            text = f"{self.names[class_id]} {conf:.2f}" if track_id is None else f"id:{track_id} {self.names[class_id]} {conf:.2f}"
+            glyph = self.glyph(text, font_scale, font_thickness, class_id, True)
+            if y1 < glyph.height:  # 框上方放不下，标签画在框内
+                glyph = self.glyph(text, font_scale, font_thickness, class_id, False)
+            glyph.paste(image, min(x1, image_width - glyph.width), y1)
+        return image
+
+
+class DetectionStore:
+    """SQLite 检测结果库：持久保存每张图片的检测框，按图片、类别、置信度建索引，重新打开处理过的图片时不再推理"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS models (
+            model_hash TEXT PRIMARY KEY,
+            names TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            mtime INTEGER NOT NULL,
+            model_hash TEXT NOT NULL,
+            params TEXT NOT NULL,
+            UNIQUE (path, model_hash, params, mtime)
+        );
+        CREATE TABLE IF NOT EXISTS detections (
+            image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+            class INTEGER NOT NULL,
+            conf REAL NOT NULL,
+            x1 REAL NOT NULL, y1 REAL NOT NULL, x2 REAL NOT NULL, y2 REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_detections_image ON detections (image_id);
+        CREATE INDEX IF NOT EXISTS idx_detections_class_conf ON detections (class, conf);
+    """
+
+    def __init__(self, db_path, commit_every=64):
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.SCHEMA)
+        self.lock = threading.Lock()  # 后台线程和界面线程共用一个连接
+        self.commit_every = commit_every  # 攒够多少次写入提交一次事务
+        self.pending = 0
+        self.names = {}  # model_hash -> 类别名称映射
+
+    @staticmethod
+    def split_key(key):
+        """缓存键 (路径, 修改时间, 模型哈希, 推理参数) 转换为数据库字段"""
+        path, mtime, model_hash, params = key
+        return path, mtime, model_hash, repr(params)
+
+    def model_names(self, model_hash):
+        if model_hash not in self.names:
+            row = self.connection.execute("SELECT names FROM models WHERE model_hash = ?", (model_hash,)).fetchone()
+            self.names[model_hash] = {int(k): v for k, v in json.loads(row[0]).items()} if row else {}
+        return self.names[model_hash]
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id FROM images WHERE path = ? AND mtime = ? AND model_hash = ? AND params = ?",
+                self.split_key(key)).fetchone()
+            if row is None:
+                return None
+            boxes = self.connection.execute(
+                "SELECT class, conf, x1, y1, x2, y2 FROM detections WHERE image_id = ?", (row[0],)).fetchall()
+            names = self.model_names(key[2])
+        data = np.array(boxes, dtype=np.float32).reshape(-1, 6)
+        return Detections(data[:, 2:6].copy(), data[:, 1].copy(), data[:, 0].astype(np.int32), names)
+
+    def __contains__(self, key):
+        if key is None:
+            return False
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM images WHERE path = ? AND mtime = ? AND model_hash = ? AND params = ?",
+                self.split_key(key)).fetchone() is not None
+
+    def put(self, key, detections):
+        if key is None:
+            return
+        path, mtime, model_hash, params = self.split_key(key)
+        with self.lock:
+            if not self.model_names(model_hash):
+                self.connection.execute("INSERT OR REPLACE INTO models VALUES (?, ?)", (model_hash, json.dumps(detections.names)))
+                self.names[model_hash] = detections.names
+            # 同一张图片旧版本（文件被修改过）的结果一并删除
+            self.connection.execute("DELETE FROM images WHERE path = ? AND model_hash = ? AND params = ?", (path, model_hash, params))
+            image_id = self.connection.execute(
+                "INSERT INTO images (path, mtime, model_hash, params) VALUES (?, ?, ?, ?)",
+                (path, mtime, model_hash, params)).lastrowid
+            self.connection.executemany(
+                "INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(image_id, int(c), float(p), *map(float, box)) for box, p, c in zip(detections.xyxy, detections.conf, detections.cls)])
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.connection.commit()
+                self.pending = 0
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+    def query_images(self, model_hash, params, class_id, min_count=1, min_conf=0.0):
+        """查询某个类别（置信度大于 min_conf）至少出现 min_count 次的图片路径"""
+        with self.lock:
+            rows = self.connection.execute(
+                """SELECT i.path FROM images i JOIN detections d ON d.image_id = i.id
+                   WHERE i.model_hash = ? AND i.params = ? AND d.class = ? AND d.conf > ?
+                   GROUP BY i.id HAVING COUNT(*) >= ? ORDER BY i.path""",
+                (model_hash, repr(params), class_id, min_conf, min_count)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class DetectionCache:
+    """按字节预算淘汰的 LRU 检测结果缓存，只保存紧凑的 Detections，线程安全
+    可以挂一个 DetectionStore 作为二级缓存，写入时同时持久化，内存未命中时再查数据库"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, store=None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.items = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            detections = self.items.get(key)
+            if detections is not None:
+                self.items.move_to_end(key)  # 最近使用的放到末尾
+                return detections
+        if self.store is not None:
+            detections = self.store.get(key)
+            if detections is not None:
+                self.put_memory(key, detections)
+        return detections
+
+    def put(self, key, detections):
+        if key is None:
+            return
+        self.put_memory(key, detections)
+        if self.store is not None:
+            self.store.put(key, detections)
+
+    def put_memory(self, key, detections):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.nbytes
+            self.items[key] = detections
+            self.total_bytes += detections.nbytes
+            # 超出预算时从最久未使用的开始淘汰
+            while self.total_bytes > self.max_bytes and len(self.items) > 1:
+                _, evicted = self.items.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.items:
+                return True
+        return self.store is not None and key in self.store
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.total_bytes = 0
+
+
+class VideoResultCache:
+    """一个视频逐帧的检测结果，每帧保存紧凑的 Detections，未检测的帧没有记录，线程安全
+
+    可以保存到视频旁边的 .npz 文件（所有帧的框拼成几个连续数组），文件名包含视频修改时间、模型和推理参数，
+    下次打开同一个视频时直接读取，回放和拖动进度条只需要解码和绘制
+    """
+
+    def __init__(self, video_path, frame_count, model_hash, params, names, fallback_dir=None):
+        self.video_path = video_path
+        self.key = (model_hash, params)
+        self.names = names
+        self.frames = {}  # 帧号 -> Detections
+        self.done = np.zeros(max(frame_count, 0), dtype=bool)  # 每一帧是否已检测
+        self.dirty = False  # 有没有未保存的结果
+        self.lock = threading.Lock()
+        digest = hashlib.sha1(repr((os.stat(video_path).st_mtime_ns, self.key)).encode()).hexdigest()[:12]
+        file_name = f"{os.path.basename(video_path)}.{digest}.detections.npz"
+        self.paths = [os.path.join(os.path.dirname(os.path.abspath(video_path)), file_name)]
+        if fallback_dir is not None:
+            self.paths.append(os.path.join(fallback_dir, file_name))  # 视频所在目录不可写时保存到这里
+
+    @classmethod
+    def open(cls, worker, video_path, frame_count, fallback_dir=None):
+        """创建当前模型和推理参数下的缓存，磁盘上有之前保存的结果时一并读取"""
+        cache = cls(video_path, frame_count, worker.model_hash, worker.result_params(), worker.model.names, fallback_dir)
+        cache.load()
+        return cache
+
+    def matches(self, worker):
+        """缓存是否对应 worker 当前的模型和推理参数"""
+        return self.key == (worker.model_hash, worker.result_params())
+
+    def get(self, frame):
+        with self.lock:
+            return self.frames.get(frame)
+
+    def put(self, frame, detections):
+        with self.lock:
+            self.frames[frame] = Detections(detections.xyxy, detections.conf, detections.cls, self.names)  # 不保存跟踪编号
+            if frame >= len(self.done):
+                self.done = np.concatenate([self.done, np.zeros(frame + 1 - len(self.done), dtype=bool)])  # 帧数统计不准确
+            self.done[frame] = True
+            self.dirty = True
+
+    def __contains__(self, frame):
+        with self.lock:
+            return frame in self.frames
+
+    def truncate(self, frame_count):
+        """视频实际只有 frame_count 帧，后面的帧不再补检"""
+        with self.lock:
+            self.done = self.done[:frame_count]
+
+    def next_missing(self, start):
+        """从 start 开始（到结尾后从头）第一个没有检测的帧，全部检测过时返回 None"""
+        with self.lock:
+            missing = np.flatnonzero(~self.done)
+        if not len(missing):
+            return None
+        after = missing[missing >= start]
+        return int(after[0] if len(after) else missing[0])
+
+    def coverage(self):
+        """已检测的帧占比"""
+        with self.lock:
+            return float(self.done.mean()) if len(self.done) else 0.0
+
+    def save(self):
+        """有新结果时写入 .npz，先写临时文件再替换，保存到一半退出也不会损坏已有的文件"""
+        with self.lock:
+            if not self.dirty:
+                return
+            frames = np.array(sorted(self.frames), dtype=np.int64)
+            items = [self.frames[frame] for frame in frames]
+            self.dirty = False
+        arrays = {
+            'frames': frames,
+            'counts': np.array([len(item.cls) for item in items], dtype=np.int32),
+            'xyxy': np.concatenate([item.xyxy for item in items]) if items else np.zeros((0, 4), dtype=np.float32),
+            'conf': np.concatenate([item.conf for item in items]) if items else np.zeros(0, dtype=np.float32),
+            'cls': np.concatenate([item.cls for item in items]) if items else np.zeros(0, dtype=np.int32),
+            'key': np.array(repr(self.key)),
+        }
+        for path in self.paths:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    np.savez(f, **arrays)
+                os.replace(path + '.tmp', path)
+                return
+            except OSError:
+                continue
+        self.dirty = True  # 都写不了，下次再试
+
+    def load(self):
+        for path in self.paths:
+            if not os.path.exists(path):
+                continue
+            try:
+                with np.load(path) as data:
+                    if str(data['key']) != repr(self.key):
+                        continue
+                    frames, counts = data['frames'], data['counts']
+                    xyxy, conf, cls = data['xyxy'], data['conf'], data['cls']
+            except (OSError, ValueError, KeyError):
+                continue  # 文件损坏，重新检测
+            ends = np.cumsum(counts)
+            with self.lock:
+                for frame, start, end in zip(frames.tolist(), (ends - counts).tolist(), ends.tolist()):
+                    # 各帧的结果是几个大数组的切片，不复制
+                    self.frames[frame] = Detections(xyxy[start:end], conf[start:end], cls[start:end], self.names)
+                if len(frames):
+                    if frames[-1] >= len(self.done):
+                        self.done = np.concatenate([self.done, np.zeros(frames[-1] + 1 - len(self.done), dtype=bool)])
+                    self.done[frames] = True
+            return
+
+
+class BatchProcessor(QObject):
+    """批量检测：线程池并行解码图片，按批次送入模型推理，推理当前批次时下一批已经在解码；
+    缓存中已有结果的图片在解码线程中查到后直接输出，不读取也不推理"""
+    result_ready = pyqtSignal(int, object)  # 图片索引、检测结果（Detections）
+    progress = pyqtSignal(int, int)  # 已处理数量、总数
+    finished = pyqtSignal(int, float)  # 处理数量、总耗时（秒）
+
+    def __init__(self, worker, cache, image_paths, indexes=None, batch_size=8, decode_workers=4):
+        super().__init__()
+        self.worker = worker
+        self.cache = cache  # 结果写入的 DetectionCache，为 None 时只通过信号输出
+        self.image_paths = list(image_paths)
+        self.indexes = list(indexes) if indexes is not None else list(range(len(self.image_paths)))  # 结果对应的图片索引
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def wait(self, timeout=2):
+        self.thread.join(timeout)
+
+    def load(self, image_path):
+        """解码线程：计算缓存键，缓存中已有结果时返回 (键, None, 结果)，否则读取图片返回 (键, 图片, None)"""
+        key = self.worker.cache_key(image_path)
+        if self.cache is not None:
+            detections = self.cache.get(key)
+            if detections is not None:
+                return key, None, detections
+        return key, cv2.imread(image_path), None
+
+    def run(self):
+        start_time = time.perf_counter()
+        total = len(self.image_paths)
+        pool = ThreadPoolExecutor(self.decode_workers)
+        pending = deque()  # 已提交解码的 (索引, future)
+        next_index = 0
+        done = 0
+        try:
+            while done < total and not self.stop_event.is_set():
+                # 始终保持两批图片在解码，推理和解码重叠进行
+                while next_index < total and len(pending) < 2 * self.batch_size:
+                    pending.append((self.indexes[next_index], pool.submit(self.load, self.image_paths[next_index])))
+                    next_index += 1
+
+                batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+                indexes, keys, images = [], [], []
+                for index, future in batch:
+                    key, image, cached = future.result()
+                    if cached is not None:
+                        self.result_ready.emit(index, cached)
+                    elif image is not None:
+                        indexes.append(index)
+                        keys.append(key)
+                        images.append(image)
+                if images:
+                    results = self.worker.detect_batch(images, self.batch_size)
+                    for index, key, result in zip(indexes, keys, results):
+                        detections = Detections.from_results(result)
+                        if self.cache is not None:
+                            self.cache.put(key, detections)
+                        self.result_ready.emit(index, detections)
+                done += len(batch)
+                self.progress.emit(done, total)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.finished.emit(done, time.perf_counter() - start_time)
+
+
+class FolderSource(QObject):
+    """从文件夹导入图片：扫描线程惰性遍历目录，发现一张就放入有界的待检测队列，检测线程按批推理，
+    不需要先列出全部文件，找到第一张图片就开始检测；队列满时扫描线程等待，一次拷进大量图片也不会占满内存
+
+    watch=True 时遍历完后继续轮询：每次只 stat 一遍已知的目录，修改时间变了才重新列出，
+    新文件的修改时间超过 settle_time 秒（已经拷贝完）才检测
+    """
+    found = pyqtSignal(list)  # 新发现的图片路径，按发现顺序编号
+    result_ready = pyqtSignal(int, object)  # 图片编号、检测结果（Detections）
+    progress = pyqtSignal(int, int)  # 已检测数量、已发现数量
+    finished = pyqtSignal(int, float)  # 检测数量、总耗时（秒）
+
+    def __init__(self, worker, cache, directory, watch=False, batch_size=8, queue_size=256, poll_interval=1.0, settle_time=1.0, decode_workers=4):
+        super().__init__()
+        self.worker = worker
+        self.cache = cache
+        self.directory = directory
+        self.watch = watch
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.decode_workers = decode_workers
+        self.work_queue = FrameQueue(queue_size)  # 待检测的 (编号, 路径)
+        self.seen = set()  # 已经发现的图片
+        self.dir_mtimes = {}  # 已遍历的目录 -> 修改时间
+        self.unsettled = set()  # 还在写入的新文件，下次轮询再检查
+        self.found_count = 0
+        self.processed = 0
+        self.scan_done = False  # 第一次遍历已完成（监视模式下之后只处理新增的图片）
+        self.new_paths = []  # 还没有通过 found 信号发出的路径
+        self.last_flush = time.perf_counter()
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.scan_loop, daemon=True),
+            threading.Thread(target=self.detect_loop, daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.work_queue.close()  # 唤醒等待空位的扫描线程
+
+    def wait(self, timeout=2):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def add(self, path):
+        """编号并放入待检测队列，队列满时先把已发现的路径发给界面再等待"""
+        self.seen.add(path)
+        self.new_paths.append(path)
+        index = self.found_count
+        self.found_count += 1
+        if len(self.new_paths) >= 256 or time.perf_counter() - self.last_flush > 0.1 or self.work_queue.is_full():
+            self.flush()
+        self.work_queue.put((index, path), block=True)
+
+    def flush(self):
+        if self.new_paths:
+            self.found.emit(self.new_paths)
+            self.new_paths = []
+        self.last_flush = time.perf_counter()
+
+    def scan_loop(self):
+        """扫描线程：先完整遍历一次，监视模式下再定期轮询新增的图片"""
+        try:
+            for path in iter_images(self.directory, self.dir_mtimes):
+                if self.stop_event.is_set():
+                    return
+                self.add(path)
+            self.flush()
+            self.scan_done = True
+            while self.watch and not self.stop_event.wait(self.poll_interval):
+                for path in self.poll():
+                    if self.stop_event.is_set():
+                        return
+                    self.add(path)
+                self.flush()
+        finally:
+            self.work_queue.close()
+
+    def poll(self):
+        """返回上次轮询以来新增并且已经写完的图片"""
+        candidates = list(self.unsettled)
+        for directory, mtime in list(self.dir_mtimes.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                del self.dir_mtimes[directory]  # 目录被删除
+                continue
+            if current == mtime:
+                continue
+            self.dir_mtimes[directory] = current
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in self.dir_mtimes:
+                        candidates.extend(iter_images(entry.path, self.dir_mtimes))  # 新建的子目录
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.path not in self.seen:
+                    candidates.append(entry.path)
+        ready = []
+        now = time.time()
+        for path in dict.fromkeys(candidates):
+            try:
+                settled = now - os.stat(path).st_mtime >= self.settle_time
+            except OSError:
+                self.unsettled.discard(path)  # 还没写完就被删除或改名
+                continue
+            if settled:
+                self.unsettled.discard(path)
+                ready.append(path)
+            else:
+                self.unsettled.add(path)
+        return ready
+
+    def load(self, image_path):
+        return cv2.imread(image_path)
+
+    def detect_loop(self):
+        """检测线程：数据库中已有结果的图片直接输出，其余的在线程池中解码，按批推理"""
+        start_time = time.perf_counter()
+        pool = ThreadPoolExecutor(self.decode_workers)
+        pending = deque()  # 已提交解码的 (编号, 缓存键, future)
+        reported = 0  # 上一次通过 progress 报告的检测数量
+        try:
+            while not self.stop_event.is_set():
+                # 把队列中已有的图片提交解码，最多两批；没有在解码的图片时才等待新图片
+                while len(pending) < 2 * self.batch_size:
+                    item = self.work_queue.get(timeout=0 if pending else 0.2)
+                    if item is None:
+                        break
+                    index, path = item
+                    key = self.worker.cache_key(path)
+                    detections = self.cache.get(key) if self.cache is not None else None
+                    if detections is not None:
+                        self.result_ready.emit(index, detections)
+                        self.processed += 1
+                    else:
+                        pending.append((index, key, pool.submit(self.load, path)))
+                if not pending:
+                    if self.work_queue.is_drained():
+                        break
+                    if self.processed != reported:  # 都是数据库中已有结果的图片
+                        reported = self.processed
+                        self.progress.emit(self.processed, self.found_count)
+                    continue
+                batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+                indexes, keys, images = [], [], []
+                for index, key, future in batch:
+                    image = future.result()
+                    if image is not None:
+                        indexes.append(index)
+                        keys.append(key)
+                        images.append(image)
+                if images:
+                    results = self.worker.detect_batch(images, self.batch_size)
+                    for index, key, result in zip(indexes, keys, results):
+                        detections = Detections.from_results(result)
+                        if self.cache is not None:
+                            self.cache.put(key, detections)
+                        self.result_ready.emit(index, detections)
+                self.processed += len(batch)
+                reported = self.processed
+                self.progress.emit(self.processed, self.found_count)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.finished.emit(self.processed, time.perf_counter() - start_time)
+
+
+class Prefetcher:
+    """后台预取当前图片前后 radius 张图片的解码和检测结果，用户跳转时丢弃过期任务"""
+
+    def __init__(self, worker, cache, radius=2):
+        self.worker = worker
+        self.cache = cache
+        self.radius = radius
+        self.targets = deque()  # 待预取的图片路径，离当前图片越近越靠前
+        self.images = OrderedDict()  # 图片路径 -> 已解码的图片，只保留当前窗口内的
+        self.in_flight = None  # 正在推理的缓存键
+        self.generation = 0  # 每次跳转加一，用来识别过期任务
+        self.paused = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, image_paths, index):
+        """切换到第 index 张图片后调用，按距离由近到远重新安排预取"""
+        order = []
+        for offset in range(1, self.radius + 1):
+            for neighbour in (index + offset, index - offset):
+                if 0 <= neighbour < len(image_paths):
+                    order.append(image_paths[neighbour])
+        window = set(order)
+        window.add(image_paths[index])
+        with self.condition:
+            self.generation += 1
+            self.paused = False
+            self.targets = deque(order)
+            # 丢弃窗口外的已解码图片，内存占用最多 2 * radius + 1 张
+            for image_path in list(self.images):
+                if image_path not in window:
+                    del self.images[image_path]
+            self.condition.notify_all()
+
+    def pause(self):
+        """前台检测期间暂停预取，把模型让给前台"""
+        with self.condition:
+            self.paused = True
+
+    def cancel(self):
+        """取消全部预取任务（切换图片集或开始播放视频时调用）"""
+        with self.condition:
+            self.generation += 1
+            self.targets.clear()
+            self.images.clear()
+
+    def close(self, timeout=2):
+        """退出程序前停止预取线程，等待正在进行的推理结束"""
+        self.cancel()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def take_image(self, image_path):
+        """获取已预解码的图片，没有则返回 None"""
+        with self.condition:
+            return self.images.get(image_path)
+
+    def wait_for(self, key):
+        """如果该图片正在预取推理，等待它完成，避免前台重复推理"""
+        with self.condition:
+            while key is not None and self.in_flight == key:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (self.paused or not self.targets):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                image_path = self.targets.popleft()
+                generation = self.generation
+                image = self.images.get(image_path)
+
+            key = self.worker.cache_key(image_path)
+            if key is None:
+                continue
+            if image is None:
+                image = cv2.imread(image_path)
+                if image is None:
+                    continue
+
+            with self.condition:
+                if generation != self.generation:
+                    continue  # 用户已跳转，放弃过期任务
+                self.images[image_path] = image
+                if self.paused or key in self.cache:
+                    continue
+                self.in_flight = key
+            try:
+                results = self.worker.detect_image(image)
+                self.cache.put(key, Detections.from_results(results[0]))
+            finally:
+                with self.condition:
+                    self.in_flight = None
+                    self.condition.notify_all()
+
+
+class ThumbnailCache:
+    """缩略图磁盘缓存：每张缩略图一个 JPEG 文件，文件名是图片路径、修改时间和缩略图尺寸的哈希，
+    总大小超过 max_bytes 时删除最久没有用过的文件，线程安全"""
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = None  # 第一次写入时再扫描目录统计
+        self.writable = True  # 目录创建失败时只读取、不再写入
+        self.lock = threading.Lock()
+
+    def key(self, image_path, size):
+        """缓存文件名，图片不存在时返回 None"""
+        try:
+            mtime = os.stat(image_path).st_mtime_ns
+        except OSError:
+            return None
+        return hashlib.sha1(f"{image_path}|{mtime}|{size}".encode('utf-8')).hexdigest() + '.jpg'
+
+    def get(self, key):
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # 修改时间用作最近使用时间
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        with self.lock:
+            if not self.writable:
+                return
+            if self.total_bytes is None:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+                except OSError:
+                    self.writable = False
+                    return
+            try:
+                with open(os.path.join(self.directory, key), 'wb') as f:
+                    f.write(data)
+            except OSError:
+                return
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """从最久没有用过的开始删除，降到预算的 80%，避免每次写入都扫描目录"""
+        entries = sorted((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in os.scandir(self.directory) if entry.is_file())
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes * 0.8:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+
+class ThumbnailLoader(QObject):
+    """后台生成缩略图：先查磁盘缓存，没有时按缩小的分辨率解码（JPEG 直接在 DCT 阶段缩小）再缩放到缩略图尺寸
+
+    请求后进先出，队列最多 max_pending 个，快速滚动时最早的（已经滚出视野的）请求被丢弃，
+    每个结果附带图片当前已知的检测物体数
+    """
+    loaded = pyqtSignal(int, int, object, int)  # 批次、行号、缩略图（QImage）、检测到的物体数（未检测为 -1）
+    REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+    def __init__(self, cache, count_lookup, size=128, workers=2, max_pending=256):
+        super().__init__()
+        self.cache = cache
+        self.count_lookup = count_lookup  # 图片路径 -> 检测到的物体数，没有结果时返回 -1
+        self.size = size
+        self.max_pending = max_pending
+        self.pending = deque()  # 等待生成的 (行号, 图片路径)，右端是最新的请求
+        self.generation = 0  # 换一组图片时加 1，丢弃上一组的结果
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def request(self, row, image_path):
+        """请求一张缩略图，返回因队列满被丢弃的行号（没有时返回 None）"""
+        with self.condition:
+            self.pending.append((row, image_path))
+            dropped = self.pending.popleft()[0] if len(self.pending) > self.max_pending else None
+            self.condition.notify()
+            return dropped
+
+    def cancel(self):
+        """换一组图片：清空队列，正在生成的结果也会被丢弃"""
+        with self.condition:
+            self.pending.clear()
+            self.generation += 1
+
+    def close(self, timeout=2):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def decode(self, image_path):
+        """按缩小的分辨率解码，缩小后长边仍不小于缩略图尺寸"""
+        size = QImageReader(image_path).size()  # 只读文件头
+        longest = max(size.width(), size.height())
+        for factor, flag in self.REDUCED_FLAGS:
+            if longest // factor >= self.size:
+                return cv2.imread(image_path, flag)
+        return cv2.imread(image_path)
+
+    def thumbnail(self, image_path):
+        """返回缩略图的 JPEG 数据，图片读取失败时返回 None"""
+        key = self.cache.key(image_path, self.size)
+        if key is None:
+            return None
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        image = self.decode(image_path)
+        if image is None:
+            return None
+        height, width = image.shape[:2]
+        scale = self.size / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            return None
+        data = encoded.tobytes()
+        self.cache.put(key, data)
+        return data
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stop_event.is_set():
+                    self.condition.wait()
+                if self.stop_event.is_set():
+                    return
+                row, image_path = self.pending.pop()  # 最新的请求优先，就是当前看得到的缩略图
+                generation = self.generation
+            data = self.thumbnail(image_path)
+            image = QImage.fromData(data, 'JPG') if data is not None else QImage()
+            self.loaded.emit(generation, row, image, self.count_lookup(image_path))
+
+
+class StageMetrics:
+    """热路径各阶段耗时统计：每个阶段保留最近 window 帧，计算滑动平均和 p95，
+    可以把每帧的耗时追加写入 CSV 或 JSONL 文件做离线分析；只在界面线程中使用"""
+    # 导出文件的列：解码、跳帧、静止画面复用结果、推理、光流跟踪、plot()、缩放、画框、读缓存、转换 QPixmap、显示、采集到显示的延迟
+    STAGES = ['decode', 'skip', 'gate', 'infer', 'track', 'plot', 'resize', 'draw', 'cache', 'convert', 'display', 'latency']
+
+    def __init__(self, window=120):
+        self.window = window
+        self.stages = {}  # 阶段 -> 最近 window 次的耗时（毫秒）
+        self.frame_times = deque(maxlen=window)  # 最近几帧显示完成的时间，用于计算 FPS
+        self.export_file = None
+        self.export_writer = None  # CSV 时为 csv.DictWriter，JSONL 时为 None
+
+    def reset(self):
+        """切换视频或图片来源时清空统计"""
+        self.stages = {}
+        self.frame_times.clear()
+
+    def record(self, source, timings):
+        """记录一帧（或一张图片）各阶段的耗时，source 为 'video' 或 'image'"""
+        for stage in self.STAGES:
+            if stage in timings:
+                self.stages.setdefault(stage, deque(maxlen=self.window)).append(timings[stage])
+        self.frame_times.append(time.perf_counter())
+        if self.export_file is not None:
+            row = {'time': round(time.time(), 3), 'source': source, 'frame': timings.get('frame')}
+            row.update((stage, round(timings[stage], 3)) for stage in self.STAGES if stage in timings)
+            if self.export_writer is not None:
+                self.export_writer.writerow(row)
+            else:
+                self.export_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def fps(self):
+        if len(self.frame_times) < 2:
+            return 0.0
+        return (len(self.frame_times) - 1) / max(self.frame_times[-1] - self.frame_times[0], 1e-6)
+
+    def summary(self):
+        """各阶段的 (平均值, p95)，单位毫秒"""
+        summary = {}
+        for stage in self.STAGES:
+            samples = self.stages.get(stage)
+            if samples:
+                values = np.fromiter(samples, dtype=np.float64, count=len(samples))
+                summary[stage] = (float(values.mean()), float(np.percentile(values, 95)))
+        return summary
+
+    def hud_text(self):
+        lines = [f"FPS {self.fps():5.1f}", "阶段       平均    p95"]
+        lines += [f"{stage:<8}{mean:7.1f}{p95:7.1f}" for stage, (mean, p95) in self.summary().items()]
+        return "\n".join(lines)
+
+    def start_export(self, path):
+        """开始把每帧耗时追加写入文件，后缀为 .csv 时写 CSV，否则写 JSONL"""
+        self.stop_export()
+        self.export_file = open(path, 'a', encoding='utf-8', newline='')
+        if path.lower().endswith('.csv'):
+            self.export_writer = csv.DictWriter(self.export_file, ['time', 'source', 'frame'] + self.STAGES)
+            if self.export_file.tell() == 0:
+                self.export_writer.writeheader()
+
+    def stop_export(self):
+        if self.export_file is not None:
+            self.export_file.close()
+            self.export_file = None
+            self.export_writer = None
+
+
+class FrameQueue:
+    """有界帧队列：队列满时丢弃最旧的一帧（drop-oldest），生产者永远不会阻塞
+    逐帧处理模式下生产者可以用 block=True 等待空位，不丢帧"""
+
+    def __init__(self, maxsize=2):
+        self.items = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0  # 被丢弃的帧数
+
+    def put(self, item, block=False):
+        """放入一帧，队列满了就挤掉最旧的一帧；block=True 时等待空位，关闭后放弃"""
+        with self.condition:
+            while block and len(self.items) == self.items.maxlen and not self.closed:
+                self.condition.wait(0.1)
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout=0.1):
+        """取出最旧的一帧，超时返回 None"""
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.items:
+                item = self.items.popleft()
+                self.condition.notify_all()  # 唤醒等待空位的生产者
+                return item
+            return None
+
+    def wait_empty(self):
+        """等待消费者把队列取空，关闭时返回 False"""
+        with self.condition:
+            while self.items and not self.closed:
+                self.condition.wait(0.1)
+            return not self.closed
+
+    def close(self):
+        """生产者已结束，唤醒所有等待的消费者"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def is_full(self):
+        with self.condition:
+            return len(self.items) == self.items.maxlen
+
+    def is_drained(self):
+        """生产者已结束并且队列已取空"""
+        with self.condition:
+            return self.closed and not self.items
+
+
+class FrameBuffers:
+    """预先分配的显示缓冲区：渲染线程写入，界面线程转换为 QPixmap 后归还，只在显示尺寸变化时重新分配
+    同时最多借出 count 个，界面线程来不及显示时渲染线程会等待，信号不会在界面线程里堆积"""
+
+    def __init__(self, count=3):
+        self.count = count
+        self.shape = None
+        self.free = []
+        self.outstanding = 0  # 已借出还未归还的缓冲区数量
+        self.condition = threading.Condition()
+
+    def acquire(self, shape, stop_event):
+        """借出一个指定尺寸的缓冲区，停止时返回 None"""
+        with self.condition:
+            while self.outstanding >= self.count:
+                if stop_event.is_set():
+                    return None
+                self.condition.wait(0.1)
+            if shape != self.shape:
+                self.shape = shape
+                self.free = []  # 尺寸变了，旧缓冲区不再复用
+            self.outstanding += 1
+            return self.free.pop() if self.free else np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        with self.condition:
+            self.outstanding -= 1
+            if buffer.shape == self.shape:
+                self.free.append(buffer)
+            self.condition.notify()
+
+    def resize(self, frame, size, stop_event):
+        """先按标签尺寸（保持宽高比）用 cv2.resize 缩放到借出的缓冲区，之后的转换都只处理显示尺寸的数据，停止时返回 None"""
+        height, width = frame.shape[:2]
+        scale = min(size[0] / width, size[1] / height)
+        display_width, display_height = max(1, int(width * scale)), max(1, int(height * scale))
+        buffer = self.acquire((display_height, display_width, 3), stop_event)
+        if buffer is not None:
+            # INTER_LINEAR 比 INTER_AREA 快一个数量级，画质仍好于原来 QPixmap.scaled 的最近邻缩放
+            cv2.resize(frame, (display_width, display_height), dst=buffer, interpolation=cv2.INTER_LINEAR)
+        return buffer
+
+
+class CameraSource(QObject):
+    """摄像头：在后台线程中打开设备，专门的采集线程不停读取并只保留最新的一帧
+
+    接口与 cv2.VideoCapture 相同（read/grab/get/set/release），可以直接交给 VideoPipeline，
+    推理线程每次拿到的都是最新画面，推理变慢时延迟不会越积越多
+    """
+    opened = pyqtSignal(bool)  # 打开成功或失败
+
+    def __init__(self, index=0, backend=cv2.CAP_ANY, resolution=None, fps=None):
+        super().__init__()
+        self.index = index
+        self.backend = backend
+        self.resolution = resolution  # (宽, 高)，None 表示使用设备默认值
+        self.fps = fps
+        self.capture = None
+        self.frame = None  # 最新的一帧
+        self.frame_id = 0  # 每采集一帧加 1
+        self.read_id = 0  # read() 上一次返回的帧
+        self.ended = False
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def open(self):
+        """开始在后台打开摄像头，完成后发出 opened 信号"""
+        self.thread.start()
+
+    def open_device(self, configure):
+        """打开设备，指定的后端打不开时改用默认后端；configure 为 True 时设置分辨率和帧率"""
+        capture = cv2.VideoCapture(self.index, self.backend)
+        if not capture.isOpened() and self.backend != cv2.CAP_ANY:
+            capture.release()
+            capture = cv2.VideoCapture(self.index, cv2.CAP_ANY)
+        if not capture.isOpened():
+            capture.release()
+            return None
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 驱动只缓存一帧，支持的后端可以进一步降低延迟
+        if configure:
+            if self.resolution:
+                capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+                capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+            if self.fps:
+                capture.set(cv2.CAP_PROP_FPS, self.fps)
+        return capture
+
+    def run(self):
+        """采集线程：打开设备后不停读取，覆盖单个“最新帧”缓冲区"""
+        capture = self.open_device(configure=bool(self.resolution or self.fps))
+        ret, frame = capture.read() if capture is not None else (False, None)
+        if not ret and capture is not None and (self.resolution or self.fps):
+            # 设备不接受指定的分辨率或帧率，使用默认设置重新打开
+            capture.release()
+            capture = self.open_device(configure=False)
+            ret, frame = capture.read() if capture is not None else (False, None)
+        if not ret or self.stop_event.is_set():
+            if capture is not None:
+                capture.release()
+            self.finish()
+            self.opened.emit(False)
+            return
+        self.capture = capture
+        self.store(frame)
+        self.opened.emit(True)
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                self.store(frame)
+        finally:
+            capture.release()
+            self.finish()
+
+    def store(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.frame_id += 1
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.ended = True
+            self.condition.notify_all()
+
+    def read(self):
+        """返回比上一次更新的一帧，摄像头断开或已释放时返回 (False, None)"""
+        with self.condition:
+            while self.frame_id == self.read_id and not self.ended:
+                self.condition.wait(0.1)
+            if self.frame_id == self.read_id:
+                return False, None
+            self.read_id = self.frame_id
+            return True, self.frame
+
+    def grab(self):
+        return not self.ended
+
+    def get(self, prop):
+        capture = self.capture
+        return capture.get(prop) if capture is not None else 0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        """停止采集线程，设备由采集线程释放（正在打开时也会在打开后立即释放）"""
+        self.stop_event.set()
+        self.finish()
+
+
+class MotionGate:
+    """运动检测：把帧缩小成灰度图与上一次推理时的帧做差，变化的像素比例低于 threshold 时认为画面静止，
+    可以直接沿用上一次的检测结果；连续跳过 refresh_interval 帧后强制推理一次，避免缓慢变化一直被忽略"""
+
+    def __init__(self, threshold=0.01, refresh_interval=30, width=160, pixel_threshold=25):
+        self.threshold = threshold  # 变化像素比例阈值，越小越灵敏
+        self.refresh_interval = refresh_interval
+        self.width = width  # 差分在宽 width 像素的缩小图上计算
+        self.pixel_threshold = pixel_threshold  # 灰度差超过这个值才算变化，过滤噪点
+        self.reference = None  # 上一次推理时的缩小灰度图
+        self.skipped = 0  # 连续跳过的帧数
+        self.changed_ratio = 0.0
+
+    def prepare(self, frame):
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, round(height * self.width / width))), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+    def is_static(self, frame):
+        """画面相对上一次推理时没有明显变化时返回 True；返回 False 时调用方会推理，参考帧随之更新"""
+        gray = self.prepare(frame)
+        if self.reference is not None and self.reference.shape == gray.shape and self.skipped < self.refresh_interval:
+            diff = cv2.absdiff(gray, self.reference)
+            self.changed_ratio = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1]) / diff.size
+            if self.changed_ratio < self.threshold:
+                self.skipped += 1
+                return True
+        self.reference = gray
+        self.skipped = 0
+        return False
+
+
+class VideoPipeline(QObject):
+    """视频处理流水线：采集线程 -> 推理线程 -> 渲染线程，只把渲染好的图像通过信号交给界面线程"""
+    frame_ready = pyqtSignal(object, object, object, object)  # 显示尺寸的原始帧、标注帧（BGR 缓冲区）、检测结果、各阶段耗时
+    finished = pyqtSignal()  # 视频播放结束或摄像头断开
+
+    def __init__(self, worker, capture, live=False, realtime=True, detect_interval=1, motion_gate=None, queue_size=2,
+                 start_frame=0, results_cache=None):
+        super().__init__()
+        self.worker = worker
+        self.capture = capture
+        self.start_frame = start_frame  # 视频文件从第几帧开始播放
+        self.results_cache = results_cache  # VideoResultCache，缓存中有的帧不再推理，新推理的帧写入缓存
+        self.detect_interval = detect_interval  # 每隔几帧做一次完整检测，中间的帧用光流跟踪；1 表示每帧都检测
+        self.tracker = BoxTracker() if detect_interval > 1 else None
+        self.frames_since_detect = 0
+        self.motion_gate = motion_gate  # MotionGate，画面静止时沿用上一次的结果；None 表示每帧都处理
+        self.gated_frames = 0  # 因画面静止跳过推理的帧数
+        self.last_output = None  # 上一帧的 (detections, results)
+        self.exporter = None  # 正在录制时为 VideoExporter，推理线程把每帧的结果交给它编码
+        self.live = live  # 摄像头等实时流，按设备速度读取
+        self.realtime = realtime  # 视频文件：True 按原速播放（跟不上时丢帧），False 逐帧处理（离线）
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        self.source_fps = fps if 1 <= fps <= 240 else 30  # 读不到帧率时按 30 FPS
+        self.inference_time = 0.0  # 推理耗时的滑动平均（秒）
+        self.skipped_frames = 0  # 用 grab() 或跳转跳过的帧数
+        self.processed_frames = 0  # 已推理的帧数
+        self.start_time = None
+        self.stats = DetectionStats(worker.model.names)  # 整段视频的累计统计，推理线程每帧更新
+        self.capture_queue = FrameQueue(queue_size)  # 采集 -> 推理
+        self.render_queue = FrameQueue(queue_size)  # 推理 -> 渲染
+        self.target_sizes = ((640, 480), (640, 480))  # 左右两个标签的显示尺寸
+        self.buffers = (FrameBuffers(), FrameBuffers())  # 左右两个标签的显示缓冲区
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.capture_loop, daemon=True),
+            threading.Thread(target=self.inference_loop, daemon=True),
+            threading.Thread(target=self.render_loop, daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """请求停止，不等待线程退出，界面不会被卡住"""
+        self.stop_event.set()
+        self.capture_queue.close()
+        self.render_queue.close()
+
+    def wait(self, timeout=2):
+        """等待所有线程退出（仅在退出程序时使用）"""
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def set_target_size(self, size1, size2):
+        """更新左右标签的显示尺寸，渲染线程会按新尺寸缩放"""
+        self.target_sizes = ((size1.width(), size1.height()), (size2.width(), size2.height()))
+
+    def capture_loop(self):
+        """采集线程：按播放模式读取帧，队列里的元素为 (帧号, 帧)"""
+        # start_time 是第 0 帧的显示时刻，从中间开始播放时往前推
+        self.start_time = time.perf_counter() - self.start_frame / self.source_fps
+        if self.start_frame:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+        try:
+            if self.live:
+                self.capture_live()
+            elif self.realtime:
+                self.capture_realtime()
+            else:
+                self.capture_every_frame()
+        finally:
+            self.capture.release()
+            self.capture_queue.close()
+
+    def capture_live(self):
+        """摄像头：推理线程取走上一帧后再读取，CameraSource 总是返回最新的一帧，延迟不会累积"""
+        position = 0
+        while not self.stop_event.is_set():
+            if not self.capture_queue.wait_empty():
+                break
+            item = self.read_frame(position)
+            if item is None:
+                break
+            self.capture_queue.put(item)
+            position += 1
+
+    def read_frame(self, position):
+        """读取一帧并记录解码耗时，返回 (帧, 耗时记录)，读取失败返回 None
+        耗时记录随帧经过推理、渲染线程，最后交给界面线程统计"""
+        start = time.perf_counter()
+        ret, frame = self.capture.read()
+        if not ret:
+            return None
+        now = time.perf_counter()
+        return frame, {'frame': position, 'decode': (now - start) * 1000, 'captured': now}
+
+    def capture_realtime(self):
+        """视频文件按原速播放：按墙上时钟计算此刻应该显示第几帧，推理跟不上时用 grab() 跳过中间的帧，不解码输出"""
+        position = self.start_frame  # 下一次 read() 得到的帧号
+        while not self.stop_event.is_set():
+            # 推理线程取走上一帧之后再读，不解码注定会被丢弃的帧
+            if not self.capture_queue.wait_empty():
+                break
+            paced = self.seek_realtime(self.capture, position, self.source_fps, self.start_time, self.inference_time, self.stop_event)
+            if paced is None:
+                break
+            position, skip, skip_time = paced
+            self.skipped_frames += skip
+            item = self.read_frame(position)
+            if item is None:
+                break
+            item[1]['skip'] = skip_time
+            self.capture_queue.put(item)
+            position += 1
+
+    @staticmethod
+    def seek_realtime(capture, position, source_fps, start_time, inference_time, stop_event):
+        """按原速播放时选下一帧：结果要再过 inference_time 才会显示，按显示时刻计算应该读第几帧。
+        落后时跳过中间的帧，超前时等到这一帧的显示时刻；返回 (帧号, 跳过的帧数, 跳帧耗时毫秒)，停止时返回 None"""
+        elapsed = time.perf_counter() - start_time + inference_time
+        target = int(elapsed * source_fps)
+        if target > position:
+            skip_start = time.perf_counter()
+            skip = target - position
+            if skip > source_fps:
+                # 落后超过 1 秒，直接跳转比逐帧 grab 快
+                capture.set(cv2.CAP_PROP_POS_FRAMES, target)
+            else:
+                for _ in range(skip):
+                    capture.grab()
+            return target, skip, (time.perf_counter() - skip_start) * 1000
+        # 比原速快，等到这一帧的显示时刻
+        delay = start_time + position / source_fps - inference_time - time.perf_counter()
+        if delay > 0 and stop_event.wait(delay):
+            return None
+        return position, 0, 0
+
+    def capture_every_frame(self):
+        """逐帧处理（离线）：每一帧都推理，队列满时等待而不是丢帧"""
+        position = self.start_frame
+        while not self.stop_event.is_set():
+            item = self.read_frame(position)
+            if item is None:
+                break
+            self.capture_queue.put(item, block=True)
+            position += 1
+
+    def stats_text(self):
+        """播放状态：源帧率、实际处理帧率、每帧平均处理耗时、跳帧比例"""
+        if self.start_time is None:
+            return ""
+        elapsed = max(time.perf_counter() - self.start_time - self.start_frame / self.source_fps, 1e-6)
+        total = self.processed_frames + self.skipped_frames
+        if self.detect_interval > 1 or self.motion_gate is not None:
+            # 有的帧不推理，显示每帧的平均处理时间
+            text = f"处理 {self.processed_frames / elapsed:.1f} FPS，每帧平均 {self.inference_time * 1000:.0f} ms"
+        else:
+            text = f"处理 {self.processed_frames / elapsed:.1f} FPS，推理 {self.inference_time * 1000:.0f} ms"
+        if self.detect_interval > 1:
+            text += f"（每 {self.detect_interval} 帧检测一次）"
+        if self.motion_gate is not None and self.processed_frames:
+            text += f"，画面静止跳过 {self.gated_frames / self.processed_frames:.0%} 的推理"
+        if self.live:
+            return text  # 摄像头的旧帧由 CameraSource 直接覆盖，不统计跳帧
+        text = f"源 {self.source_fps:.1f} FPS，" + text
+        if total:
+            text += f"，跳过 {self.skipped_frames / total:.0%} 的帧"
+        return text
+
+    def inference_loop(self):
+        """推理线程：检测，标注交给渲染线程在显示尺寸上绘制"""
+        while not self.stop_event.is_set():
+            item = self.capture_queue.get()
+            if item is None:
+                if self.capture_queue.is_drained():
+                    break
+                continue
+            frame, timings = item
+            start = time.perf_counter()
+            tracker = self.tracker
+            cache = self.results_cache if self.results_cache is not None and self.results_cache.matches(self.worker) else None
+            cached = cache.get(timings['frame']) if cache is not None else None
+            if cached is not None:
+                # 回放处理过的帧：直接使用缓存的检测结果，只解码和绘制
+                detections = self.worker.filter_detections(cached)
+                if tracker is not None:
+                    detections, new_classes = tracker.update(frame, detections)
+                    self.stats.add_unique(new_classes)
+                    self.frames_since_detect = 0
+                results = [detections.to_results(frame)]
+                elapsed = time.perf_counter() - start
+                timings['cache'] = elapsed * 1000
+            elif self.motion_gate is not None and self.last_output is not None and self.motion_gate.is_static(frame):
+                # 画面静止：沿用上一帧的检测结果，不推理也不跟踪
+                detections, results = self.last_output
+                self.gated_frames += 1
+                elapsed = time.perf_counter() - start
+                timings['gate'] = elapsed * 1000
+            elif tracker is not None and tracker.tracks is not None and not tracker.lost and self.frames_since_detect < self.detect_interval - 1:
+                # 两次检测之间：用光流移动上一次的框，不运行模型
+                detections = tracker.propagate(frame)
+                results = [detections.to_results(frame)]
+                self.frames_since_detect += 1
+                elapsed = time.perf_counter() - start
+                timings['track'] = elapsed * 1000
+            else:
+                # 检测直接使用原始 BGR 帧；结果不缓存时把类别等过滤条件下推到推理
+                results = self.worker.detect_image(frame, **(self.worker.pushdown_params() if cache is None else {}))
+                detections = Detections.from_results(results[0])
+                if cache is not None:
+                    cache.put(timings['frame'], detections)  # 缓存过滤前的原始结果
+                filtered = self.worker.filter_detections(detections)
+                if filtered is not detections:
+                    detections = filtered
+                    results = [detections.to_results(frame)]
+                if tracker is not None:
+                    detections, new_classes = tracker.update(frame, detections)
+                    results = [detections.to_results(frame)]
+                    self.stats.add_unique(new_classes)
+                    self.frames_since_detect = 0
+                elapsed = time.perf_counter() - start
+                timings['infer'] = elapsed * 1000
+            self.last_output = (detections, results)
+            self.stats.update(detections, timings['frame'])
+            # inference_time 是每帧的平均处理时间（跳帧检测时包括跟踪的帧），实时播放按它选帧
+            if not self.processed_frames:
+                # 第一帧包含模型预热，不计入耗时，播放时钟从这一帧显示时重新开始
+                self.start_time = time.perf_counter() - timings['frame'] / self.source_fps
+            elif self.processed_frames == 1:
+                self.inference_time = elapsed
+            else:
+                self.inference_time = 0.8 * self.inference_time + 0.2 * elapsed  # 滑动平均
+            self.processed_frames += 1
+            # 类别名不是 ASCII 时 FastAnnotator 画不了，仍在原始分辨率上用 plot() 绘制
+            annotated_frame = None
+            if not self.worker.annotator.supported:
+                start = time.perf_counter()
+                annotated_frame = results[0].plot()
+                timings['plot'] = (time.perf_counter() - start) * 1000
+            exporter = self.exporter
+            if exporter is not None:
+                # 摄像头的帧号是读取次数，按放入的时刻换算写入位置；逐帧处理时等待编码，一帧不丢
+                exporter.put(frame, detections, None if self.live else timings['frame'], annotated_frame, block=not (self.live or self.realtime))
+            self.render_queue.put((frame, annotated_frame, detections, results, timings), block=not (self.live or self.realtime))
+        self.render_queue.close()
+
+    def render_loop(self):
+        """渲染线程：把帧缩小到显示尺寸写入复用的缓冲区，通过信号交给界面线程"""
+        while not self.stop_event.is_set():
+            item = self.render_queue.get()
+            if item is None:
+                if self.render_queue.is_drained():
+                    if not self.stop_event.is_set():
+                        self.finished.emit()
+                    break
+                continue
+            frame, annotated_frame, detections, results, timings = item
+            size1, size2 = self.target_sizes
+            start = time.perf_counter()
+            display1 = self.buffers[0].resize(frame, size1, self.stop_event)
+            if display1 is None:
+                break
+            if annotated_frame is not None:
+                display2 = self.buffers[1].resize(annotated_frame, size2, self.stop_event)
+            elif size1 == size2:
+                # 左右尺寸相同，复制显示尺寸的原始帧后直接在上面画框，不再缩放第二次
+                display2 = self.buffers[1].acquire(display1.shape, self.stop_event)
+                if display2 is not None:
+                    np.copyto(display2, display1)
+            else:
+                display2 = self.buffers[1].resize(frame, size2, self.stop_event)
+            if display2 is None:
+                break
+            draw_start = time.perf_counter()
+            timings['resize'] = (draw_start - start) * 1000  # 包括等待空闲缓冲区的时间
+            if annotated_frame is None:
+                self.worker.annotator.draw(display2, detections, display2.shape[1] / frame.shape[1], frame.shape)
+                timings['draw'] = (time.perf_counter() - draw_start) * 1000
+            self.frame_ready.emit(display1, display2, results, timings)
+
+    def release_buffers(self, display1, display2):
+        """界面线程显示完后归还缓冲区"""
+        self.buffers[0].release(display1)
+        self.buffers[1].release(display2)
+
+
+class VideoSeeker(QObject):
+    """暂停时的视频定位和后台补检：拖动进度条时只处理最新请求的一帧，有缓存直接返回，没有就检测一次；
+    空闲时从当前位置往后顺序解码，按批检测还没有结果的帧，写入 VideoResultCache；
+    保存缓存（拼接数组、写 .npz）也在这个线程中进行，关闭时保存一次"""
+    frame_ready = pyqtSignal(int, object, object)  # 帧号、原始帧、检测结果（Detections）
+    progress = pyqtSignal(float)  # 已检测的帧占比
+
+    def __init__(self, worker, video_path, cache, batch_size=4, max_grab=30):
+        super().__init__()
+        self.worker = worker
+        self.video_path = video_path
+        self.cache = cache
+        self.batch_size = batch_size  # 补检每批的帧数，较小的批次让播放或拖动请求能尽快拿到模型
+        self.max_grab = max_grab  # 往后不超过这么多帧时逐帧 grab()，比跳转快
+        self.requested = None  # 等待显示的帧号，只保留最新的请求
+        self.fill_from = 0  # 补检从这一帧开始往后找
+        self.filling = False  # 播放时暂停补检，不和播放抢模型
+        self.position = 0  # 下一次 read() 得到的帧号
+        self.save_requested = False
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def request(self, frame):
+        """显示第 frame 帧，之后从这里继续补检"""
+        with self.condition:
+            self.requested = frame
+            self.fill_from = frame
+            self.filling = True
+            self.condition.notify_all()
+
+    def pause(self):
+        """开始播放：放弃未处理的请求并暂停补检（正在检测的一批会做完）"""
+        with self.condition:
+            self.requested = None
+            self.filling = False
+
+    def save(self):
+        """在后台线程中把缓存写入磁盘，长视频保存时界面不会卡住"""
+        with self.condition:
+            self.save_requested = True
+            self.condition.notify_all()
+
+    def close(self, timeout=2):
+        """停止线程，线程退出前保存缓存；timeout 为 None 时等待保存完（关闭窗口时）"""
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def read_at(self, capture, frame):
+        """读取第 frame 帧：就在后面不远时顺序 grab()，否则跳转"""
+        if frame != self.position:
+            if 0 < frame - self.position <= self.max_grab:
+                for _ in range(frame - self.position):
+                    capture.grab()
+            else:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        ret, image = capture.read()
+        self.position = frame + 1
+        return image if ret else None
+
+    def next_task(self):
+        """等待下一个任务：返回 ('show', 帧号)、('save', None) 或 ('fill', 帧号)，停止时返回 None"""
+        with self.condition:
+            while not self.stop_event.is_set():
+                if self.requested is not None:
+                    frame, self.requested = self.requested, None
+                    return 'show', frame
+                if self.save_requested:
+                    self.save_requested = False
+                    return 'save', None
+                if self.filling:
+                    frame = self.cache.next_missing(self.fill_from)
+                    if frame is not None:
+                        return 'fill', frame
+                    self.filling = False  # 整个视频都已检测
+                self.condition.wait(0.2)
+        return None
+
+    def run(self):
+        capture = cv2.VideoCapture(self.video_path)
+        try:
+            while True:
+                task = self.next_task()
+                if task is None:
+                    break
+                kind, frame = task
+                if kind == 'save':
+                    self.cache.save()
+                    continue
+                if kind == 'show':
+                    image = self.read_at(capture, frame)
+                    if image is None:
+                        continue
+                    matches = self.cache.matches(self.worker)  # 切换模型或参数的瞬间不读写旧参数的缓存
+                    detections = self.cache.get(frame) if matches else None
+                    if detections is None:
+                        detections = Detections.from_results(self.worker.detect_image(image)[0])
+                        if matches:
+                            self.cache.put(frame, detections)
+                    self.frame_ready.emit(frame, image, detections)
+                    continue
+                # 补检：从 frame 开始顺序读取连续的、还没有结果的帧
+                frames, images = [], []
+                while len(frames) < self.batch_size and frame not in self.cache:
+                    image = self.read_at(capture, frame)
+                    if image is None:
+                        break
+                    frames.append(frame)
+                    images.append(image)
+                    frame += 1
+                if not frames:
+                    self.cache.truncate(frame)  # 读不到这一帧：视频实际帧数比文件记录的少
+                    continue
+                results = self.worker.detect_batch(images, self.batch_size)
+                if not self.cache.matches(self.worker):
+                    continue
+                for index, result in zip(frames, results):
+                    self.cache.put(index, Detections.from_results(result))
+                with self.condition:
+                    if self.filling:
+                        self.fill_from = frame
+                self.progress.emit(self.cache.coverage())
+        finally:
+            capture.release()
+            self.cache.save()
+
+
+class MultiStreamPipeline(QObject):
+    """多路视频流水线：所有路共用一个模型，每路一个采集线程，一个推理线程，一个渲染线程
+
+    每路最多只有一帧在等待推理（上一帧被取走后才读取下一帧），推理线程每轮把各路等待的帧合成一批，
+    一次 predict 检测完；路数多于 batch_size 时优先处理上一次参与推理最早的路，帧率不同的各路都能轮到
+    """
+    frame_ready = pyqtSignal(int, object, object, object)  # 路号、标注帧（显示尺寸的 BGR 缓冲区）、检测结果、各阶段耗时
+    finished = pyqtSignal()  # 所有路都已结束
+
+    def __init__(self, worker, captures, realtime=True, batch_size=8, gather_timeout=0.01):
+        super().__init__()
+        self.worker = worker
+        self.captures = captures  # cv2.VideoCapture 或 CameraSource
+        self.realtime = realtime  # 视频文件：True 按原速播放（跟不上时丢帧），False 逐帧处理；摄像头总是取最新帧
+        self.batch_size = batch_size  # 每轮最多合并几路
+        self.gather_timeout = gather_timeout  # 有一路的帧到达后，最多再等多久让其他路凑进同一批（秒）
+        self.source_fps = []
+        for capture in captures:
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            self.source_fps.append(fps if 1 <= fps <= 240 else 30)  # 读不到帧率时按 30 FPS
+        self.slots = [None] * len(captures)  # 每路等待推理的 (帧, 耗时记录)
+        self.ended = [False] * len(captures)
+        self.last_served = [0] * len(captures)  # 每路上一次参与推理的轮次
+        self.processed_frames = [0] * len(captures)
+        self.skipped_frames = [0] * len(captures)
+        self.rounds = 0  # 推理的轮数
+        self.inference_time = 0.0  # 每轮推理耗时的滑动平均（秒）
+        self.start_time = None
+        self.stats = [DetectionStats(worker.model.names) for _ in captures]  # 每路的累计统计
+        self.condition = threading.Condition()
+        self.render_queue = FrameQueue(2 * len(captures))  # 推理 -> 渲染
+        self.target_sizes = [(320, 240)] * len(captures)  # 每路格子的显示尺寸
+        self.buffers = [FrameBuffers() for _ in captures]
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=self.capture_loop, args=(index,), daemon=True) for index in range(len(captures))]
+        self.threads += [
+            threading.Thread(target=self.inference_loop, daemon=True),
+            threading.Thread(target=self.render_loop, daemon=True),
+        ]
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        for capture in self.captures:
+            if isinstance(capture, CameraSource):
+                capture.open()  # 在后台打开，read() 会等到第一帧
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """请求停止，不等待线程退出"""
+        self.stop_event.set()
+        for capture in self.captures:
+            if isinstance(capture, CameraSource):
+                capture.release()  # 唤醒还在等待摄像头打开的采集线程
+        with self.condition:
+            self.condition.notify_all()
+        self.render_queue.close()
+
+    def wait(self, timeout=2):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def set_target_sizes(self, sizes):
+        """更新每路格子的显示尺寸"""
+        self.target_sizes = [(size.width(), size.height()) for size in sizes]
+
+    def capture_loop(self, index):
+        """第 index 路的采集线程：推理线程取走上一帧后再读取；视频文件按播放模式选帧，摄像头直接取最新帧"""
+        capture = self.captures[index]
+        live = isinstance(capture, CameraSource)
+        position = 0
+        try:
+            while True:
+                with self.condition:
+                    while self.slots[index] is not None and not self.stop_event.is_set():
+                        self.condition.wait(0.1)
+                if self.stop_event.is_set():
+                    break
+                skip_time = 0
+                if self.realtime and not live:
+                    paced = VideoPipeline.seek_realtime(capture, position, self.source_fps[index], self.start_time, self.inference_time, self.stop_event)
+                    if paced is None:
+                        break
+                    position, skip, skip_time = paced
+                    self.skipped_frames[index] += skip
+                start = time.perf_counter()
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                now = time.perf_counter()
+                with self.condition:
+                    self.slots[index] = (frame, {'frame': position, 'decode': (now - start) * 1000, 'skip': skip_time, 'captured': now})
+                    self.condition.notify_all()
+                position += 1
+        finally:
+            capture.release()
+            with self.condition:
+                self.ended[index] = True
+                self.condition.notify_all()
+
+    def take_batch(self):
+        """取出一批等待推理的帧 [(路号, 帧, 耗时记录)]，上一次参与推理最早的路优先；全部结束或停止时返回 None"""
+        with self.condition:
+            while not any(slot is not None for slot in self.slots):
+                if all(self.ended) or self.stop_event.is_set():
+                    return None
+                self.condition.wait(0.1)
+            # 其他还在运行的路稍等片刻，凑成更大的一批
+            deadline = time.perf_counter() + self.gather_timeout
+            while not all(slot is not None or ended for slot, ended in zip(self.slots, self.ended)):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.stop_event.is_set():
+                    break
+                self.condition.wait(remaining)
+            ready = sorted((index for index, slot in enumerate(self.slots) if slot is not None), key=self.last_served.__getitem__)
+            self.rounds += 1
+            batch = []
+            for index in ready[:self.batch_size]:
+                batch.append((index, *self.slots[index]))
+                self.slots[index] = None
+                self.last_served[index] = self.rounds
+            self.condition.notify_all()  # 唤醒等待取走的采集线程
+            return batch
+
+    def inference_loop(self):
+        """推理线程：每轮把各路的帧合成一批检测，结果按路交给渲染线程"""
+        while not self.stop_event.is_set():
+            batch = self.take_batch()
+            if batch is None:
+                break
+            start = time.perf_counter()
+            results = self.worker.detect_batch([frame for _, frame, _ in batch], self.batch_size, **self.worker.pushdown_params())
+            elapsed = time.perf_counter() - start
+            if self.rounds == 2:
+                self.inference_time = elapsed  # 第一轮包含新批量尺寸的预热，不计入
+            elif self.rounds > 2:
+                self.inference_time = 0.8 * self.inference_time + 0.2 * elapsed  # 滑动平均
+            for (index, frame, timings), result in zip(batch, results):
+                detections = Detections.from_results(result)
+                filtered = self.worker.filter_detections(detections)
+                if filtered is not detections:
+                    detections = filtered
+                    result = detections.to_results(frame)
+                timings['infer'] = elapsed * 1000  # 整批的耗时，即这一帧等待推理结果的时间
+                self.stats[index].update(detections, timings['frame'])
+                self.processed_frames[index] += 1
+                annotated_frame = None
+                if not self.worker.annotator.supported:
+                    plot_start = time.perf_counter()
+                    annotated_frame = result.plot()
+                    timings['plot'] = (time.perf_counter() - plot_start) * 1000
+                self.render_queue.put((index, frame, annotated_frame, detections, [result], timings), block=not self.realtime)
+        self.render_queue.close()
+
+    def render_loop(self):
+        """渲染线程：把每路的帧缩小到格子尺寸并画框，通过信号交给界面线程"""
+        while not self.stop_event.is_set():
+            item = self.render_queue.get()
+            if item is None:
+                if self.render_queue.is_drained():
+                    if not self.stop_event.is_set():
+                        self.finished.emit()
+                    break
+                continue
+            index, frame, annotated_frame, detections, results, timings = item
+            start = time.perf_counter()
+            display = self.buffers[index].resize(frame if annotated_frame is None else annotated_frame, self.target_sizes[index], self.stop_event)
+            if display is None:
+                break
+            draw_start = time.perf_counter()
+            timings['resize'] = (draw_start - start) * 1000
+            if annotated_frame is None:
+                self.worker.annotator.draw(display, detections, display.shape[1] / frame.shape[1], frame.shape)
+                timings['draw'] = (time.perf_counter() - draw_start) * 1000
+            self.frame_ready.emit(index, display, results, timings)
+
+    def release_buffer(self, index, display):
+        """界面线程显示完后归还缓冲区"""
+        self.buffers[index].release(display)
+
+    def stats_text(self):
+        """播放状态：路数、合计处理帧率、每批平均路数、每轮推理耗时、跳帧比例"""
+        if self.start_time is None or not self.rounds:
+            return ""
+        elapsed = max(time.perf_counter() - self.start_time, 1e-6)
+        processed = sum(self.processed_frames)
+        text = (f"{len(self.captures)} 路，合计处理 {processed / elapsed:.1f} FPS，"
+                f"每批平均 {processed / self.rounds:.1f} 路，每批推理 {self.inference_time * 1000:.0f} ms")
+        skipped = sum(self.skipped_frames)
+        if skipped:
+            text += f"，视频跳过 {skipped / (skipped + processed):.0%} 的帧"
+        return text
+
+
+class VideoExporter:
+    """导出标注视频：专门的编码线程在原始分辨率上画框并写入 cv2.VideoWriter，调用方只把帧放入有界队列
+
+    实时播放时队列满了丢弃最旧的帧，编码再慢也不会拖慢显示；离线导出时等待空位，一帧不丢。
+    实时播放跳过的帧用上一帧补齐，导出的视频保持原来的帧率和时长
+    """
+
+    def __init__(self, worker, path, fps, queue_size=32):
+        self.worker = worker
+        self.path = path
+        self.fps = fps
+        self.queue = FrameQueue(queue_size)
+        self.writer = None  # 收到第一帧、知道分辨率后再创建
+        self.written = 0  # 写入的帧数（包括补齐用的重复帧）
+        self.error = None
+        self.start_time = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.thread.start()
+
+    @property
+    def dropped(self):
+        """队列满时丢弃的帧数"""
+        return self.queue.dropped
+
+    def put(self, frame, detections, position=None, annotated_frame=None, block=False):
+        """放入一帧原始分辨率的帧和检测结果，position 为帧号，为 None（摄像头）时按放入的时刻换算；
+        annotated_frame 为已经画好框的帧（类别名不是 ASCII 时由 plot() 绘制）"""
+        if position is None:
+            position = int((time.perf_counter() - self.start_time) * self.fps)
+        self.queue.put((frame, detections, position, annotated_frame), block)
+
+    def close(self, wait=True):
+        """不再放入新帧，编码线程写完队列中剩下的帧后关闭文件；wait 为 True 时等待写完"""
+        self.queue.close()
+        if wait:
+            self.thread.join()
+
+    def open_writer(self, shape):
+        fourcc = 'MJPG' if self.path.lower().endswith('.avi') else 'mp4v'
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*fourcc), self.fps, (shape[1], shape[0]))
+        if not writer.isOpened():
+            writer.release()
+            return None
+        return writer
+
+    def run(self):
+        """编码线程：画框、补齐跳过的帧、写入文件"""
+        last_frame, last_position = None, None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    if self.queue.is_drained():
+                        break
+                    continue
+                frame, detections, position, annotated_frame = item
+                if last_position is not None and position <= last_position:
+                    continue  # 摄像头比设定帧率快时，同一帧号只写一次
+                if annotated_frame is None:
+                    annotated_frame = self.worker.annotate(frame, detections)
+                if self.writer is None:
+                    self.writer = self.open_writer(annotated_frame.shape)
+                    if self.writer is None:
+                        self.error = f"无法写入视频文件：{self.path}"
+                        break
+                else:
+                    for _ in range(position - last_position - 1):
+                        self.writer.write(last_frame)
+                        self.written += 1
+                self.writer.write(annotated_frame)
+                self.written += 1
+                last_frame, last_position = annotated_frame, position
+        except Exception as e:
+            self.error = f"写入视频文件出错：{e}"
+            raise
+        finally:
+            self.queue.close()  # 编码线程出错退出时，让等待空位的调用方不再阻塞
+            if self.writer is not None:
+                self.writer.release()
+
+
+class VideoExportJob(QObject):
+    """离线导出整个视频文件：解码线程读帧，当前线程按批推理，VideoExporter 的编码线程写文件，
+    三者同时进行，不经过界面显示，速度只受推理限制"""
+    progress = pyqtSignal(int, int)  # 已导出帧数、总帧数
+    finished = pyqtSignal(int, float)  # 导出帧数、总耗时（秒）
+
+    def __init__(self, worker, video_path, output_path, batch_size=8):
+        super().__init__()
+        self.worker = worker
+        self.video_path = video_path
+        self.output_path = output_path
+        self.batch_size = batch_size
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def wait(self, timeout=None):
+        """等待导出线程结束；编码线程写完文件尾后才返回，导出到一半的视频也能播放"""
+        self.thread.join(timeout)
+
+    def decode_loop(self, capture, frames):
+        """解码线程：按顺序读取全部帧，队列满时等待"""
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                frames.put(frame, block=True)
+        finally:
+            capture.release()
+            frames.close()
+
+    def run(self):
+        start_time = time.perf_counter()
+        capture = cv2.VideoCapture(self.video_path)
+        if not capture.isOpened():
+            self.error = f"无法打开视频文件：{self.video_path}"
+            self.finished.emit(0, 0.0)
+            return
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        exporter = VideoExporter(self.worker, self.output_path, fps if 1 <= fps <= 240 else 30, 2 * self.batch_size)
+        exporter.start()
+        frames = FrameQueue(2 * self.batch_size)
+        decoder = threading.Thread(target=self.decode_loop, args=(capture, frames), daemon=True)
+        decoder.start()
+        done = 0
+        try:
+            while not self.stop_event.is_set() and exporter.error is None:
+                batch = []
+                while len(batch) < self.batch_size:
+                    frame = frames.get()
+                    if frame is not None:
+                        batch.append(frame)
+                    elif frames.is_drained():
+                        break
+                if not batch:
+                    break
+                results = self.worker.detect_batch(batch, self.batch_size, **self.worker.pushdown_params())
+                for frame, result in zip(batch, results):
+                    detections = self.worker.filter_detections(Detections.from_results(result))
+                    annotated_frame = None if self.worker.annotator.supported else detections.to_results(frame).plot()
+                    exporter.put(frame, detections, done, annotated_frame, block=True)
+                    done += 1
+                self.progress.emit(done, total)
+        finally:
+            self.stop_event.set()
+            frames.close()  # 唤醒等待空位的解码线程
+            exporter.close()
+            decoder.join()
+        self.error = exporter.error
+        self.finished.emit(done, time.perf_counter() - start_time)
+
+
+class ThumbnailModel(QAbstractListModel):
+    """图片集的缩略图列表模型：视图只向模型请求可见的行，缩略图在可见时才生成，
+    内存中最多保留 max_items 张，多于这个数时淘汰最久没有显示的"""
+    CountRole = Qt.UserRole + 1  # 检测到的物体数，未检测为 -1
+
+    def __init__(self, loader, max_items=1000):
+        super().__init__()
+        self.loader = loader
+        self.loader.loaded.connect(self.thumbnail_loaded)
+        self.max_items = max_items
+        self.image_paths = []
+        self.counts = np.zeros(0, dtype=np.int32)
+        self.pixmaps = OrderedDict()  # 行号 -> QPixmap，按最近显示排序
+        self.requested = set()  # 已请求还没有返回的行
+        self.stale = set()  # 角标需要重新读取的行，缩略图先照常显示
+        self.placeholder = QPixmap(loader.size, loader.size)
+        self.placeholder.fill(QColor('#303030'))
+
+    def set_paths(self, image_paths):
+        self.beginResetModel()
+        self.loader.cancel()
+        self.image_paths = list(image_paths)
+        self.counts = np.full(len(image_paths), -1, dtype=np.int32)
+        self.pixmaps.clear()
+        self.requested.clear()
+        self.stale.clear()
+        self.endResetModel()
+
+    def append_paths(self, image_paths):
+        """在末尾追加图片（导入文件夹时边扫描边显示）"""
+        if not image_paths:
+            return
+        start = len(self.image_paths)
+        self.beginInsertRows(QModelIndex(), start, start + len(image_paths) - 1)
+        self.image_paths.extend(image_paths)
+        self.counts = np.concatenate([self.counts, np.full(len(image_paths), -1, dtype=np.int32)])
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.image_paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = index.row()
+        if not index.isValid() or row >= len(self.image_paths):
+            return None
+        if role == Qt.DecorationRole:
+            pixmap = self.pixmaps.get(row)
+            if pixmap is not None:
+                self.pixmaps.move_to_end(row)
+                if row not in self.stale:
+                    return pixmap
+            if row not in self.requested:
+                self.requested.add(row)
+                dropped = self.loader.request(row, self.image_paths[row])
+                if dropped is not None:
+                    self.requested.discard(dropped)  # 再次可见时重新请求
+            return pixmap if pixmap is not None else self.placeholder
+        if role == Qt.DisplayRole:
+            return os.path.basename(self.image_paths[row])
+        if role == Qt.ToolTipRole:
+            return self.image_paths[row]
+        if role == self.CountRole:
+            return int(self.counts[row])
+        return None
+
+    def thumbnail_loaded(self, generation, row, image, count):
+        if generation != self.loader.generation:
+            return  # 上一组图片的结果
+        self.requested.discard(row)
+        self.stale.discard(row)
+        self.pixmaps[row] = QPixmap.fromImage(image) if not image.isNull() else self.placeholder
+        while len(self.pixmaps) > self.max_items:
+            self.stale.discard(self.pixmaps.popitem(last=False)[0])
+        if count >= 0:
+            self.counts[row] = count
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def reload_counts(self):
+        """显示过滤改变后重新读取角标：可见的行重新请求（缩略图有磁盘缓存），返回前先显示旧的缩略图"""
+        self.loader.cancel()
+        self.counts[:] = -1
+        self.requested.clear()
+        self.stale = set(self.pixmaps)
+        if self.image_paths:
+            self.dataChanged.emit(self.index(0), self.index(len(self.image_paths) - 1))
+
+    def set_count(self, row, count):
+        """检测完一张图片后更新角标"""
+        if 0 <= row < len(self.counts) and self.counts[row] != count:
+            self.counts[row] = count
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [self.CountRole])
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    """在缩略图右上角画检测到的物体数角标，还没有检测的图片不画"""
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        count = index.data(ThumbnailModel.CountRole)
+        if count is None or count < 0:
+            return
+        text = str(count)
+        width = max(22, painter.fontMetrics().horizontalAdvance(text) + 10)
+        rect = QRect(option.rect.right() - width - 4, option.rect.top() + 4, width, 20)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor('#d9534f') if count else QColor('#777777'))
+        painter.drawRoundedRect(rect, 10, 10)
+        painter.setPen(QColor('white'))
+        painter.drawText(rect, Qt.AlignCenter, text)
+        painter.restore()
 
 
 class InteractiveLabel(QLabel):
@@ -79,7 +2754,11 @@ class InteractiveLabel(QLabel):
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    libraries_ready = pyqtSignal(float)  # 后台导入推理库完成，参数为启动后经过的秒数
+    model_loaded = pyqtSignal(bool, str)  # 后台加载模型结束：是否加载成功、失败原因
+
+    def __init__(self, data_dir=None):
+        """data_dir 为检测结果库和缓存的保存目录，默认为用户数据目录（性能测试时指向临时目录）"""
         super().__init__()
         self.setWindowTitle("YOLO基础识别程序V3.0 —— By AMJ")
         self.setGeometry(300, 150, 800, 600)
@@ -87,6 +2766,8 @@ class MainWindow(QMainWindow):
         # 设置窗口图标
         # 获取脚本所在的目录
         base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.data_dir = data_dir or user_data_dir()  # 缓存和数据库的保存目录
+        self.closed = False  # closeEvent 已经释放过资源
 
         # 动态拼接图标路径
         icon_path = os.path.join(base_dir, 'app.ico')
@@ -97,8 +2778,8 @@ class MainWindow(QMainWindow):
         self.image_min_width = 680
         self.image_min_height = 550
 
-        # 根据图片尺寸动态调整窗口最小尺寸
-        self.setMinimumSize(self.image_min_width * 2 + 60, self.image_min_height + 100)
+        # 根据图片尺寸动态调整窗口最小尺寸（高度包括工具栏和两行按钮）
+        self.setMinimumSize(self.image_min_width * 2 + 60, self.image_min_height + 220)
 
         # 创建两个 InteractiveLabel 分别显示左右图像
         self.label1 = QLabel()
@@ -116,15 +2797,72 @@ class MainWindow(QMainWindow):
         hbox_video = QHBoxLayout()
         hbox_video.addWidget(self.label1)  # 左侧显示原始图像
         hbox_video.addWidget(self.label2)  # 右侧显示检测后的图像
+        # 多路检测时隐藏左右两个标签，改为网格显示每一路的检测画面
+        self.stream_grid = QWidget()
+        self.stream_grid_layout = QGridLayout(self.stream_grid)
+        self.stream_grid_layout.setContentsMargins(0, 0, 0, 0)
+        self.stream_grid.hide()
+        hbox_video.addWidget(self.stream_grid)
+        self.stream_labels = []
         layout.addLayout(hbox_video)
+
+        # 视频进度条：播放过的帧的检测结果保存在 VideoResultCache 中，拖动和回放只解码和绘制，不再推理
+        self.timeline_widget = QWidget()
+        hbox_timeline = QHBoxLayout(self.timeline_widget)
+        hbox_timeline.setContentsMargins(0, 0, 0, 0)
+        self.play_button = QPushButton("⏸")
+        self.play_button.setFixedSize(50, 30)
+        self.play_button.clicked.connect(self.toggle_playback)
+        hbox_timeline.addWidget(self.play_button)
+        self.timeline_slider = QSlider(Qt.Horizontal)
+        self.timeline_slider.valueChanged.connect(self.seek_video)
+        self.timeline_slider.sliderReleased.connect(self.timeline_released)
+        hbox_timeline.addWidget(self.timeline_slider)
+        self.timeline_label = QLabel()
+        hbox_timeline.addWidget(self.timeline_label)
+        self.timeline_widget.hide()
+        layout.addWidget(self.timeline_widget)
+
+        # 缩略图栏：只生成看得到的缩略图并缓存到磁盘，十万张以上的图片集也能流畅滚动，角标为检测到的物体数
+        self.thumbnail_size = 96
+        self.thumbnail_cache = ThumbnailCache(os.path.join(self.data_dir, 'thumbnails'))
+        self.thumbnail_loader = ThumbnailLoader(self.thumbnail_cache, self.thumbnail_count, self.thumbnail_size)
+        self.thumbnail_model = ThumbnailModel(self.thumbnail_loader)
+        self.gallery = QListView()
+        self.gallery.setViewMode(QListView.IconMode)
+        self.gallery.setFlow(QListView.LeftToRight)
+        self.gallery.setWrapping(False)
+        self.gallery.setMovement(QListView.Static)
+        self.gallery.setUniformItemSizes(True)  # 不需要逐项计算尺寸，布局耗时与图片数量无关
+        self.gallery.setIconSize(QSize(self.thumbnail_size, self.thumbnail_size))
+        self.gallery.setGridSize(QSize(self.thumbnail_size + 16, self.thumbnail_size + 28))
+        self.gallery.setFixedHeight(self.thumbnail_size + 52)
+        self.gallery.setModel(self.thumbnail_model)
+        self.gallery.setItemDelegate(ThumbnailDelegate(self.gallery))
+        self.gallery.selectionModel().currentChanged.connect(self.gallery_selected)
+        self.gallery.hide()
+        layout.addWidget(self.gallery)
+
+        # 性能浮层：叠在检测图左上角，显示 FPS 和各阶段耗时，按 F3 切换
+        self.hud_label = QLabel(self.label2)
+        self.hud_label.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: #00ff00; font-family: monospace; font-size: 12px; padding: 4px; border: none;')
+        self.hud_label.setAttribute(Qt.WA_TransparentForMouseEvents)  # 不挡住右键菜单
+        self.hud_label.move(8, 8)
+        self.hud_label.hide()
         self.worker = Worker()
+        self.worker.export_dir = os.path.join(self.data_dir, 'exports')
 
-        # 创建按钮布局 
+        # 创建按钮布局：按钮分两行，推理和播放设置放在窗口顶部的工具栏，按钮再多也不会超出窗口宽度
         hbox_buttons = QHBoxLayout()
+        hbox_actions = QHBoxLayout()
+        settings_bar = QToolBar("设置")
+        settings_bar.setMovable(False)
+        self.addToolBar(settings_bar)
+        self.settings_bar = settings_bar
 
         # 添加模型选择按钮
         self.load_model_button = QPushButton("📁模型选择")
-        self.load_model_button.clicked.connect(self.load_model)
+        self.load_model_button.clicked.connect(lambda: self.load_model())  # clicked 会传入 checked 参数
         self.load_model_button.setFixedSize(160, 50)
         self.load_model_button.setStyleSheet("""
             QPushButton {
@@ -144,6 +2882,26 @@ class MainWindow(QMainWindow):
         """)
         hbox_buttons.addWidget(self.load_model_button)
 
+        # 添加推理后端选择，ONNX Runtime / OpenVINO 首次使用时导出并缓存
+        self.backend_box = QComboBox()
+        for backend, (name, _) in Worker.BACKENDS.items():
+            self.backend_box.addItem(name, (backend, False))
+            if backend != 'pytorch':
+                self.backend_box.addItem(name + " INT8", (backend, True))
+        self.backend_box.currentIndexChanged.connect(self.reload_model)
+        self.backend_box.setFixedSize(160, 50)
+        self.backend_box.setStyleSheet("""
+            QComboBox {
+                background-color: #ffffff;
+                border: 2px solid #cccccc;
+                border-radius: 10px;
+                font-size: 16px;
+                color: #000000;
+                padding: 5px;
+            }
+        """)
+        settings_bar.addWidget(self.backend_box)
+
         # 添加导入图片按钮
         self.load_images_button = QPushButton("🖼️导入图片")
         self.load_images_button.clicked.connect(self.load_images)
@@ -152,6 +2910,17 @@ class MainWindow(QMainWindow):
         self.load_images_button.setStyleSheet(self.load_model_button.styleSheet())
         hbox_buttons.addWidget(self.load_images_button)
 
+        # 添加导入文件夹按钮：边遍历边检测，不需要先选中全部文件；监视模式下自动检测新放入的图片
+        self.load_folder_button = QPushButton("📂导入文件夹")
+        self.load_folder_button.setEnabled(False)
+        self.load_folder_button.setFixedSize(160, 50)
+        self.load_folder_button.setStyleSheet(self.load_model_button.styleSheet())
+        folder_menu = QMenu(self)
+        folder_menu.addAction("打开文件夹…").triggered.connect(lambda: self.open_folder(watch=False))
+        folder_menu.addAction("监视文件夹…").triggered.connect(lambda: self.open_folder(watch=True))
+        self.load_folder_button.setMenu(folder_menu)
+        hbox_buttons.addWidget(self.load_folder_button)
+
         # 添加导入视频按钮
         self.load_video_button = QPushButton("🎞️导入视频")
         self.load_video_button.clicked.connect(self.load_video)
@@ -160,6 +2929,47 @@ class MainWindow(QMainWindow):
         self.load_video_button.setStyleSheet(self.load_model_button.styleSheet())
         hbox_buttons.addWidget(self.load_video_button)
 
+        # 添加视频播放模式选择：实时播放（推理跟不上时丢帧）或逐帧处理（离线，每一帧都检测）
+        self.play_mode_box = QComboBox()
+        self.play_mode_box.addItems(["实时（丢帧）", "逐帧处理（离线）"])
+        self.play_mode_box.setFixedSize(160, 50)
+        self.play_mode_box.setStyleSheet("""
+            QComboBox {
+                background-color: #ffffff;
+                border: 2px solid #cccccc;
+                border-radius: 10px;
+                font-size: 16px;
+                color: #000000;
+                padding: 5px;
+            }
+        """)
+        settings_bar.addWidget(self.play_mode_box)
+
+        # 添加检测间隔选择：每隔几帧做一次完整检测，中间的帧用光流跟踪检测框，CPU 上帧率成倍提高
+        self.detect_interval_box = QComboBox()
+        for interval in (1, 2, 3, 5, 10):
+            self.detect_interval_box.addItem("每帧检测" if interval == 1 else f"每 {interval} 帧检测", interval)
+        self.detect_interval_box.setFixedSize(160, 50)
+        self.detect_interval_box.setStyleSheet(self.play_mode_box.styleSheet())
+        settings_bar.addWidget(self.detect_interval_box)
+
+        # 添加运动检测灵敏度选择：画面静止（固定摄像头）时沿用上一次的检测结果，不重复推理
+        self.motion_box = QComboBox()
+        for name, threshold in (("运动检测：关", None), ("运动检测：高灵敏", 0.002), ("运动检测：中", 0.01), ("运动检测：低灵敏", 0.03)):
+            self.motion_box.addItem(name, threshold)
+        self.motion_box.setFixedSize(160, 50)
+        self.motion_box.setStyleSheet(self.play_mode_box.styleSheet())
+        settings_bar.addWidget(self.motion_box)
+
+        # 添加切片推理选择：超大图片（航拍、全景）切成重叠的小块分别检测，小目标不会丢失
+        self.tile_box = QComboBox()
+        for name, tile_size in (("切片推理：关", None), ("切片 640", 640), ("切片 1024", 1024), ("切片 1280", 1280)):
+            self.tile_box.addItem(name, tile_size)
+        self.tile_box.currentIndexChanged.connect(self.change_tile_size)
+        self.tile_box.setFixedSize(160, 50)
+        self.tile_box.setStyleSheet(self.play_mode_box.styleSheet())
+        settings_bar.addWidget(self.tile_box)
+
         # 添加上一张按钮
         self.prev_image_button = QPushButton("◀上一张")
         self.prev_image_button.clicked.connect(self.show_prev_image)
@@ -176,6 +2986,14 @@ class MainWindow(QMainWindow):
         self.next_image_button.setStyleSheet(self.load_model_button.styleSheet())
         hbox_buttons.addWidget(self.next_image_button)
 
+        # 添加批量检测按钮
+        self.batch_button = QPushButton("⚡批量检测")
+        self.batch_button.clicked.connect(self.start_batch)
+        self.batch_button.setEnabled(False)
+        self.batch_button.setFixedSize(160, 50)
+        self.batch_button.setStyleSheet(self.load_model_button.styleSheet())
+        hbox_buttons.addWidget(self.batch_button)
+
         # 添加摄像头按钮
         self.camera_button = QPushButton("📷摄像头检测")
         self.camera_button.clicked.connect(self.start_camera)
@@ -184,13 +3002,21 @@ class MainWindow(QMainWindow):
         self.camera_button.setStyleSheet(self.load_model_button.styleSheet())
         hbox_buttons.addWidget(self.camera_button)
 
+        # 添加多路检测按钮：同时检测多个视频或摄像头，共用一个模型，每轮各路的帧合成一批推理
+        self.multi_stream_button = QPushButton("🧩多路检测")
+        self.multi_stream_button.clicked.connect(self.open_streams)
+        self.multi_stream_button.setEnabled(False)
+        self.multi_stream_button.setFixedSize(160, 50)
+        self.multi_stream_button.setStyleSheet(self.load_model_button.styleSheet())
+        hbox_actions.addWidget(self.multi_stream_button)
+
         # 添加停止按钮
         self.stop_button = QPushButton("⏹️停止")
         self.stop_button.clicked.connect(self.stop_processing)
         self.stop_button.setEnabled(False)
         self.stop_button.setFixedSize(160, 50)
         self.stop_button.setStyleSheet(self.load_model_button.styleSheet())
-        hbox_buttons.addWidget(self.stop_button)
+        hbox_actions.addWidget(self.stop_button)
 
         # 添加显示检测物体按钮
         self.display_objects_button = QPushButton("🔍统计")
@@ -198,156 +3024,905 @@ class MainWindow(QMainWindow):
         self.display_objects_button.setEnabled(False)
         self.display_objects_button.setFixedSize(160, 50)
         self.display_objects_button.setStyleSheet(self.load_model_button.styleSheet())
-        hbox_buttons.addWidget(self.display_objects_button)
+        hbox_actions.addWidget(self.display_objects_button)
+
+        # 添加检测结果查询按钮
+        self.query_button = QPushButton("🗂️查询")
+        self.query_button.clicked.connect(self.query_detections)
+        self.query_button.setEnabled(False)
+        self.query_button.setFixedSize(160, 50)
+        self.query_button.setStyleSheet(self.load_model_button.styleSheet())
+        hbox_actions.addWidget(self.query_button)
+
+        # 添加过滤按钮：调整置信度、IoU 阈值和显示的类别，在缓存的检测结果上立即重新绘制
+        self.filter_button = QPushButton("🎚️过滤")
+        self.filter_button.clicked.connect(self.show_filter_panel)
+        self.filter_button.setEnabled(False)
+        self.filter_button.setFixedSize(160, 50)
+        self.filter_button.setStyleSheet(self.load_model_button.styleSheet())
+        hbox_actions.addWidget(self.filter_button)
+
+        # 添加导出视频按钮：录制正在播放的检测画面，或离线导出整个视频文件
+        self.export_video_button = QPushButton("💾导出视频")
+        self.export_video_button.setEnabled(False)
+        self.export_video_button.setFixedSize(160, 50)
+        self.export_video_button.setStyleSheet(self.load_model_button.styleSheet())
+        export_menu = QMenu(self)
+        self.record_action = export_menu.addAction("录制正在播放的画面…")
+        self.record_action.setCheckable(True)
+        self.record_action.toggled.connect(self.toggle_recording)
+        export_menu.addAction("导出整个视频文件…").triggered.connect(self.export_video_file)
+        self.export_video_button.setMenu(export_menu)
+        hbox_actions.addWidget(self.export_video_button)
+
+        # 添加性能按钮：显示性能浮层、把每帧耗时记录到文件
+        self.metrics_button = QPushButton("📈性能")
+        self.metrics_button.setFixedSize(160, 50)
+        self.metrics_button.setStyleSheet(self.load_model_button.styleSheet())
+        metrics_menu = QMenu(self)
+        self.hud_action = metrics_menu.addAction("显示性能浮层 (F3)")
+        self.hud_action.setCheckable(True)
+        self.hud_action.toggled.connect(self.toggle_hud)
+        self.export_action = metrics_menu.addAction("记录每帧耗时到文件…")
+        self.export_action.setCheckable(True)
+        self.export_action.toggled.connect(self.toggle_metrics_export)
+        self.metrics_button.setMenu(metrics_menu)
+        QShortcut(QKeySequence("F3"), self, activated=self.hud_action.toggle)
+        hbox_actions.addWidget(self.metrics_button)
 
         # 添加退出按钮
         self.exit_button = QPushButton("❌退出")
         self.exit_button.clicked.connect(self.exit_application)
         self.exit_button.setFixedSize(160, 50)
         self.exit_button.setStyleSheet(self.load_model_button.styleSheet())
-        hbox_buttons.addWidget(self.exit_button)
+        hbox_actions.addWidget(self.exit_button)
 
         layout.addLayout(hbox_buttons)
+        layout.addLayout(hbox_actions)
         central_widget = QWidget()
         central_widget.setLayout(layout)
         self.setCentralWidget(central_widget)
 
         self.current_results = None
+        self.current_detections = None  # 当前画面过滤前的原始检测结果，调整过滤条件时直接重新绘制
+        self.filter_panel = None  # 过滤面板（非模态对话框）
+        self.worker.set_display_filter(DetectionFilter())  # 推理使用较低的置信度下限，缓存原始结果
+        # 累计统计（DetectionStats）：图片集和视频各用一个，后台批量检测图片时播放视频不会混在一起
+        self.image_stats = None  # 当前图片集的累计统计
+        self.video_stats = None  # 当前视频的累计统计（流水线推理线程更新）
+        self.stats_is_video = False  # 当前显示的是视频还是图片集
         self.image_paths = []  # 存储图片路径
         self.current_image_index = -1  # 当前图片索引
 
+        # 批量检测变量
+        self.batch_processor = None
+        self.batch_size = 8  # 每批送入模型的图片数量
+        self.folder_source = None  # 正在导入或监视的文件夹（FolderSource）
+
+        # 检测结果缓存，来回翻看图片时不再重复推理
+        # 检测结果同时保存到用户数据目录下的 SQLite 数据库，下次打开同一批图片时直接读取
+        self.cache_max_mb = 256
+        try:
+            os.makedirs(self.data_dir, exist_ok=True)
+            self.detection_store = DetectionStore(os.path.join(self.data_dir, 'detections.db'))
+        except (OSError, sqlite3.Error):
+            self.detection_store = DetectionStore(':memory:')  # 数据目录不可写：结果只保存到程序退出
+        self.detection_cache = DetectionCache(self.cache_max_mb * 1024 * 1024, self.detection_store)
+
+        # 预取前后几张图片，点击上一张/下一张时直接显示
+        self.prefetch_radius = 2
+        self.prefetcher = Prefetcher(self.worker, self.detection_cache, self.prefetch_radius)
+
         # 视频播放变量
         self.video_path = None
-        self.video_capture = None
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.video_play)
+        self.pipeline = None  # 当前的视频处理流水线
+        self.video_exporter = None  # 正在录制的 VideoExporter
+        self.video_cache = None  # 当前视频逐帧的检测结果（VideoResultCache）
+        self.video_cache_dir = os.path.join(self.data_dir, 'video_cache')  # 视频所在目录不可写时缓存保存到这里
+        self.video_seeker = None  # 暂停时定位和后台补检的 VideoSeeker
+        self.video_fps = 30
+        self.resume_after_scrub = False  # 播放中拖动进度条，松开后继续播放
+        self.export_job = None  # 正在离线导出的 VideoExportJob
 
-        self.camera_capture = None
+        # 摄像头设置：Windows 上 DirectShow 打开速度比默认的 MSMF 快很多
+        # 设备不支持指定的分辨率或帧率时自动改用默认设置
+        self.camera_index = 0
+        self.camera_backend = cv2.CAP_DSHOW if sys.platform == 'win32' else cv2.CAP_ANY
+        self.camera_resolution = (1280, 720)
+        self.camera_fps = 30
+        self.camera_source = None  # 正在后台打开的摄像头
+        self.stream_sources = []  # 上一次多路检测的视频路径或摄像头编号
+        self.stream_batch_size = 8  # 多路检测时每批最多合并的路数
+        self.multi_pipeline = None  # 当前的多路检测流水线
+        self.stream_stats = []  # 多路检测每一路的累计统计
+        self.motion_refresh_interval = 30  # 运动检测开启时，画面静止最多连续沿用多少帧的结果
 
         # 当前图片数据
         self.original_image = None
         self.annotated_image = None
+        self.original_pixmap = None  # 原始分辨率的 QPixmap，只转换一次，缩放时复用
+        self.annotated_pixmap = None
+
+        # 各阶段耗时统计，性能浮层每 250 毫秒刷新一次
+        self.metrics = StageMetrics()
+        self.hud_timer = QTimer()
+        self.hud_timer.setInterval(250)
+        self.hud_timer.timeout.connect(self.update_hud)
+
+        # 拖动窗口时先用快速缩放预览，停止拖动后再做一次高质量缩放
+        self.resize_timer = QTimer()
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(lambda: self.scale_images(Qt.SmoothTransformation))
+
+        # 窗口显示后再在后台导入 ultralytics / torch，用户选择模型文件时通常已经导入完成
+        self.libraries_loaded = False
+        self.libraries_ready.connect(self.on_libraries_ready)
+        self.model_loaded.connect(self.on_model_loaded)
+        self.model_thread = None  # 正在后台加载模型的线程
+        self.model_reloading = False  # 这次加载是切换后端，加载完后换成对应的结果缓存
+        self.previous_model_path = None  # 这次加载之前的模型文件，用于判断是否换了模型
+        self.preload_thread = threading.Thread(target=self.preload_libraries, daemon=True)
+        QTimer.singleShot(0, self.preload_thread.start)
+        self.statusBar().showMessage("正在后台加载推理库…")
+
+    def preload_libraries(self):
+        try:
+            import_ultralytics()
+        finally:
+            self.libraries_ready.emit(time.perf_counter() - STARTUP_TIME)
+
+    def on_libraries_ready(self, elapsed):
+        self.libraries_loaded = True
+        if self.statusBar().currentMessage() == "正在后台加载推理库…":
+            self.statusBar().showMessage(f"推理库加载完成（启动后 {elapsed:.1f} 秒）", 5000)
 
 
 # -------------------------------------------
-    def load_model(self):
-        if self.worker.load_model():
-            self.load_images_button.setEnabled(True)
-            self.load_video_button.setEnabled(True)
-            self.camera_button.setEnabled(True)
-            self.display_objects_button.setEnabled(True)
-            self.stop_button.setEnabled(True)
+    def model_buttons(self):
+        """加载模型后才能使用的按钮"""
+        return [self.load_images_button, self.load_folder_button, self.load_video_button, self.camera_button,
+                self.multi_stream_button, self.export_video_button, self.display_objects_button, self.query_button,
+                self.filter_button, self.stop_button]
+
+    def load_model(self, model_path=None, reloading=False):
+        """在后台线程中加载模型（导出和预热可能需要几分钟），加载期间禁用相关按钮"""
+        if model_path is None:
+            model_path, _ = QFileDialog.getOpenFileName(self, "选择模型文件", "", "模型文件 (*.pt)")
+        if not model_path:
+            return
+        backend, int8 = self.backend_box.currentData()
+        if not self.libraries_loaded:
+            self.statusBar().showMessage("正在等待推理库加载完成…")
+        elif backend != 'pytorch':
+            self.statusBar().showMessage("正在加载模型（首次使用该后端时需要导出，请稍候）…")
+        else:
+            self.statusBar().showMessage("正在加载模型…")
+        self.load_model_button.setEnabled(False)
+        self.settings_bar.setEnabled(False)
+        for button in self.model_buttons():
+            button.setEnabled(False)
+        QApplication.setOverrideCursor(Qt.BusyCursor)
+        self.model_reloading = reloading
+        self.previous_model_path = self.worker.model_path
+        self.model_thread = threading.Thread(target=self.load_model_thread, args=(model_path, backend, int8), daemon=True)
+        self.model_thread.start()
+
+    def load_model_thread(self, model_path, backend, int8):
+        try:
+            self.worker.load_model(model_path, backend, int8)
+        except Exception as e:
+            self.model_loaded.emit(False, str(e))
+        else:
+            self.model_loaded.emit(True, "")
+
+    def on_model_loaded(self, loaded, error):
+        self.model_thread = None
+        QApplication.restoreOverrideCursor()
+        self.load_model_button.setEnabled(True)
+        self.settings_bar.setEnabled(True)
+        for button in self.model_buttons():
+            button.setEnabled(self.worker.model is not None)
+        if not loaded:
+            # 选回上一次加载成功的后端，否则之后每次选择模型都会再失败一次
+            self.backend_box.blockSignals(True)
+            loaded_backend = (self.worker.backend, self.worker.int8)  # findData 不能比较元组，逐项查找
+            self.backend_box.setCurrentIndex(next(index for index in range(self.backend_box.count())
+                                                  if self.backend_box.itemData(index) == loaded_backend))
+            self.backend_box.blockSignals(False)
+            self.statusBar().clearMessage()
+            QMessageBox.critical(self, "错误", f"模型加载失败：{error}")
+            return
+        self.statusBar().showMessage(self.worker.speed_text())
+        if self.filter_panel is not None:
+            self.filter_panel.close()  # 类别列表对应旧模型
+            self.filter_panel = None
+        model_changed = self.worker.model_path != self.previous_model_path
+        display_filter = self.worker.display_filter
+        if model_changed and display_filter is not None:
+            # 类别过滤中的编号对应旧模型，还会下推给 predict，恢复为全部类别和默认数量，只保留阈值
+            self.worker.set_display_filter(DetectionFilter(display_filter.conf, display_filter.iou))
+        if model_changed or (self.image_stats is not None and self.image_stats.names != self.worker.model.names):
+            # 统计数组的长度按旧模型的类别数分配，旧模型的结果和角标也不再适用
+            self.reset_stats()
+            self.thumbnail_model.reload_counts()
+        if self.model_reloading:
+            self.reopen_timeline()
+            if self.pipeline is None and self.video_seeker is None and self.image_paths:
+                self.show_current_image()
+
+    def reload_model(self):
+        """切换推理后端后重新加载当前模型"""
+        if self.worker.model_path is None:
+            return
+        self.prefetcher.cancel()
+        if self.video_seeker is not None:
+            self.stop_pipeline()  # 暂停视频，换成新模型对应的结果缓存后再继续
+        self.load_model(self.worker.model_path, reloading=True)
+
+    def change_tile_size(self):
+        """切换切片推理设置，缓存键随之改变，重新显示当前图片"""
+        self.prefetcher.cancel()
+        if self.video_seeker is not None:
+            self.stop_pipeline()
+        self.worker.tile_size = self.tile_box.currentData()
+        self.reopen_timeline()
+        if self.worker.model is not None and self.pipeline is None and self.video_seeker is None and self.image_paths:
+            self.show_current_image()
 
     def load_images(self):
         """导入多张图片"""
         file_names, _ = QFileDialog.getOpenFileNames(self, "选择图片文件", "", "图片文件 (*.jpg *.jpeg *.png *.bmp)")
         if file_names:
-            self.image_paths = file_names
+            self.open_image_set(file_names)
+
+    def open_image_set(self, image_paths):
+        """切换到一组新的图片并显示第一张"""
+        self.stop_pipeline()
+        self.close_timeline()
+        self.stop_batch()
+        self.stop_folder()
+        self.prefetcher.cancel()
+        self.image_paths = image_paths
+        self.image_stats = DetectionStats(self.worker.model.names)
+        self.stats_is_video = False
+        self.current_image_index = 0
+        self.thumbnail_model.set_paths(image_paths)
+        self.gallery.setVisible(len(image_paths) > 1)
+        self.show_current_image()
+        self.prev_image_button.setEnabled(len(self.image_paths) > 1)
+        self.next_image_button.setEnabled(len(self.image_paths) > 1)
+        self.batch_button.setEnabled(True)
+
+    def open_folder(self, watch):
+        """导入文件夹中的全部图片（递归），watch 为 True 时继续检测之后放入的图片"""
+        directory = QFileDialog.getExistingDirectory(self, "监视文件夹" if watch else "选择图片文件夹")
+        if directory:
+            self.start_folder(directory, watch)
+
+    def start_folder(self, directory, watch=False):
+        """开始边遍历边检测文件夹中的图片，找到第一张就显示"""
+        self.open_image_set([])
+        self.folder_source = FolderSource(self.worker, self.detection_cache, directory, watch, self.batch_size)
+        self.folder_source.found.connect(self.folder_found)
+        self.folder_source.result_ready.connect(self.folder_result)
+        self.folder_source.progress.connect(self.folder_progress)
+        self.folder_source.finished.connect(self.folder_finished)
+        self.folder_source.start()
+        self.statusBar().showMessage(f"正在扫描 {directory}…")
+
+    def stop_folder(self, wait=False):
+        if self.folder_source is not None:
+            self.folder_source.stop()
+            if wait:
+                self.folder_source.wait()
+            self.folder_source = None
+
+    def folder_found(self, paths):
+        """文件夹中发现了新的图片，追加到图片列表，第一批到达时显示第一张"""
+        if self.sender() is not self.folder_source:
+            return
+        first = not self.image_paths
+        self.image_paths.extend(paths)
+        self.thumbnail_model.append_paths(paths)
+        self.gallery.setVisible(len(self.image_paths) > 1)
+        self.prev_image_button.setEnabled(len(self.image_paths) > 1)
+        self.next_image_button.setEnabled(len(self.image_paths) > 1)
+        self.batch_button.setEnabled(True)
+        if first and self.pipeline is None:
             self.current_image_index = 0
             self.show_current_image()
-            self.prev_image_button.setEnabled(len(self.image_paths) > 1)
-            self.next_image_button.setEnabled(len(self.image_paths) > 1)
+
+    def folder_result(self, index, detections):
+        if self.sender() is self.folder_source:
+            detections = self.worker.filter_detections(detections)
+            self.image_stats.update(detections, index, unique=True)
+            self.thumbnail_model.set_count(index, len(detections.cls))
+
+    def folder_progress(self, done, found):
+        source = self.sender()
+        if source is None or source is not self.folder_source or self.pipeline is not None:
+            return
+        if source.watch and source.scan_done:
+            self.statusBar().showMessage(f"正在监视文件夹：已检测 {done}/{found} 张")
+        else:
+            self.statusBar().showMessage(f"文件夹检测中：已检测 {done} 张，已发现 {found} 张")
+
+    def folder_finished(self, count, elapsed):
+        source = self.sender()
+        if source is None or source is not self.folder_source:
+            return  # 已停止的导入（关闭窗口后数据库已关闭）
+        self.folder_source = None
+        self.detection_store.commit()
+        speed = count / elapsed if elapsed > 0 else 0
+        self.statusBar().showMessage(f"文件夹检测完成：{count} 张图片，耗时 {elapsed:.1f} 秒（{speed:.1f} 张/秒）")
+
+    def start_batch(self):
+        """在后台批量检测全部已导入的图片"""
+        batch_size, ok = QInputDialog.getInt(self, "批量检测", "每批图片数量：", self.batch_size, 1, 64)
+        if not ok:
+            return
+        self.batch_size = batch_size
+        self.stop_batch()
+        # 已经在缓存中的图片由 BatchProcessor 在后台查到后直接输出，不重复检测
+        self.batch_processor = BatchProcessor(self.worker, self.detection_cache, self.image_paths, batch_size=self.batch_size)
+        self.batch_processor.result_ready.connect(self.batch_result)
+        self.batch_processor.progress.connect(self.batch_progress)
+        self.batch_processor.finished.connect(self.batch_finished)
+        self.batch_processor.start()
+
+    def stop_batch(self, wait=False):
+        if self.batch_processor is not None:
+            self.batch_processor.stop()
+            if wait:
+                self.batch_processor.wait()
+            self.batch_processor = None
+
+    def batch_result(self, index, detections):
+        if self.sender() is self.batch_processor:
+            detections = self.worker.filter_detections(detections)  # 缓存命中和新推理的都是原始结果，统一在这里过滤
+            self.image_stats.update(detections, index, unique=True)
+            self.thumbnail_model.set_count(index, len(detections.cls))
+
+    def batch_progress(self, done, total):
+        if self.sender() is self.batch_processor:
+            self.statusBar().showMessage(f"批量检测中：{done}/{total}")
+
+    def batch_finished(self, count, elapsed):
+        processor = self.sender()
+        if processor is not None and processor is self.batch_processor:
+            self.batch_processor = None
+            self.detection_store.commit()
+            speed = count / elapsed if elapsed > 0 else 0
+            self.statusBar().showMessage(f"批量检测完成：{count} 张图片，耗时 {elapsed:.1f} 秒（{speed:.1f} 张/秒）")
+
+    def thumbnail_count(self, image_path):
+        """缩略图角标：数据库中已有的检测物体数，没有结果时返回 -1（在缩略图线程中调用）"""
+        if self.worker.model is None:
+            return -1
+        detections = self.detection_store.get(self.worker.cache_key(image_path))
+        return -1 if detections is None else len(self.worker.filter_detections(detections).cls)
+
+    def gallery_selected(self, current, previous):
+        """点击缩略图跳到这张图片"""
+        row = current.row()
+        if 0 <= row < len(self.image_paths) and row != self.current_image_index and self.pipeline is None:
+            self.current_image_index = row
+            self.show_current_image()
 
     def load_video(self):
         """导入视频文件"""
         file_name, _ = QFileDialog.getOpenFileName(self, "选择视频文件", "", "视频文件 (*.mp4 *.avi *.mov)")
-        if file_name:
-            self.video_path = file_name
-            self.video_capture = cv2.VideoCapture(self.video_path)
-            # 检查视频是否成功打开
-            if not self.video_capture.isOpened():
-                QMessageBox.critical(self, "错误", "无法打开视频文件，请检查文件路径或格式")
-                return
+        if not file_name:
+            return
+        self.video_path = file_name
+        video_capture = cv2.VideoCapture(self.video_path)
+        # 检查视频是否成功打开
+        if not video_capture.isOpened():
+            QMessageBox.critical(self, "错误", "无法打开视频文件，请检查文件路径或格式")
+            return
+
+        # 启动流水线播放视频，按视频自身的帧率播放
+        self.stop_pipeline()
+        fps = video_capture.get(cv2.CAP_PROP_FPS)
+        self.open_timeline(file_name, int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT)), fps if 1 <= fps <= 240 else 30)
+        self.start_pipeline(video_capture, results_cache=self.video_cache)
+        self.stop_button.setEnabled(True)
+
+    def open_timeline(self, video_path, frame_count, fps):
+        """显示视频进度条，读取（或新建）这个视频的逐帧检测结果缓存，启动暂停时定位和补检的后台线程"""
+        self.close_timeline()
+        if frame_count <= 0:
+            return  # 读不到帧数（如网络流）时不显示进度条
+        self.video_fps = fps
+        self.video_cache = VideoResultCache.open(self.worker, video_path, frame_count, self.video_cache_dir)
+        self.video_seeker = VideoSeeker(self.worker, video_path, self.video_cache)
+        self.video_seeker.frame_ready.connect(self.seeker_frame)
+        self.video_seeker.progress.connect(self.update_timeline_label)
+        self.video_seeker.start()
+        self.timeline_slider.blockSignals(True)
+        self.timeline_slider.setRange(0, frame_count - 1)
+        self.timeline_slider.setValue(0)
+        self.timeline_slider.blockSignals(False)
+        self.play_button.setText("⏸")
+        self.timeline_widget.show()
+        self.update_timeline_label()
+
+    def close_timeline(self, wait=False):
+        """关闭进度条，后台线程退出前保存逐帧检测结果；wait 为 True 时等待保存完（关闭窗口时）"""
+        if self.video_seeker is not None:
+            self.video_seeker.close(None if wait else 2)
+            self.video_seeker = None
+        self.video_cache = None
+        self.resume_after_scrub = False
+        self.timeline_widget.hide()
+
+    def reopen_timeline(self):
+        """模型或推理参数改变后换成对应的结果缓存，停在原来的位置"""
+        if self.video_cache is None or self.video_cache.matches(self.worker):
+            return
+        position = self.timeline_slider.value()
+        self.open_timeline(self.video_cache.video_path, self.timeline_slider.maximum() + 1, self.video_fps)
+        self.timeline_slider.blockSignals(True)
+        self.timeline_slider.setValue(position)
+        self.timeline_slider.blockSignals(False)
+        self.play_button.setText("▶")
+        self.update_timeline_label()
+        self.video_seeker.request(position)
+
+    def update_timeline_label(self):
+        if self.video_cache is None:
+            return
+        position, last = self.timeline_slider.value(), self.timeline_slider.maximum()
+
+        def format_time(frame):
+            seconds = frame / self.video_fps
+            return f"{int(seconds // 60):02d}:{seconds % 60:04.1f}"
+
+        self.timeline_label.setText(f"{format_time(position)} / {format_time(last)}  已检测 {self.video_cache.coverage():.0%}")
+
+    def toggle_playback(self):
+        if self.pipeline is not None:
+            self.pause_video()
+        else:
+            self.play_video()
+
+    def play_video(self):
+        """从进度条的位置开始播放，已检测过的帧直接使用缓存的结果"""
+        self.video_seeker.pause()
+        position = self.timeline_slider.value()
+        if position >= self.timeline_slider.maximum():
+            position = 0  # 已经在结尾，从头回放
+            self.timeline_slider.blockSignals(True)
+            self.timeline_slider.setValue(0)
+            self.timeline_slider.blockSignals(False)
+        capture = cv2.VideoCapture(self.video_cache.video_path)
+        if not capture.isOpened():
+            QMessageBox.critical(self, "错误", "无法打开视频文件，请检查文件是否被移动或删除")
+            return
+        self.start_pipeline(capture, start_frame=position, results_cache=self.video_cache)
+        self.play_button.setText("⏸")
+
+    def pause_video(self):
+        """暂停播放，在原始分辨率上显示当前帧，后台继续检测还没有结果的帧"""
+        self.stop_pipeline()
+        self.play_button.setText("▶")
+        self.video_seeker.save()
+        self.video_seeker.request(self.timeline_slider.value())
+
+    def seek_video(self, position):
+        """进度条被拖动或点击"""
+        self.update_timeline_label()
+        if self.pipeline is not None:
+            if self.timeline_slider.isSliderDown():
+                # 拖动时先暂停，只显示拖到的帧，松开后再从那里继续播放
+                self.stop_pipeline()
+                self.resume_after_scrub = True
+                self.play_button.setText("▶")
+                self.video_seeker.request(position)
+            else:
+                self.play_video()
+        elif self.video_seeker is not None:
+            self.video_seeker.request(position)
+
+    def timeline_released(self):
+        if self.resume_after_scrub:
+            self.resume_after_scrub = False
+            self.play_video()
+
+    def seeker_frame(self, position, frame, detections):
+        """显示暂停或拖动时定位到的帧"""
+        if self.sender() is not self.video_seeker or self.pipeline is not None:
+            return
+        self.original_image = frame
+        self.current_detections = detections
+        detections = self.worker.filter_detections(detections)
+        self.current_results = [detections.to_results(frame)]
+        self.annotated_image = self.worker.annotate(frame, detections)
+        self.show_images(self.original_image, self.annotated_image)
+
+    def start_pipeline(self, capture, live=False, start_frame=0, results_cache=None):
+        """启动视频处理流水线，采集、推理、渲染都在后台线程中进行，live 表示摄像头等实时流，
+        start_frame 为视频文件开始播放的帧，results_cache 为视频逐帧的检测结果缓存"""
+        self.stop_pipeline()
+        self.prefetcher.cancel()
 
         # 清空原有的显示内容
         self.label1.clear()
         self.label2.clear()
+        self.original_image = None
+        self.annotated_image = None
+        self.current_detections = None
+        self.original_pixmap = None
+        self.annotated_pixmap = None
+        self.gallery.hide()
 
-        # 启动定时器以逐帧播放视频
-        self.timer.start(33)  # 每 30 毫秒播放一帧（约为 33 FPS）
-        self.stop_button.setEnabled(True)
+        realtime = self.play_mode_box.currentIndex() == 0
+        self.metrics.reset()
+        detect_interval = self.detect_interval_box.currentData()
+        threshold = self.motion_box.currentData()
+        motion_gate = MotionGate(threshold, self.motion_refresh_interval) if threshold is not None else None
+        self.pipeline = VideoPipeline(self.worker, capture, live=live, realtime=realtime, detect_interval=detect_interval, motion_gate=motion_gate,
+                                      start_frame=start_frame, results_cache=results_cache)
+        self.video_stats = self.pipeline.stats
+        self.stats_is_video = True
+        self.pipeline.set_target_size(self.label1.size(), self.label2.size())
+        self.pipeline.frame_ready.connect(self.video_play)
+        self.pipeline.finished.connect(self.video_finished)
+        self.pipeline.start()
+
+    def stop_pipeline(self, wait=False):
+        self.stop_recording(wait)
+        if self.camera_source is not None:
+            self.camera_source.release()  # 取消正在打开的摄像头
+            self.camera_source = None
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            if wait:
+                self.pipeline.wait()
+            self.pipeline = None
+        if self.multi_pipeline is not None:
+            self.multi_pipeline.stop()
+            if wait:
+                self.multi_pipeline.wait()
+            self.multi_pipeline = None
+        if not self.stream_grid.isHidden():
+            self.show_stream_grid(0)
+
+    def video_play(self, display1, display2, results, timings):
+        """显示流水线渲染好的原始帧和检测帧（已是显示尺寸，界面线程只负责转换为 QPixmap）"""
+        # 忽略已停止的流水线残留的帧
+        pipeline = self.sender()
+        if pipeline is not self.pipeline:
+            return
+        self.current_results = results
+        start = time.perf_counter()
+        pixmap1 = self.to_pixmap(display1)
+        pixmap2 = self.to_pixmap(display2)
+        pipeline.release_buffers(display1, display2)  # fromImage 已复制数据，缓冲区可以复用
+        display_start = time.perf_counter()
+        self.label1.setPixmap(pixmap1)
+        self.label2.set_image(pixmap2)
+        now = time.perf_counter()
+        timings['convert'] = (display_start - start) * 1000
+        timings['display'] = (now - display_start) * 1000
+        timings['latency'] = (now - timings['captured']) * 1000
+        self.metrics.record('video', timings)
+        self.statusBar().showMessage(pipeline.stats_text())
+        if self.video_seeker is not None and not pipeline.live:
+            self.timeline_slider.blockSignals(True)
+            self.timeline_slider.setValue(timings['frame'])
+            self.timeline_slider.blockSignals(False)
+            self.update_timeline_label()
 
-    def video_play(self):
-        """播放视频或摄像头流并检测"""
-        # 如果是摄像头流，使用 self.camera_capture
-        if self.camera_capture is not None and self.camera_capture.isOpened():
-            ret, frame = self.camera_capture.read()
-        # 如果是视频文件，使用 self.video_capture
-        elif self.video_capture is not None and self.video_capture.isOpened():
-            ret, frame = self.video_capture.read()
+    def toggle_hud(self, visible):
+        self.hud_label.setVisible(visible)
+        if visible:
+            self.update_hud()
+            self.hud_timer.start()
         else:
-            # 如果都没有，则停止定时器
-            self.timer.stop()
+            self.hud_timer.stop()
+
+    def update_hud(self):
+        self.hud_label.setText(self.metrics.hud_text())
+        self.hud_label.adjustSize()
+
+    def toggle_metrics_export(self, enabled):
+        """开始或停止把每帧耗时追加写入 CSV / JSONL 文件"""
+        if not enabled:
+            self.metrics.stop_export()
             return
+        file_path, _ = QFileDialog.getSaveFileName(self, "记录每帧耗时", "timings.csv", "CSV 文件 (*.csv);;JSONL 文件 (*.jsonl)")
+        if not file_path:
+            self.export_action.setChecked(False)
+            return
+        try:
+            self.metrics.start_export(file_path)
+        except OSError as e:
+            QMessageBox.critical(self, "错误", f"无法写入文件：{e}")
+            self.export_action.setChecked(False)
 
-        if ret:
-            # 将帧从 BGR 转换为 RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def video_finished(self):
+        """视频播放完毕或摄像头断开（多路检测时为所有路都已结束）"""
+        if self.sender() is self.pipeline:
+            self.pipeline = None
+            self.stop_recording()
+            if self.video_seeker is not None:
+                # 播完后保存结果，后台补检实时播放时跳过的帧
+                self.play_button.setText("▶")
+                self.video_seeker.save()
+                self.video_seeker.request(self.timeline_slider.value())
+        elif self.sender() is self.multi_pipeline:
+            self.multi_pipeline = None
+        else:
+            return
+        QMessageBox.information(self, "结束", "视频播放结束或摄像头停止")
 
-            # 如果加载了模型，进行检测
-            if self.worker.model is not None:
-                results = self.worker.detect_image(frame)  # 检测直接使用原始 BGR 帧
-                annotated_frame = results[0].plot()  # 获取标注后的帧（默认返回 BGR 格式）
+    def toggle_recording(self, enabled):
+        """开始或停止把正在播放的检测画面以原始分辨率和帧率录制到视频文件"""
+        if not enabled:
+            self.stop_recording()
+            return
+        if self.pipeline is None:
+            QMessageBox.warning(self, "提示", "请先播放视频或打开摄像头")
+            self.record_action.setChecked(False)
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "录制检测视频", "record.mp4", "MP4 视频 (*.mp4);;AVI 视频 (*.avi)")
+        if not file_path or self.pipeline is None:
+            self.record_action.setChecked(False)
+            return
+        self.video_exporter = VideoExporter(self.worker, file_path, self.pipeline.source_fps)
+        self.video_exporter.start()
+        self.pipeline.exporter = self.video_exporter
 
-                # 转换原始帧为 QImage
-                qimage1 = QImage(frame_rgb.data, frame_rgb.shape[1], frame_rgb.shape[0], QImage.Format_RGB888)
-                pixmap1 = QPixmap.fromImage(qimage1)
+    def stop_recording(self, wait=False):
+        """停止录制，编码线程在后台写完剩下的帧；wait 为 True 时等待写完（退出程序时）"""
+        if self.video_exporter is not None:
+            if self.pipeline is not None:
+                self.pipeline.exporter = None
+            self.video_exporter.close(wait)
+            self.video_exporter = None
+        if self.record_action.isChecked():
+            self.record_action.setChecked(False)
 
-                # 转换标注帧为 QImage
-                qimage2 = QImage(annotated_frame.data, annotated_frame.shape[1], annotated_frame.shape[0], QImage.Format_BGR888)
-                pixmap2 = QPixmap.fromImage(qimage2)
+    def export_video_file(self):
+        """离线导出整个视频文件的检测结果，不经过播放，尽可能快"""
+        if self.export_job is not None:
+            QMessageBox.information(self, "提示", "正在导出视频，请等待当前任务完成")
+            return
+        video_path, _ = QFileDialog.getOpenFileName(self, "选择要导出的视频文件", "", "视频文件 (*.mp4 *.avi *.mov)")
+        if not video_path:
+            return
+        output_path, _ = QFileDialog.getSaveFileName(self, "保存检测视频", os.path.splitext(video_path)[0] + "_detected.mp4",
+                                                     "MP4 视频 (*.mp4);;AVI 视频 (*.avi)")
+        if not output_path:
+            return
+        self.export_job = VideoExportJob(self.worker, video_path, output_path, self.batch_size)
+        self.export_job.progress.connect(self.export_progress)
+        self.export_job.finished.connect(self.export_finished)
+        self.export_job.start()
+        self.statusBar().showMessage("正在导出视频…")
 
-                # 显示原始帧和检测帧
-                self.label1.setPixmap(pixmap1.scaled(self.label1.size(), Qt.KeepAspectRatio))
-                self.label2.set_image(pixmap2.scaled(self.label2.size(), Qt.KeepAspectRatio))
-        else:
-            # 如果是视频，播放完毕后释放资源
-            if self.video_capture is not None:
-                self.video_capture.release()
-            if self.camera_capture is not None:
-                self.camera_capture.release()
+    def export_progress(self, done, total):
+        if self.sender() is self.export_job:
+            self.statusBar().showMessage(f"导出视频中：{done}/{total} 帧")
+
+    def export_finished(self, count, elapsed):
+        job = self.sender()
+        if job is None or job is not self.export_job:
+            return  # 已取消的任务（关闭窗口时已经等它写完）
+        self.export_job = None
+        if job.error:
+            self.statusBar().clearMessage()
+            QMessageBox.critical(self, "错误", job.error)
+            return
+        speed = count / elapsed if elapsed > 0 else 0
+        self.statusBar().showMessage(f"导出完成：{count} 帧，耗时 {elapsed:.1f} 秒（{speed:.1f} FPS）")
+        QMessageBox.information(self, "导出完成", f"检测视频已保存到 {job.output_path}")
+
+    def open_streams(self):
+        """选择多路检测的视频文件、视频流地址或摄像头编号，每行一个"""
+        dialog = QDialog(self)
+        dialog.setWindowTitle("多路检测")
+        form = QFormLayout(dialog)
+        sources_edit = QPlainTextEdit("\n".join(self.stream_sources))
+        sources_edit.setPlaceholderText("每行一个：视频文件路径、RTSP 地址或摄像头编号（如 0）")
+        sources_edit.setMinimumSize(480, 200)
+        add_button = QPushButton("添加视频文件…")
 
-            # 停止定时器
-            self.timer.stop()
-            QMessageBox.information(self, "结束", "视频播放结束或摄像头停止")
+        def add_files():
+            file_names, _ = QFileDialog.getOpenFileNames(dialog, "选择视频文件", "", "视频文件 (*.mp4 *.avi *.mov)")
+            for file_name in file_names:
+                sources_edit.appendPlainText(file_name)
+
+        add_button.clicked.connect(add_files)
+        form.addRow(sources_edit)
+        form.addRow(add_button)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        form.addRow(buttons)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        sources = [line.strip() for line in sources_edit.toPlainText().splitlines() if line.strip()]
+        if sources:
+            self.stream_sources = sources
+            self.start_streams(sources)
+
+    def start_streams(self, sources):
+        """启动多路检测，摄像头在后台打开，视频文件在这里打开以便立即报告错误"""
+        self.stop_pipeline()
+        self.close_timeline()
+        self.prefetcher.cancel()
+        captures = []
+        for source in sources:
+            if source.isdigit():
+                captures.append(CameraSource(int(source), self.camera_backend, self.camera_resolution, self.camera_fps))
+                continue
+            capture = cv2.VideoCapture(source)
+            if not capture.isOpened():
+                for opened in captures:
+                    opened.release()
+                capture.release()
+                QMessageBox.critical(self, "错误", f"无法打开视频：{source}")
+                return
+            captures.append(capture)
+
+        # 多路检测时不再浏览图片：停止后台检测图片，禁用翻页，重新导入图片后恢复
+        self.stop_batch()
+        self.stop_folder()
+        self.prev_image_button.setEnabled(False)
+        self.next_image_button.setEnabled(False)
+        self.batch_button.setEnabled(False)
+        self.current_results = None
+        self.original_pixmap = None
+        self.annotated_pixmap = None
+        self.gallery.hide()
+        self.show_stream_grid(len(captures))
+        self.metrics.reset()
+        realtime = self.play_mode_box.currentIndex() == 0
+        self.multi_pipeline = MultiStreamPipeline(self.worker, captures, realtime=realtime, batch_size=min(len(captures), self.stream_batch_size))
+        self.stream_stats = self.multi_pipeline.stats
+        self.multi_pipeline.set_target_sizes([label.size() for label in self.stream_labels])
+        self.multi_pipeline.frame_ready.connect(self.stream_play)
+        self.multi_pipeline.finished.connect(self.video_finished)
+        self.multi_pipeline.start()
+        self.stop_button.setEnabled(True)
+
+    def show_stream_grid(self, count):
+        """count 大于 0 时用接近正方形的网格显示 count 路画面，为 0 时恢复左右两个标签"""
+        for label in self.stream_labels:
+            self.stream_grid_layout.removeWidget(label)
+            label.deleteLater()
+        self.stream_labels = []
+        columns = int(np.ceil(np.sqrt(count)))
+        for index in range(count):
+            label = QLabel()
+            label.setAlignment(Qt.AlignCenter)
+            label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)  # 画面尺寸不影响布局，格子平分窗口
+            label.setStyleSheet('border:3px solid #6950a1; background-color: black; color: white;')
+            label.setText(f"第 {index + 1} 路")
+            self.stream_grid_layout.addWidget(label, index // columns, index % columns)
+            self.stream_labels.append(label)
+        self.label1.setVisible(not count)
+        self.label2.setVisible(not count)
+        self.stream_grid.setVisible(bool(count))
+        self.centralWidget().layout().activate()  # 立即应用布局，格子尺寸才是最终的显示尺寸
+
+    def stream_play(self, index, display, results, timings):
+        """显示多路检测中一路渲染好的检测帧"""
+        pipeline = self.sender()
+        if pipeline is not self.multi_pipeline:
+            return
+        self.current_results = results
+        start = time.perf_counter()
+        pixmap = self.to_pixmap(display)
+        pipeline.release_buffer(index, display)
+        display_start = time.perf_counter()
+        self.stream_labels[index].setPixmap(pixmap)
+        now = time.perf_counter()
+        timings['convert'] = (display_start - start) * 1000
+        timings['display'] = (now - display_start) * 1000
+        timings['latency'] = (now - timings['captured']) * 1000
+        self.metrics.record(f'stream{index + 1}', timings)
+        self.statusBar().showMessage(pipeline.stats_text())
 
     def start_camera(self):
-        self.camera_capture = cv2.VideoCapture(0)
-        self.timer.start(30)
+        """在后台打开摄像头，打开期间界面保持响应"""
+        self.stop_pipeline()
+        self.close_timeline()
+        self.camera_source = CameraSource(self.camera_index, self.camera_backend, self.camera_resolution, self.camera_fps)
+        self.camera_source.opened.connect(self.camera_opened)
+        self.camera_source.open()
+        self.statusBar().showMessage("正在打开摄像头…")
+        self.stop_button.setEnabled(True)
+
+    def camera_opened(self, ok):
+        camera_source = self.sender()
+        if camera_source is not self.camera_source:
+            return  # 已经取消
+        self.camera_source = None
+        if not ok:
+            self.statusBar().clearMessage()
+            QMessageBox.critical(self, "错误", "无法打开摄像头，请检查设备是否连接或被其他程序占用")
+            return
+        self.start_pipeline(camera_source, live=True)
 
     def resizeEvent(self, event):
         """当窗口大小发生变化时，重新加载图片以防止图片变花"""
-        if self.original_image is not None and self.annotated_image is not None:
-            self.show_images(self.original_image, self.annotated_image)
+        if self.pipeline is not None:
+            self.pipeline.set_target_size(self.label1.size(), self.label2.size())
+        if self.multi_pipeline is not None:
+            self.multi_pipeline.set_target_sizes([label.size() for label in self.stream_labels])
+        if self.original_pixmap is not None and self.annotated_pixmap is not None:
+            # 拖动过程中只做快速缩放，停止拖动后由 resize_timer 做高质量缩放
+            self.scale_images(Qt.FastTransformation)
+            self.resize_timer.start()
 # -------------------------------------------
-    def show_images(self, original, annotated):
-        """显示原始和检测后的图片"""
-        # 显示原始图片
-        image_rgb = cv2.cvtColor(original, cv2.COLOR_BGR2RGB)
-        height1, width1, channel1 = image_rgb.shape
-        bytesPerLine1 = 3 * width1
-        qimage1 = QImage(image_rgb.data, width1, height1, bytesPerLine1, QImage.Format_RGB888)
-        pixmap1 = QPixmap.fromImage(qimage1)
-        self.label1.setPixmap(pixmap1.scaled(self.label1.size(), Qt.KeepAspectRatio))
-
-        # 显示检测后的图片
-        annotated_rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
-        height2, width2, channel2 = annotated_rgb.shape
-        bytesPerLine2 = 3 * width2
-        qimage2 = QImage(annotated_rgb.data, width2, height2, bytesPerLine2, QImage.Format_RGB888)
-        pixmap2 = QPixmap.fromImage(qimage2)
-        self.label2.set_image(pixmap2.scaled(self.label2.size(), Qt.KeepAspectRatio))
+    def show_images(self, original, annotated, timings=None):
+        """显示原始和检测后的图片，timings 不为 None 时记录转换和显示的耗时"""
+        # 只在这里把原始分辨率的图片转换一次 QPixmap（fromImage 会复制数据）
+        start = time.perf_counter()
+        self.original_pixmap = self.to_pixmap(original)
+        self.annotated_pixmap = self.to_pixmap(annotated)
+        display_start = time.perf_counter()
+        self.scale_images(Qt.SmoothTransformation)
+        if timings is not None:
+            timings['convert'] = (display_start - start) * 1000
+            timings['display'] = (time.perf_counter() - display_start) * 1000
+
+    @staticmethod
+    def to_pixmap(image):
+        """BGR 图片转换为 QPixmap，直接使用 BGR888 格式，不需要 cvtColor"""
+        height, width, channel = image.shape
+        qimage = QImage(image.data, width, height, image.strides[0], QImage.Format_BGR888)
+        return QPixmap.fromImage(qimage)
+
+    def scale_images(self, transform):
+        """把缓存的原始分辨率图片缩放到当前标签尺寸"""
+        if self.original_pixmap is None or self.annotated_pixmap is None:
+            return
+        self.label1.setPixmap(self.original_pixmap.scaled(self.label1.size(), Qt.KeepAspectRatio, transform))
+        self.label2.set_image(self.annotated_pixmap.scaled(self.label2.size(), Qt.KeepAspectRatio, transform))
 
     def show_current_image(self):
         """显示当前选定的图片"""
         if 0 <= self.current_image_index < len(self.image_paths):
             image_path = self.image_paths[self.current_image_index]
-            self.original_image = cv2.imread(image_path)
+            timings = {'frame': self.current_image_index}
+            start = time.perf_counter()
+            self.prefetcher.pause()
+            self.original_image = self.prefetcher.take_image(image_path)
+            if self.original_image is None:
+                self.original_image = cv2.imread(image_path)
+            timings['decode'] = (time.perf_counter() - start) * 1000
             if self.original_image is not None:
-                self.current_results = self.worker.detect_image(self.original_image)
-                if self.current_results:
-                    self.annotated_image = self.current_results[0].plot()
-                    self.show_images(self.original_image, self.annotated_image)
+                start = time.perf_counter()
+                key = self.worker.cache_key(image_path)
+                self.prefetcher.wait_for(key)
+                detections = self.detection_cache.get(key)
+                timings['cache'] = (time.perf_counter() - start) * 1000  # 包括等待正在预取的这张图片
+                if detections is None:
+                    start = time.perf_counter()
+                    detections = Detections.from_results(self.worker.detect_image(self.original_image)[0])
+                    self.detection_cache.put(key, detections)
+                    timings['infer'] = (time.perf_counter() - start) * 1000
+                # 缓存原始结果，显示过滤后的结果
+                self.current_detections = detections
+                detections = self.worker.filter_detections(detections)
+                self.current_results = [detections.to_results(self.original_image, image_path)]
+                self.image_stats.update(detections, self.current_image_index, unique=True)
+                self.thumbnail_model.set_count(self.current_image_index, len(detections.cls))
+                start = time.perf_counter()
+                self.annotated_image = self.worker.annotate(self.original_image, detections)
+                timings['plot'] = (time.perf_counter() - start) * 1000
+                self.show_images(self.original_image, self.annotated_image, timings)
+                self.metrics.record('image', timings)
+            index = self.thumbnail_model.index(self.current_image_index)
+            if self.gallery.currentIndex() != index:
+                self.gallery.setCurrentIndex(index)  # 用上一张/下一张切换时同步选中的缩略图
+            # 当前图片显示完后，继续预取前后的图片
+            self.prefetcher.request(self.image_paths, self.current_image_index)
     
     def show_prev_image(self):
         """显示上一张图片"""
@@ -362,30 +3937,29 @@ class MainWindow(QMainWindow):
             self.show_current_image()
 # -------------------------------------------   
     def show_detected_objects(self):
-        """显示检测到的物体统计信息"""
+        """显示当前画面的物体统计，以及整段视频或整个图片集的累计统计"""
         if self.current_results:
-            det_info = self.current_results[0].boxes.cls  # 获取检测到的类别信息
+            det_info = Detections.from_results(self.current_results[0]).cls  # 获取检测到的类别信息
             object_count = len(det_info)  # 总物体数量
             object_info = f"识别物体总数：{object_count}\n"  # 初始化输出信息
-            object_dict = {}  # 存储每种物体的计数
             class_names_dict = self.current_results[0].names  # 类别名称映射
 
-            # 统计每种物体的数量
-            for class_id in det_info:
-                class_name = class_names_dict[int(class_id)]  # 获取类别名称
-                if class_name in object_dict:
-                    object_dict[class_name] += 1
-                else:
-                    object_dict[class_name] = 1
-
-            # 排序物体统计结果，按数量降序
-            sorted_objects = sorted(object_dict.items(), key=lambda x: x[1], reverse=True)
-
-            # 添加物体统计信息，仅在首次添加 "其中"
-            if sorted_objects:
+            # 统计每种物体的数量，按数量降序
+            counts = np.bincount(det_info, minlength=max(class_names_dict) + 1)
+            if object_count:
                 object_info += "其中：\n"
-            for obj_name, obj_count in sorted_objects:
-                object_info += f"{obj_name}: {obj_count}\n"
+            for class_id in np.argsort(-counts, kind='stable')[:np.count_nonzero(counts)]:
+                object_info += f"{class_names_dict[int(class_id)]}: {counts[class_id]}\n"
+
+            # 附加整段视频或整个图片集的累计统计（处理过程中已增量更新，不重新扫描）
+            if not self.stream_grid.isHidden():
+                for index, stats in enumerate(self.stream_stats):
+                    object_info += stats.summary_text(f"第 {index + 1} 路", "帧")
+            elif self.stats_is_video:
+                if self.video_stats is not None:
+                    object_info += self.video_stats.summary_text("整段视频", "帧")
+            elif self.image_stats is not None and len(self.image_paths) > 1:
+                object_info += self.image_stats.summary_text(f"图片集 {len(self.image_paths)} 张中", "张")
 
             # 显示结果
             self.show_message_box("识别结果", object_info)
@@ -393,6 +3967,160 @@ class MainWindow(QMainWindow):
             # 如果没有检测到物体，显示提示
             self.show_message_box("识别结果", "未检测到物体")
     
+    def query_detections(self):
+        """按类别、数量、置信度查询检测结果库，可以只浏览查询到的图片"""
+        names = self.worker.model.names
+        dialog = QDialog(self)
+        dialog.setWindowTitle("查询检测结果")
+        form = QFormLayout(dialog)
+        class_box = QComboBox()
+        for class_id, name in names.items():
+            class_box.addItem(name, class_id)
+        count_box = QSpinBox()
+        count_box.setRange(1, 1000)
+        conf_box = QDoubleSpinBox()
+        conf_box.setRange(0, 1)
+        conf_box.setSingleStep(0.05)
+        conf_box.setValue(0.5)
+        form.addRow("类别：", class_box)
+        form.addRow("至少数量：", count_box)
+        form.addRow("置信度大于：", conf_box)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        form.addRow(buttons)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+
+        self.detection_store.commit()
+        params = self.worker.result_params()
+        paths = [path for path in self.detection_store.query_images(
+            self.worker.model_hash, params, class_box.currentData(), count_box.value(), conf_box.value()) if os.path.exists(path)]
+        condition = f"{class_box.currentText()} ≥ {count_box.value()} 个（置信度 > {conf_box.value():.2f}）"
+        if not paths:
+            self.show_message_box("查询结果", f"没有找到 {condition} 的图片")
+            return
+        answer = QMessageBox.question(self, "查询结果", f"找到 {len(paths)} 张 {condition} 的图片，是否只浏览这些图片？")
+        if answer == QMessageBox.Yes:
+            self.open_image_set(paths)
+
+    def show_filter_panel(self):
+        """打开过滤面板（非模态），修改任意一项立即生效"""
+        if self.filter_panel is not None:
+            self.filter_panel.show()
+            self.filter_panel.raise_()
+            self.filter_panel.activateWindow()
+            return
+        current = self.worker.display_filter
+        panel = QDialog(self)
+        panel.setWindowTitle("检测结果过滤")
+        form = QFormLayout(panel)
+        conf_box = QDoubleSpinBox()
+        conf_box.setRange(0.01, 1)
+        conf_box.setSingleStep(0.05)
+        conf_box.setValue(current.conf)
+        iou_box = QDoubleSpinBox()
+        iou_box.setRange(0.05, 0.95)
+        iou_box.setSingleStep(0.05)
+        iou_box.setValue(current.iou)
+        max_det_box = QSpinBox()
+        max_det_box.setRange(1, 1000)
+        max_det_box.setValue(current.max_det)
+        class_list = QListWidget()
+        for class_id, name in self.worker.model.names.items():
+            item = QListWidgetItem(name)
+            item.setData(Qt.UserRole, class_id)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if current.classes is None or class_id in current.classes else Qt.Unchecked)
+            class_list.addItem(item)
+
+        def apply(*_):
+            items = [class_list.item(row) for row in range(class_list.count())]
+            classes = [item.data(Qt.UserRole) for item in items if item.checkState() == Qt.Checked]
+            self.apply_filter(DetectionFilter(conf_box.value(), iou_box.value(),
+                                              None if len(classes) == len(items) else classes, max_det_box.value()))
+
+        def check_all(state):
+            class_list.blockSignals(True)  # 逐项修改时不重复绘制，全部改完后应用一次
+            for row in range(class_list.count()):
+                class_list.item(row).setCheckState(state)
+            class_list.blockSignals(False)
+            apply()
+
+        # 数值框输入时每个按键都会触发 valueChanged，停顿一会儿再应用，避免低于推理下限的中间值反复触发重新检测
+        apply_timer = QTimer(panel)
+        apply_timer.setSingleShot(True)
+        apply_timer.setInterval(400)
+        apply_timer.timeout.connect(apply)
+
+        def apply_now():
+            if apply_timer.isActive():  # 按回车或离开输入框时不再等待
+                apply_timer.stop()
+                apply()
+
+        for box in (conf_box, iou_box, max_det_box):
+            box.valueChanged.connect(apply_timer.start)
+            box.editingFinished.connect(apply_now)
+        class_list.itemChanged.connect(apply)
+        check_buttons = QHBoxLayout()
+        for text, state in (("全选", Qt.Checked), ("全不选", Qt.Unchecked)):
+            button = QPushButton(text)
+            button.clicked.connect(lambda _, state=state: check_all(state))
+            check_buttons.addWidget(button)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(panel.close)
+        form.addRow("置信度不低于：", conf_box)
+        form.addRow("NMS IoU 阈值：", iou_box)
+        form.addRow("最多显示数量：", max_det_box)
+        form.addRow("显示的类别：", class_list)
+        form.addRow(check_buttons)
+        form.addRow(buttons)
+        self.filter_panel = panel
+        panel.show()
+
+    def apply_filter(self, display_filter):
+        """应用新的显示过滤：缓存的原始结果够用时立即重新绘制，不推理；
+        置信度低于推理下限或 IoU 更宽松时推理参数改变，和切换切片设置一样重新检测"""
+        changed = self.worker.set_display_filter(display_filter)
+        self.thumbnail_model.reload_counts()
+        self.reset_stats()
+        if not changed:
+            self.rerender_current()
+            return
+        self.prefetcher.cancel()
+        if self.video_seeker is not None:
+            self.stop_pipeline()
+        self.reopen_timeline()
+        if self.pipeline is None and self.video_seeker is None and self.image_paths:
+            self.show_current_image()
+
+    def reset_stats(self):
+        """过滤条件改变后清空累计统计，不同阈值下的结果不混在一起；之后检测或翻看到的图片、播放的帧按新的条件重新计入"""
+        names = self.worker.model.names
+        if self.image_stats is not None:
+            self.image_stats = DetectionStats(names)
+        if self.pipeline is not None:
+            self.pipeline.stats = DetectionStats(names)  # 整体替换，推理线程下一帧起更新新的统计
+            self.video_stats = self.pipeline.stats
+        else:
+            self.video_stats = None
+        if self.multi_pipeline is not None:
+            self.multi_pipeline.stats = [DetectionStats(names) for _ in self.multi_pipeline.stats]
+            self.stream_stats = self.multi_pipeline.stats
+
+    def rerender_current(self):
+        """浏览图片或视频暂停时，用当前画面的原始检测结果按新的过滤条件重新绘制；正在播放时下一帧就会使用新的条件"""
+        if self.pipeline is not None or self.multi_pipeline is not None or self.original_image is None or self.current_detections is None:
+            return
+        detections = self.worker.filter_detections(self.current_detections)
+        self.current_results = [detections.to_results(self.original_image)]
+        self.annotated_image = self.worker.annotate(self.original_image, detections)
+        self.show_images(self.original_image, self.annotated_image)
+        if self.video_seeker is None and 0 <= self.current_image_index < len(self.image_paths):
+            self.thumbnail_model.set_count(self.current_image_index, len(detections.cls))
+            if self.image_stats is not None:
+                self.image_stats.update(detections, self.current_image_index, unique=True)
+
     def show_message_box(self, title, message):
         msg_box = QMessageBox(self)
         msg_box.setWindowTitle(title)
@@ -400,22 +4128,50 @@ class MainWindow(QMainWindow):
         msg_box.exec_()
 # -------------------------------------------
     def stop_processing(self):
-        self.timer.stop()
-        if self.video_capture:
-            self.video_capture.release()
-        if self.camera_capture:
-            self.camera_capture.release()
+        self.stop_pipeline()
+        self.close_timeline()
+        self.stop_folder()
         self.label1.clear()
         self.label2.clear()
+        self.current_detections = None
 
     def exit_application(self):
-        sys.exit()
+        self.close()  # 资源在 closeEvent 中释放，与点击窗口的关闭按钮相同
+
+    def closeEvent(self, event):
+        """关闭窗口时停止后台线程，把还没有提交的检测结果写入数据库"""
+        if self.closed:
+            event.accept()
+            return
+        self.closed = True
+        if self.preload_thread.is_alive():
+            self.preload_thread.join()  # torch 导入到一半时退出解释器可能崩溃
+        if self.model_thread is not None:
+            self.model_thread.join()  # 导出到一半退出会留下不完整的导出缓存
+        self.stop_pipeline(wait=True)
+        self.close_timeline(wait=True)  # 等后台线程保存视频的逐帧检测结果
+        self.stop_batch(wait=True)
+        self.stop_folder(wait=True)
+        if self.export_job is not None:
+            self.export_job.stop()
+            self.export_job.wait()  # 等编码线程写完文件尾，导出到一半的视频也能播放
+            self.export_job = None  # 之后到达的 finished 信号不再弹出提示
+        self.metrics.stop_export()
+        self.prefetcher.close()
+        self.thumbnail_loader.close()
+        self.detection_store.close()
+        event.accept()
 # -------------------------------------------
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
+    if '--startup-time' in sys.argv:
+        # 只测量启动耗时，推理库导入完成后退出，用于检查启动速度有没有变慢
+        QTimer.singleShot(0, lambda: print(f"窗口显示：{time.perf_counter() - STARTUP_TIME:.2f} 秒"))
+        # 先关闭窗口（closeEvent 中等待后台线程、关闭数据库），再退出事件循环
+        window.libraries_ready.connect(lambda elapsed: (print(f"推理库加载完成：{elapsed:.2f} 秒"), window.close(), app.quit()))
     sys.exit(app.exec_())
 
 # -------------------------------------------------